@@ -0,0 +1,74 @@
+"""!
+@file bench_host.py
+This file contains the stand-ins with which the benchmarks in this
+directory, such as @c share_bench.py, run under CPython on a PC. It is
+only imported when @c utime can't be, so it needn't be copied to the
+board.
+
+The stand-ins supply the calls which @c task_share.py and @c cotask.py make:
+@c utime's tick functions read the PC's clock rather than a simulated one,
+so the benchmarks measure real time (unlike @c on_pc/vclock.py, which the
+host runner uses to simulate the board's time), @c micropython's
+decorators do nothing, and @c ptr8 is a byte view of a buffer. Code which
+MicroPython compiles to machine code with @c native or @c viper runs as
+ordinary Python, so CPython times show how much work each call does, not
+how long it takes on the board.
+"""
+
+import builtins
+import sys
+import time
+
+
+class _UTime:
+    """!
+    @brief   A stand-in for @c utime whose ticks wrap as the board's do.
+    """
+    _PERIOD = 1 << 30
+
+    def ticks_us(self):
+        return int(time.perf_counter() * 1000000) & (self._PERIOD - 1)
+
+    def ticks_ms(self):
+        return int(time.perf_counter() * 1000) & (self._PERIOD - 1)
+
+    def ticks_add(self, ticks, delta):
+        return (ticks + delta) & (self._PERIOD - 1)
+
+    def ticks_diff(self, end, start):
+        half = self._PERIOD >> 1
+        return ((end - start + half) & (self._PERIOD - 1)) - half
+
+    def sleep_us(self, usec):
+        time.sleep(usec / 1000000)
+
+    def sleep_ms(self, msec):
+        time.sleep(msec / 1000)
+
+
+class _MicroPython:
+    """!
+    @brief   A stand-in for @c micropython whose decorators do nothing.
+    """
+
+    def native(self, fun):
+        return fun
+
+    def viper(self, fun):
+        return fun
+
+    def const(self, value):
+        return value
+
+
+def install():
+    """!
+    Put the stand-ins where the modules being benchmarked find them.
+    @returns A tuple holding the stand-ins for @c utime and @c micropython
+    """
+    utime = _UTime()
+    micropython = _MicroPython()
+    sys.modules['utime'] = utime
+    sys.modules['micropython'] = micropython
+    builtins.ptr8 = lambda buf: memoryview(buf).cast('B')
+    return utime, micropython
@@ -1,6 +1,6 @@
 
 
-from time import ticks_diff
+import timestamp
 class CLMotorController():
     """
     A closed-loop Proportional-Integral controller object that is used to set a desired wheel speed in mm/s
@@ -18,7 +18,7 @@ class CLMotorController():
         target : int
             Desired motor speed in mm/s
         old_ticks : int
-            System clock counter in microseconds
+            Timestamp from timestamp.stamp() in microseconds
         Kp : float, optional
             Proportional gain constant. The default is 1.
         Ki : float, optional
@@ -170,7 +170,7 @@ class CLMotorController():
         
         Parameters
         ----------
-            new_ticks (int): Timer reading in microseconds
+            new_ticks (int): Time the reading was taken, from timestamp.stamp(), in microseconds
             new_state (int): Motor's encoder reading, in ticks
             
         Returns:
@@ -191,7 +191,7 @@ class CLMotorController():
             self.old_ticks = new_ticks
             # print(f"init!: self")
         else:
-            self.dt = ticks_diff(new_ticks, self.old_ticks)/1E6
+            self.dt = timestamp.diff(new_ticks, self.old_ticks)/1E6
             self.acc_error = self.use_integral*(self.acc_error + self.error*self.dt) #Integral error, equivalent to degrees
             self.old_ticks = new_ticks
         # do control algorithm
@@ -227,7 +227,7 @@ class IRController():
         target : float
             Desired centroid setpoint for the IR sensor array.
          old_ticks : int
-             System clock counter in microseconds
+             Timestamp from timestamp.stamp() in microseconds
         K3 : float
             Sensitivity or scaling factor used to translate controller output to a wheel speed difference in mm/s.
         Kp : float, optional
@@ -350,7 +350,7 @@ class IRController():
         Determines a necessary adjustment to locate the centroid of the sensor array at the specified target value
         
         Args:
-            new_ticks (int): Timer reading in microseconds
+            new_ticks (int): Time the reading was taken, from timestamp.stamp(), in microseconds
             new_state (float): Current centroid location of the line in the sensor array
             
         Returns:
@@ -361,7 +361,7 @@ class IRController():
         if(self.old_ticks == 0):
             self.old_ticks = new_ticks
         else:
-            self.dt = ticks_diff(new_ticks, self.old_ticks)/1E6 # time step passed
+            self.dt = timestamp.diff(new_ticks, self.old_ticks)/1E6 # time step passed
             self.acc_error = self.use_integral*(self.acc_error + self.error*self.dt) #Integral error, equivalent to mm of centroid
             self.old_ticks = new_ticks
         # do control algorithm
@@ -388,7 +388,7 @@ class PositionController():
         target : float
             Desired heading angle, in radians.
          old_ticks : int
-             System clock counter in microseconds
+             Timestamp from timestamp.stamp() in microseconds
         K3 : float
             Sensitivity or scaling factor used to translate controller output to a wheel speed difference in mm/s.
         Kp : float, optional
@@ -516,7 +516,7 @@ class PositionController():
         Determines a necessary adjustment to bring heading angle to specified target value
         
         Args:
-            new_ticks (int): Timer reading in microseconds
+            new_ticks (int): Time the reading was taken, from timestamp.stamp(), in microseconds
             new_state (float): Calculated heading angle difference needed to point in the direction of the desired endpoints
             
         Returns:
@@ -529,7 +529,7 @@ class PositionController():
             self.old_ticks = new_ticks
             # print(f"init!: self")
         else:
-            self.dt = ticks_diff(new_ticks, self.old_ticks)/1E6 # time step passed
+            self.dt = timestamp.diff(new_ticks, self.old_ticks)/1E6 # time step passed
             self.acc_error = self.use_integral*(self.acc_error + self.error*self.dt) #Integral error, equivalent to mm of centroid
             self.old_ticks = new_ticks
         # do control algorithm
@@ -27,9 +27,77 @@
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
+import array                           # Compact arrays for histograms
 import gc                              # Memory allocation garbage collector
 import utime                           # Micropython version of time library
 import micropython                     # This shuts up incorrect warnings
+import struct                          # Packing of binary trace dumps
+try:
+    from pyb import wfi                # Sleep until the next interrupt
+except ImportError:
+    wfi = None                         # Not on a Pyboard; use utime instead
+
+
+## The longest time in microseconds which @c TaskList.idle_sched() sleeps
+#  at once when untimed tasks might be started by an interrupt and the CPU
+#  can't be put to sleep until the next interrupt
+IDLE_SLICE = 1000
+
+## The number of bins in the run time and lateness histograms kept for each
+#  profiled task. Bin 0 counts times of 0 us, and bin @c n counts times from
+#  2<sup>n-1</sup> up to 2<sup>n</sup> microseconds; the last bin also counts
+#  all longer times.
+HIST_BINS = 24
+
+## The time in microseconds a garbage collection is assumed to take, by
+#  @c TaskList.idle_sched(), before the first one has been measured
+GC_FIRST_ESTIMATE = 5000
+
+## The extra idle time in microseconds, beyond the estimated time of a
+#  garbage collection, which must be left before the next task is due for
+#  @c TaskList.idle_sched() to collect garbage
+GC_MARGIN = 500
+
+## The number of state transitions kept in a task's trace when tracing is
+#  turned on with @c trace=True. Once the trace is full, each new transition
+#  takes the place of the oldest one.
+TRACE_DEPTH = 256
+
+## The format of the header which starts each task's record in a binary
+#  trace dump: the bytes @c TRC1, the length of the task's name, the number
+#  of transitions in the record and the number of earlier transitions which
+#  were overwritten. The name follows, then an array of 32-bit transition
+#  times from @c utime.ticks_us(), then an array of 16-bit from- and to-state
+#  pairs, all little-endian.
+TRACE_HEADER = '<4sHII'
+
+## Overrun policy: a task which is more than a period late is run once for
+#  each period which has passed, back to back, until it has caught up
+CATCH_UP = 0
+
+## Overrun policy: a late task is run once, and the releases which were
+#  missed are skipped; later runs stay on the task's original time grid
+SKIP = 1
+
+## Overrun policy: a late task is run once, and its next run is set one
+#  period after the current time, starting a new time grid
+REALIGN = 2
+
+## The task which is running, or @c None between task runs. Shares use it to
+#  record which task wrote to them last.
+current_task = None
+
+
+## Find the bin of a log<sub>2</sub> histogram into which a time falls.
+#  @param usec A time in microseconds, zero or more
+#  @return The index of the histogram bin which counts this time
+@micropython.native
+def _log2_bin(usec):
+    bin_num = 0
+    while usec > 0 and bin_num < HIST_BINS - 1:
+        usec >>= 1
+        bin_num += 1
+    return bin_num
 
 
 ## Implements multitasking with scheduling and some performance logging.
@@ -81,12 +149,27 @@ class Task:
     #         The time can be given in a @c float or @c int; it will be 
     #         converted to microseconds for internal use by the scheduler.
     #  @param profile Set to @c True to enable run-time profiling 
-    #  @param trace Set to @c True to generate a list of transitions between
-    #         states. @b Note: This slows things down and allocates memory.
+    #  @param trace Set to @c True to keep a trace of the last
+    #         @c TRACE_DEPTH transitions between states, or to a number to
+    #         keep that many. The trace's memory is all allocated here, so
+    #         tracing can be left on indefinitely. States must be integers
+    #         from 0 to 65535 to be traced.
     #  @param shares A list or tuple of shares and queues used by this task.
     #         If no list is given, no shares are passed to the task
+    #  @param overrun What to do when a timed task is found to be more than
+    #         one period late: @c CATCH_UP (the default), @c SKIP or
+    #         @c REALIGN
+    #  @param deadline The time in milliseconds after each release by which
+    #         a run of the task should be finished. It defaults to the period
+    #         for a timed task, or to zero (as soon as possible) for a task
+    #         started by @c go()
+    #  @param mem_profile Set to @c True to record how many bytes of heap
+    #         memory each run of the task allocates. Each run then calls
+    #         @c gc.mem_alloc() twice, which scans the heap's allocation
+    #         table, so this is best turned on only for tasks being checked
     def __init__(self, run_fun, name="NoName", priority=0, period=None,
-                 profile=False, trace=False, shares=()):
+                 profile=False, trace=False, shares=(), overrun=CATCH_UP,
+                 deadline=None, mem_profile=False):
         # The function which is run to implement this task's code. Since it 
         # is a generator, we "run" it here, which doesn't actually run it but
         # gets it going as a generator which is ready to yield values
@@ -114,20 +197,62 @@ class Task:
             self.period = period
             self._next_run = None
 
+        # How the next run time is found when the task has fallen more than
+        # a period behind
+        self._overrun = overrun
+
+        ## The relative deadline in microseconds, the time after each release
+        #  by which the run of the task should be finished. It is used by the
+        #  earliest-deadline-first scheduler @c TaskList.edf_sched().
+        # A deadline not given follows the period when it is changed
+        self._deadline_given = deadline != None
+        if deadline != None:
+            self.deadline = int(deadline * 1000)
+        elif self.period != None:
+            self.deadline = self.period
+        else:
+            self.deadline = 0
+
+        # The time at which the task was last released or started by
+        # @c go(), and the time by which that run should be finished
+        self._released = None
+        self._abs_deadline = None
+
+        # For a task started by a @c TimerRelease, the time at which the
+        # timer will next start it
+        self._next_release = None
+
         # Flag which causes the task to be profiled, in which the execution
         #  time of the @c run() method is measured and basic statistics kept. 
         self._prof = profile
+
+        # Flag which causes the memory allocated by each run to be measured
+        self._mem_prof = mem_profile
+
+        # Histograms of run durations and of lateness, allocated now so that
+        # they can be updated while the task runs without allocating memory
+        if profile:
+            self._dur_hist = array.array('L', [0] * HIST_BINS)
+            self._late_hist = array.array('L', [0] * HIST_BINS)
+        else:
+            self._dur_hist = None
+            self._late_hist = None
         self.reset_profile()
 
         # The previous state in which the task last ran. It is used to watch
         # for and track state transitions.
         self._prev_state = 0
 
-        # If transition tracing has been enabled, create an empty list in 
-        # which to store transition (time, to-state) stamps
-        self._trace = trace
-        self._tr_data = []
-        self._prev_time = utime.ticks_us()
+        # If transition tracing has been enabled, create a ring of arrays in
+        # which to store the time of each transition and the states from and
+        # to which it went. The number of transitions the ring can hold is
+        # kept in _trace, which is zero if the task isn't traced
+        if trace is True:
+            trace = TRACE_DEPTH
+        self._trace = int(trace)
+        self._tr_time = array.array('I', [0] * self._trace)
+        self._tr_states = array.array('H', [0] * (2 * self._trace))
+        self.reset_trace()
 
         ## Flag which is set true when the task is ready to be run by the
         #  scheduler
@@ -142,52 +267,93 @@ class Task:
     #  @return @c True if the task ran or @c False if it did not
     def schedule(self) -> bool:
         if self.ready():
-
-            # Reset the go flag for the next run
-            self.go_flag = False
-
-            # If profiling, save the start time
-            if self._prof:
-                stime = utime.ticks_us()
-
-            # Run the method belonging to the state which should be run next
-            curr_state = next(self._run_gen)
-
-            # If profiling or tracing, save timing data
-            if self._prof or self._trace:
-                etime = utime.ticks_us()
-
-            # If profiling, save timing data
-            if self._prof:
-                self._runs += 1
-                runt = utime.ticks_diff(etime, stime)
-                if self._runs > 2:
-                    self._run_sum += runt
-                    if runt > self._slowest:
-                        self._slowest = runt
-
-            # If transition logic tracing is on, record a transition; if not,
-            # ignore the state. If out of memory, switch tracing off and 
-            # run the memory allocation garbage collector
-            if self._trace:
-                try:
-                    if curr_state != self._prev_state:
-                        self._tr_data.append(
-                            (utime.ticks_diff(etime, self._prev_time),
-                             curr_state))
-                except MemoryError:
-                    self._trace = False
-                    gc.collect()
-
-                self._prev_state = curr_state
-                self._prev_time = etime
-
+            self._run()
             return True
 
         else:
             return False
 
 
+    ## This method runs the task's generator once, up to its next @c yield(),
+    #  and records profiling and trace data. It is called by @c schedule()
+    #  once the task has been found ready, or directly by a scheduler such as
+    #  @c TaskList.dl_sched() which has already released the task.
+    def _run(self):
+        global current_task
+
+        # Reset the go flag for the next run
+        self.go_flag = False
+
+        # If profiling, save the start time and record how long after its
+        # release time the task has started
+        if self._prof:
+            stime = utime.ticks_us()
+            if self._released != None:
+                late = utime.ticks_diff(stime, self._released)
+                self._late_sum += late
+                self._late_hist[_log2_bin(late)] += 1
+                if late > self._latest:
+                    self._latest = late
+                if late < self._soonest:
+                    self._soonest = late
+
+        # Run the method belonging to the state which should be run next,
+        # measuring the heap memory it allocates if asked to. The task is
+        # current only while its code runs, even if the code raises an error
+        current_task = self
+        try:
+            if self._mem_prof:
+                alloc = gc.mem_alloc()
+                curr_state = next(self._run_gen)
+                alloc = gc.mem_alloc() - alloc
+            else:
+                curr_state = next(self._run_gen)
+        finally:
+            current_task = None
+
+        # If the heap shrank, the garbage collector ran during the run, so
+        # the amount allocated isn't known
+        if self._mem_prof:
+            if alloc < 0:
+                self._gc_runs += 1
+            else:
+                self._alloc_runs += 1
+                self._alloc_sum += alloc
+                if alloc > self._alloc_max:
+                    self._alloc_max = alloc
+
+        # If profiling or tracing, save timing data
+        if self._prof or self._trace:
+            etime = utime.ticks_us()
+
+        # If profiling, save timing data
+        if self._prof:
+            self._runs += 1
+            runt = utime.ticks_diff(etime, stime)
+            if (self._abs_deadline != None
+                    and utime.ticks_diff(etime, self._abs_deadline) > 0):
+                self._dl_missed += 1
+            if self._runs > 2:
+                self._run_sum += runt
+                self._dur_hist[_log2_bin(runt)] += 1
+                if runt > self._slowest:
+                    self._slowest = runt
+
+        # If transition logic tracing is on, record a transition over the
+        # oldest one in the ring; if not, ignore the state
+        if self._trace:
+            if curr_state != self._prev_state:
+                idx = self._tr_next
+                self._tr_time[idx] = etime
+                self._tr_states[2 * idx] = self._prev_state
+                self._tr_states[2 * idx + 1] = curr_state
+                idx += 1
+                self._tr_next = 0 if idx == self._trace else idx
+                self._tr_count += 1
+
+            self._prev_state = curr_state
+
+
     ## This method checks if the task is ready to run.
     #  If the task runs on a timer, this method checks what time it is; if not,
     #  this method checks the flag which indicates that the task is ready to
@@ -200,65 +366,192 @@ class Task:
         if self.period != None:
             late = utime.ticks_diff(utime.ticks_us(), self._next_run)
             if late > 0:
-                self.go_flag = True
-                self._next_run = utime.ticks_diff(self.period, 
-                                                  -self._next_run)
-
-                # If keeping a latency profile, record the data
-                if self._prof:
-                    self._late_sum += late
-                    if late > self._latest:
-                        self._latest = late
+                self._release(late)
 
         # If the task doesn't use a timer, we rely on go_flag to signal ready
         return self.go_flag
 
 
+    ## This method releases a timed task whose run time has come: it sets
+    #  the go flag, finds the next run time, and saves the time of the
+    #  release so that @c _run() can measure how late the task starts.
+    #  Normally the next run time is one period on; if the task is a period
+    #  or more late, the overrun policy decides. A release counts as missed
+    #  if it could not be run before the next one came due.
+    #  @param late How many microseconds past its run time the task is
+    @micropython.native
+    def _release(self, late):
+        self.go_flag = True
+        period = self.period
+        released = self._next_run
+        if late < period:
+            self._next_run = utime.ticks_diff(period, -self._next_run)
+        elif self._overrun == SKIP:
+            missed = late // period
+            self._missed += missed
+            released = utime.ticks_add(released, missed * period)
+            self._next_run = utime.ticks_add(released, period)
+        elif self._overrun == REALIGN:
+            self._missed += late // period
+            released = utime.ticks_add(released, late)
+            self._next_run = utime.ticks_add(released, period)
+        else:
+            self._missed += 1
+            self._next_run = utime.ticks_diff(period, -self._next_run)
+        self._released = released
+        self._abs_deadline = utime.ticks_add(released, self.deadline)
+
+
     ## This method sets the period between runs of the task to the given
     #  number of milliseconds, or @c None if the task is triggered by calls
-    #  to @c go() rather than time.
+    #  to @c go() rather than time. A relative deadline which wasn't given
+    #  when the task was created changes with the period. The next run is
+    #  one new period after the task's last release, or from now if it
+    #  hasn't been released. When the task list is run by
+    #  @c TaskList.dl_sched() or @c TaskList.edf_sched(), call
+    #  @c TaskList.set_period() instead, which also keeps the scheduler's
+    #  heap of run times in order.
     #  @param new_period The new period in milliseconds between task runs
     def set_period(self, new_period):
         if new_period is None:
             self.period = None
+            self._next_run = None
+            if not self._deadline_given:
+                self.deadline = 0
+            return
+        self.period = int(new_period) * 1000
+        if not self._deadline_given:
+            self.deadline = self.period
+        if self._released != None:
+            self._next_run = utime.ticks_add(self._released, self.period)
         else:
-            self.period = int(new_period) * 1000
+            self._next_run = utime.ticks_add(utime.ticks_us(), self.period)
 
 
     ## This method resets the variables used for execution time profiling.
     #  This method is also used by @c __init__() to create the variables.
     def reset_profile(self):
         self._runs = 0
+        self._missed = 0
+        self._dl_missed = 0
         self._run_sum = 0
         self._slowest = 0
         self._late_sum = 0
         self._latest = 0
+        self._soonest = 0x3FFFFFFF
+        self._alloc_runs = 0
+        self._alloc_sum = 0
+        self._alloc_max = 0
+        self._gc_runs = 0
+        if self._dur_hist is not None:
+            for bin_num in range(HIST_BINS):
+                self._dur_hist[bin_num] = 0
+                self._late_hist[bin_num] = 0
+
+
+    ## This method estimates a percentile of a time from one of the task's
+    #  histograms. Because the histogram bins are powers of two wide, the
+    #  result is the upper edge of the bin holding the given percentile, or
+    #  the largest time measured if that is smaller.
+    #  @param hist The histogram, such as @c self._dur_hist
+    #  @param fraction The percentile as a fraction, such as 0.95
+    #  @param limit The largest time measured in microseconds
+    #  @return The time in milliseconds below which the given fraction of
+    #          the samples fall, or 0 if there are no samples
+    @staticmethod
+    def _percentile(hist, fraction, limit):
+        total = sum(hist)
+        if total == 0:
+            return 0.0
+        count = 0
+        for bin_num in range(HIST_BINS):
+            count += hist[bin_num]
+            if count >= fraction * total:
+                break
+        if bin_num == 0:
+            return 0.0
+        return min(1 << bin_num, limit) / 1000.0
+
+
+    ## This method empties the task's transition trace. The times in the
+    #  trace shown by @c get_trace() are measured from when this method was
+    #  last called, or from when the task was created.
+    def reset_trace(self):
+        self._tr_next = 0
+        self._tr_count = 0
+        self._tr_start = utime.ticks_us()
+
+
+    ## This method finds where the oldest transition in the trace is kept.
+    #  @return A tuple holding the index of the oldest transition in the
+    #          trace arrays and the number of transitions held
+    def _trace_span(self):
+        if self._tr_count > self._trace:
+            return self._tr_next, self._trace
+        return 0, self._tr_count
 
 
     ## This method returns a string containing the task's transition trace.
-    #  The trace is a set of tuples, each of which contains a time and the
-    #  states from and to which the system transitioned. 
+    #  Each line shows the time of a transition in seconds and the states
+    #  from and to which the task went. If the trace has filled up, only
+    #  the most recent transitions are shown, timed from the first of them.
     #  @return A possibly quite large string showing state transitions
     def get_trace(self):
         tr_str = 'Task ' + self.name + ':'
-        if self._trace:
-            tr_str += '\n'
-            last_state = 0
-            total_time = 0.0
-            for item in self._tr_data:
-                total_time += item[0] / 1000000.0
-                tr_str += '{: 12.6f}: {: 2d} -> {:d}\n'.format (total_time, 
-                    last_state, item[1])
-                last_state = item[1]
+        if not self._trace:
+            return tr_str + ' not traced'
+
+        first, count = self._trace_span()
+        lost = self._tr_count - count
+        if lost:
+            tr_str += f' {lost} earlier transitions overwritten'
+            last_time = self._tr_time[first]
         else:
-            tr_str += ' not traced'
+            last_time = self._tr_start
+        tr_str += '\n'
+        total_time = 0.0
+        for num in range(count):
+            idx = (first + num) % self._trace
+            total_time += utime.ticks_diff(self._tr_time[idx],
+                                           last_time) / 1000000.0
+            last_time = self._tr_time[idx]
+            tr_str += '{: 12.6f}: {: 2d} -> {:d}\n'.format (total_time,
+                self._tr_states[2 * idx], self._tr_states[2 * idx + 1])
         return tr_str
 
 
+    ## This method writes the task's transition trace in binary to a stream
+    #  such as a @c machine.UART or a file opened in binary mode. The record
+    #  starts with a header in the format @c TRACE_HEADER, and the trace's
+    #  arrays are written oldest transition first straight from memory. The
+    #  program @c on_pc/trace_decode.py reads the records back.
+    #  @param stream The stream to which the trace is written
+    def dump_trace(self, stream):
+        first, count = self._trace_span()
+        name = self.name.encode()
+        stream.write(struct.pack(TRACE_HEADER, b'TRC1', len(name), count,
+                                 self._tr_count - count))
+        stream.write(name)
+        if count:
+            # The ring is written in two pieces, from the oldest transition
+            # to the end of the arrays and then from their start
+            times = memoryview(self._tr_time)
+            states = memoryview(self._tr_states)
+            end = first + count
+            if end > self._trace:
+                end = self._trace
+            stream.write(times[first:end])
+            stream.write(times[:count - (end - first)])
+            stream.write(states[2 * first:2 * end])
+            stream.write(states[:2 * (count - (end - first))])
+
+
     ## Method to set a flag so that this task indicates that it's ready to run.
     #  This method may be called from an interrupt service routine or from
     #  another task which has data that this task needs to process soon.
     def go(self):
+        self._released = utime.ticks_us()
+        self._abs_deadline = utime.ticks_add(self._released, self.deadline)
         self.go_flag = True
 
 
@@ -273,18 +566,225 @@ class Task:
         except TypeError:
             rst += '         -'
         rst += f"{self._runs: 8d}"
+        if self.period != None or self._released != None:
+            rst += f"{self._missed: 8d}"
+        else:
+            rst += '       -'
+        if self._prof:
+            rst += f"{self._dl_missed: 8d}"
 
         if self._prof and self._runs > 0:
             avg_dur = (self._run_sum / self._runs) / 1000.0
             avg_late = (self._late_sum / self._runs) / 1000.0
             rst += f"{avg_dur: 10.3f}{(self._slowest / 1000.0): 10.3f}"
-            if self.period != None:
+            if self._released != None:
                 rst += f"{avg_late: 10.3f}{(self._latest / 1000.0): 10.3f}"
+            else:
+                rst += '         -         -'
+            for hist, limit in ((self._dur_hist, self._slowest),
+                                (self._late_hist, self._latest)):
+                for fraction in (0.50, 0.95, 0.99):
+                    rst += f"{self._percentile(hist, fraction, limit): 10.3f}"
+        elif self._mem_prof:
+            if not self._prof:
+                rst += '       -'
+            rst += '         -' * 10
+
+        # Bytes allocated per run, and the number of runs during which the
+        # garbage collector ran
+        if self._mem_prof:
+            if self._alloc_runs > 0:
+                rst += f"{(self._alloc_sum / self._alloc_runs): 10.0f}"
+            else:
+                rst += '         -'
+            rst += f"{self._alloc_max: 10d}{self._gc_runs: 8d}"
         return rst
 
 
 # =============================================================================
 
+## @brief   Class which starts untimed tasks from a hardware timer interrupt.
+#  @details The timer's callback calls each task's @c go() method, so the
+#  tasks are released at the rate of the timer's clock rather than whenever
+#  the scheduler next polls the time; a task which takes too long elsewhere
+#  in the loop can delay the start of a timer-released task, but it can't
+#  make the release times drift. The tasks must be created with no period.
+#  The callback doesn't allocate memory, so it is safe to run in an ISR.
+#
+#  Example:
+#  @code
+#  task = cotask.Task(left_ops, name="Left ops", priority=3, profile=True)
+#  cotask.task_list.append(task)
+#  release = cotask.TimerRelease(pyb.Timer(6, freq=50), (task,))
+#  ...
+#  print(release.report())
+#  @endcode
+class TimerRelease:
+
+    ## Bind tasks to a timer's interrupt.
+    #  @param timer A @c pyb.Timer which has been initialized with the
+    #         frequency at which the tasks are to be run
+    #  @param tasks A tuple of untimed tasks to be released by the timer
+    def __init__(self, timer, tasks):
+        for task in tasks:
+            if task.period != None:
+                raise ValueError(f"Task {task.name} has a period; timer "
+                                 "released tasks must be untimed")
+
+        ## The timer whose interrupt releases the tasks
+        self.timer = timer
+
+        ## The tuple of tasks released by the timer
+        self.tasks = tuple(tasks)
+
+        ## The period of the timer in microseconds, found from the timer's
+        #  clock source, prescaler and period registers
+        self.period = ((timer.prescaler() + 1) * (timer.period() + 1)
+                       * 1000000 // timer.source_freq())
+
+        # A task with no deadline of its own is to be done by the next tick
+        for task in self.tasks:
+            if task.deadline == 0:
+                task.deadline = self.period
+
+        self.reset()
+
+        # The bound method is made once here; making it in the interrupt
+        # would allocate memory
+        self._cb = self._isr
+        timer.callback(self._cb)
+
+
+    ## The timer callback, which releases each task. A task whose go flag
+    #  is still set from the previous tick hasn't run in time; it is counted
+    #  as a missed release and its original release time is kept.
+    #  @param timer The timer which caused the interrupt
+    @micropython.native
+    def _isr(self, timer):
+        now = utime.ticks_us()
+        if self._ticks > 0:
+            gap = utime.ticks_diff(now, self._last_tick)
+            if gap < self._gap_min:
+                self._gap_min = gap
+            if gap > self._gap_max:
+                self._gap_max = gap
+        self._last_tick = now
+        self._ticks += 1
+        next_tick = utime.ticks_add(now, self.period)
+        for task in self.tasks:
+            if task.go_flag:
+                task._missed += 1
+            else:
+                task.go()
+            task._next_release = next_tick
+
+
+    ## Zero the count of timer ticks and the measured tick intervals.
+    def reset(self):
+        self._ticks = 0
+        self._last_tick = 0
+        self._gap_min = 0x3FFFFFFF
+        self._gap_max = 0
+
+
+    ## Stop the timer's interrupt from releasing the tasks.
+    def stop(self):
+        self.timer.callback(None)
+        for task in self.tasks:
+            task._next_release = None
+
+
+    ## Make a report of the timer's intervals and each task's start jitter.
+    #  The interval between interrupts is measured with @c utime.ticks_us()
+    #  in the callback. For each profiled task, the latency is the time from
+    #  the interrupt to the start of the task's run, and the jitter is the
+    #  difference between the longest and the shortest latency.
+    #  @return A string holding the report
+    def report(self):
+        rst = f"Timer period {self.period} us, {self._ticks} ticks"
+        if self._ticks > 1:
+            rst += f", interval {self._gap_min} to {self._gap_max} us"
+        rst += ('\nTASK                RUNS  MISSED  AVG LATE  MAX LATE'
+                '    JITTER\n')
+        for task in self.tasks:
+            rst += f"{task.name:<16s}{task._runs: 8d}{task._missed: 8d}"
+            if task._prof and task._runs > 0:
+                rst += (f"{(task._late_sum / task._runs / 1000.0): 10.3f}"
+                        f"{(task._latest / 1000.0): 10.3f}"
+                        f"{((task._latest - task._soonest) / 1000.0): 10.3f}")
+            else:
+                rst += '         -         -         -'
+            rst += '\n'
+        return rst
+
+
+# =============================================================================
+
+## Move the task at position @c pos of a heap of tasks up toward the root
+#  until its parent is due no later than it is. The heap is kept in a list
+#  ordered by each task's next run time, earliest at index 0.
+#  @param heap The list holding the heap of tasks
+#  @param pos The index of the task which may need to move up
+@micropython.native
+def _sift_up(heap, pos):
+    task = heap[pos]
+    while pos > 0:
+        parent = (pos - 1) >> 1
+        other = heap[parent]
+        if utime.ticks_diff(task._next_run, other._next_run) >= 0:
+            break
+        heap[pos] = other
+        pos = parent
+    heap[pos] = task
+
+
+## Move the task at position @c pos of a heap of tasks down toward the
+#  leaves until neither of its children is due before it is.
+#  @param heap The list holding the heap of tasks
+#  @param pos The index of the task which may need to move down
+#  @param size The number of tasks in the heap; items in the list from this
+#         index onward are not part of the heap
+@micropython.native
+def _sift_down(heap, pos, size):
+    task = heap[pos]
+    while True:
+        child = 2 * pos + 1
+        if child >= size:
+            break
+        if child + 1 < size and utime.ticks_diff(heap[child + 1]._next_run,
+                                                 heap[child]._next_run) < 0:
+            child += 1
+        if utime.ticks_diff(heap[child]._next_run, task._next_run) >= 0:
+            break
+        heap[pos] = heap[child]
+        pos = child
+    heap[pos] = task
+
+
+## Check whether one task should be run before another by priority, using
+#  the times at which they were released to decide between tasks with the
+#  same priority.
+#  @param task The task which may be more important
+#  @param other The task with which it is compared
+#  @return @c True if @c task should be run before @c other
+@micropython.native
+def _higher(task, other):
+    if task.priority != other.priority:
+        return task.priority > other.priority
+    return utime.ticks_diff(task._released, other._released) < 0
+
+
+## Check whether one task's deadline is before another's, using priority
+#  to decide between tasks with the same deadline.
+#  @param task The task which may be more urgent
+#  @param other The task with which it is compared
+#  @return @c True if @c task should be run before @c other
+@micropython.native
+def _sooner(task, other):
+    diff = utime.ticks_diff(task._abs_deadline, other._abs_deadline)
+    return diff < 0 or (diff == 0 and task.priority > other.priority)
+
+
 ## A list of tasks used internally by the task scheduler.
 #  This class holds the list of tasks which will be run by the task scheduler.
 #  The task list is usually not directly used by the programmer except when
@@ -308,6 +808,44 @@ class TaskList:
         #  that priority. 
         self.pri_list = []
 
+        # The timed tasks, used by @c dl_sched(). The first @c _n_due items
+        # form a binary heap ordered by next run time; the items after those
+        # are tasks which have been released and are waiting to run. A count
+        # of -1 means the heap must be rebuilt before it is next used
+        self._heap = []
+        self._n_due = -1
+
+        # The tasks which have no period and only run after @c go() is called
+        self._untimed = []
+
+        ## The function which @c idle_sched() calls to wait when no task is
+        #  ready. It is given the number of microseconds until the next task
+        #  is due and may return early, as when an interrupt occurs. On a
+        #  Pyboard it puts the CPU to sleep until the next interrupt; this
+        #  may be replaced, for example by a simulated clock on a PC.
+        self.sleep_us = _wfi_sleep if wfi else utime.sleep_us
+
+        ## The number of bytes which must have been allocated since the last
+        #  garbage collection for @c idle_sched() to collect garbage while the
+        #  CPU is idle, or @c None to leave garbage collection to MicroPython
+        self.gc_threshold = None
+
+        ## Functions which @c idle_sched() calls before sleeping, each given
+        #  the number of microseconds until the next task is due, so that
+        #  work such as writing a log to a file can be done while the CPU
+        #  would otherwise be idle. Each should return quickly if there
+        #  isn't time for its work.
+        self.idle_work = []
+
+        # The estimated time a garbage collection takes, and the number of
+        # bytes allocated just after the last collection
+        self._gc_est = GC_FIRST_ESTIMATE
+        self._gc_base = 0
+
+        # Variables which measure how much of the time the CPU is idle, and
+        # how long garbage collection takes
+        self.reset_load()
+
 
     ## Append a task to the task list. The list will be sorted by task 
     #  priorities so that the scheduler can quickly find the highest priority
@@ -333,6 +871,37 @@ class TaskList:
         # Make sure the main list (of lists at each priority) is sorted
         self.pri_list.sort(key=lambda pri: pri[0], reverse=True)
 
+        # Keep track of the task for the deadline-ordered scheduler too
+        if task.period != None:
+            self._heap.append(task)
+            self._n_due = -1
+        else:
+            self._untimed.append(task)
+
+
+    ## Change the period of a task in the list, as @c Task.set_period()
+    #  does, and move the task within the heap used by @c dl_sched() and
+    #  @c edf_sched() to match its new next run time. A task may change its
+    #  own period while it runs. A task can't be switched between having a
+    #  period and being started by @c go(), as it would have to move between
+    #  the scheduler's lists.
+    #  @param task The task, which has been appended to this list
+    #  @param new_period The new period in milliseconds between task runs
+    #  @raises ValueError if the task would gain or lose its period
+    def set_period(self, task, new_period):
+        if (new_period == None) != (task.period == None):
+            raise ValueError("can't switch a task between timed and untimed")
+        task.set_period(new_period)
+        if new_period == None:
+            return
+
+        # A task waiting in the heap is moved to its new place; one which
+        # has been released, or is running, is put back in order after it runs
+        idx = self._heap.index(task)
+        if idx < self._n_due:
+            _sift_up(self._heap, idx)
+            _sift_down(self._heap, self._heap.index(task), self._n_due)
+
 
     ## Run tasks in order, ignoring the tasks' priorities.
     #
@@ -356,6 +925,7 @@ class TaskList:
     #  This scheduler runs tasks in a priority based fashion. Each time it is
     #  called, it finds the highest priority task which is ready to run and
     #  calls that task's @c run() method.
+    #  @return @c True if a task was run, @c False if none was ready
     @micropython.native
     def pri_sched(self):
         # Go down the list of priorities, beginning with the highest
@@ -372,20 +942,299 @@ class TaskList:
                 if pri[1] >= length:
                     pri[1] = 2
                 if ran:
-                    return
+                    return True
+
+        return False
+
+
+    ## Run tasks according to their priorities, finding due tasks by time.
+    #
+    #  This scheduler runs the same highest-priority-first policy as
+    #  @c pri_sched(), but it doesn't ask every task whether it is ready.
+    #  Timed tasks are kept in a heap ordered by their next run times, so a
+    #  pass reads the clock once and looks only at the tasks at the top of
+    #  the heap which have come due, plus those without a period. When no
+    #  task is due, a pass costs about the same no matter how many tasks
+    #  there are. Timed tasks are only run when they come due; calling
+    #  @c go() on a timed task has no effect with this scheduler. Don't
+    #  switch between this scheduler and @c pri_sched() while running, as
+    #  the heap would no longer match the tasks' run times.
+    #  @return @c True if a task was run, @c False if none was ready
+    @micropython.native
+    def dl_sched(self):
+        heap = self._heap
+        n_due = self._release_due()
+
+        # Find the highest priority task among the released ones and the
+        # untimed ones whose go flags have been set. Of tasks with the same
+        # priority, the one released first is run first
+        best = None
+        best_idx = 0
+        for idx in range(n_due, len(heap)):
+            task = heap[idx]
+            if best is None or _higher(task, best):
+                best = task
+                best_idx = idx
+        for task in self._untimed:
+            if task.go_flag and (best is None or _higher(task, best)):
+                best = task
+                best_idx = -1
+        if best is None:
+            return False
+
+        self._run_released(best, best_idx)
+        return True
+
+
+    ## Run the ready task whose deadline is nearest.
+    #
+    #  This earliest-deadline-first scheduler ignores the tasks' priorities
+    #  except to break ties. Each time a timed task is released, its
+    #  absolute deadline is set to the release time plus the task's relative
+    #  deadline, which is its period unless set otherwise; a task started by
+    #  @c go() gets a deadline measured from the call to @c go(). Of all the
+    #  tasks which are ready, the one whose deadline comes first is run. Due
+    #  tasks are found with the same heap as @c dl_sched() uses, and the same
+    #  warnings apply.
+    #  @return @c True if a task was run, @c False if none was ready
+    @micropython.native
+    def edf_sched(self):
+        heap = self._heap
+        n_due = self._release_due()
+
+        # Find the released or started task with the earliest deadline
+        best = None
+        best_idx = 0
+        for idx in range(n_due, len(heap)):
+            task = heap[idx]
+            if best is None or _sooner(task, best):
+                best = task
+                best_idx = idx
+        for task in self._untimed:
+            if task.go_flag and (best is None or _sooner(task, best)):
+                best = task
+                best_idx = -1
+        if best is None:
+            return False
+
+        self._run_released(best, best_idx)
+        return True
+
+
+    ## Release each timed task at the top of the heap whose time has come,
+    #  moving it out of the heap into the released area past the heap's end.
+    #  The clock is read once, and only the tasks which are due are looked at.
+    #  @return The number of tasks left in the heap
+    @micropython.native
+    def _release_due(self):
+        if self._n_due < 0:
+            self._build_heap()
+        heap = self._heap
+        n_due = self._n_due
+        now = utime.ticks_us()
+
+        while n_due > 0:
+            task = heap[0]
+            late = utime.ticks_diff(now, task._next_run)
+            if late <= 0:
+                break
+            task._release(late)
+            n_due -= 1
+            heap[0] = heap[n_due]
+            heap[n_due] = task
+            _sift_down(heap, 0, n_due)
+        self._n_due = n_due
+        return n_due
+
+
+    ## Run a task chosen by @c dl_sched() or @c edf_sched(). A timed task is
+    #  then put back into the heap to wait for its next run time.
+    #  @param task The task to be run
+    #  @param idx The task's index in the heap list, or -1 if it is untimed
+    @micropython.native
+    def _run_released(self, task, idx):
+        task._run()
+        if idx >= 0:
+            heap = self._heap
+            n_due = self._n_due
+            heap[idx] = heap[n_due]
+            heap[n_due] = task
+            _sift_up(heap, n_due)
+            self._n_due = n_due + 1
+
+
+    ## Run tasks according to their priorities, sleeping when none is due.
+    #
+    #  This scheduler runs a task just as @c dl_sched() does. If no task is
+    #  ready, rather than returning to be called again straight away, it
+    #  sleeps until the earliest timed task is due, or until the go flag of
+    #  an untimed task is set by an interrupt. The time spent asleep is
+    #  measured so that @c load() can show how busy the CPU really is.
+    #
+    #  If @c gc_threshold is set, garbage is collected before sleeping when
+    #  enough memory has been allocated and the sleep will be long enough
+    #  for the collection to finish before the next task is due. Tasks then
+    #  needn't call @c gc.collect() themselves. The functions in
+    #  @c idle_work are then called with the time left before the next task.
+    #  @param edf If @c True, choose tasks by @c edf_sched() rather than by
+    #         @c dl_sched()
+    #  @return @c True if a task was run, @c False if the scheduler slept
+    def idle_sched(self, edf=False):
+        if self._load_start == None:
+            self._load_start = utime.ticks_ms()
+        if self.edf_sched() if edf else self.dl_sched():
+            return True
+
+        # Sleep until the first task in the heap is due; a task is released
+        # once the time is past its run time, so wake a microsecond after
+        # it. If an untimed task is made ready by an interrupt, wake up early
+        # so it can be run
+        start = utime.ticks_us()
+        if self._n_due > 0:
+            wake = utime.ticks_add(self._heap[0]._next_run, 1)
+        else:
+            wake = utime.ticks_add(start, IDLE_SLICE)
+        if self.gc_threshold != None:
+            self._idle_gc(start, wake)
+            start = utime.ticks_us()
+        for work in self.idle_work:
+            work(self._slack(start, wake))
+            start = utime.ticks_us()
+        left = utime.ticks_diff(wake, start)
+        while left > 0 and not self._untimed_ready():
+            if self._untimed and self.sleep_us is not _wfi_sleep:
+                left = min(left, IDLE_SLICE)
+            self.sleep_us(left)
+            left = utime.ticks_diff(wake, utime.ticks_us())
+        self._idle_us += utime.ticks_diff(utime.ticks_us(), start)
+        return False
+
+
+    ## Collect garbage if enough memory has been allocated since the last
+    #  collection and there is time for a collection before the next task is
+    #  due. Each collection is timed; the estimate of how long one takes
+    #  follows the longest recent collection.
+    #  @param now The current time from @c utime.ticks_us()
+    #  @param wake The time at which the next timed task is due
+    def _idle_gc(self, now, wake):
+        slack = self._slack(now, wake)
+        if slack < self._gc_est + GC_MARGIN:
+            return
+        if gc.mem_alloc() - self._gc_base < self.gc_threshold:
+            return
+
+        begin = utime.ticks_us()
+        gc.collect()
+        gc_time = utime.ticks_diff(utime.ticks_us(), begin)
+        self._gc_base = gc.mem_alloc()
+        self._gc_count += 1
+        self._gc_sum += gc_time
+        if gc_time > self._gc_max:
+            self._gc_max = gc_time
+        self._gc_est -= self._gc_est >> 3
+        if gc_time > self._gc_est:
+            self._gc_est = gc_time
+
+
+    ## Find how long the CPU may be kept busy before a task is due, whether
+    #  a timed task or an untimed one released by an interrupt.
+    #  @param now The current time from @c utime.ticks_us()
+    #  @param wake The time at which the next timed task is due
+    #  @return The time in microseconds until the next task is due
+    def _slack(self, now, wake):
+        slack = utime.ticks_diff(wake, now)
+        for task in self._untimed:
+            if task._next_release != None:
+                until = utime.ticks_diff(task._next_release, now)
+                if until < slack:
+                    slack = until
+        return slack
+
+
+    ## Check whether any task without a period has had its go flag set.
+    #  @return @c True if an untimed task is ready to run
+    def _untimed_ready(self):
+        for task in self._untimed:
+            if task.go_flag:
+                return True
+        return False
+
+
+    ## Reset the measurement of idle and busy time made by @c idle_sched(),
+    #  and the count and times of the garbage collections it has made.
+    #  Measurement restarts at the next call to @c idle_sched().
+    def reset_load(self):
+        self._load_start = None
+        self._idle_us = 0
+        self._gc_count = 0
+        self._gc_sum = 0
+        self._gc_max = 0
+
+
+    ## Find how much of the time the CPU has spent idle and busy since
+    #  @c idle_sched() was first called or @c reset_load() was last called.
+    #  @return A tuple holding the idle and busy fractions, each from 0 to 1,
+    #          or @c None if @c idle_sched() hasn't been run
+    def load(self):
+        if self._load_start == None:
+            return None
+        total = utime.ticks_diff(utime.ticks_ms(), self._load_start) * 1000
+        if total <= 0:
+            return None
+        idle = min(self._idle_us / total, 1.0)
+        return (idle, 1.0 - idle)
+
+
+    ## Put all the timed tasks into the heap used by @c dl_sched(), sorted by
+    #  the time at which each one is next due. A sorted list is a valid heap.
+    def _build_heap(self):
+        now = utime.ticks_us()
+        self._heap.sort(key=lambda task: utime.ticks_diff(task._next_run, now))
+        self._n_due = len(self._heap)
+
+
+    ## Write the transition traces of all the traced tasks in the list to a
+    #  stream in binary, one record per task as written by
+    #  @c Task.dump_trace(). A header with an empty name and no transitions
+    #  marks the end of the dump.
+    #  @param stream The stream, such as a @c machine.UART, to write to
+    def dump_traces(self, stream):
+        for pri in self.pri_list:
+            for task in pri[2:]:
+                if task._trace:
+                    task.dump_trace(stream)
+        stream.write(struct.pack(TRACE_HEADER, b'TRC1', 0, 0, 0))
 
 
     ## Create some diagnostic text showing the tasks in the task list.
     def __repr__(self):
-        ret_str = 'TASK             PRI    PERIOD    RUNS   AVG DUR   MAX ' \
-            'DUR  AVG LATE  MAX LATE\n'
+        ret_str = 'TASK             PRI    PERIOD    RUNS  MISSED DL MISS   AVG ' \
+            'DUR   MAX DUR  AVG LATE  MAX LATE   DUR P50   DUR P95   DUR P99  LATE P50' \
+            '  LATE P95  LATE P99 AVG ALLOC MAX ALLOC     GCS\n'
         for pri in self.pri_list:
             for task in pri[2:]:
                 ret_str += str(task) + '\n'
 
+        load = self.load()
+        if load:
+            ret_str += f"IDLE {load[0] * 100.0: 5.1f}%   " \
+                       f"BUSY {load[1] * 100.0: 5.1f}%\n"
+        if self._gc_count:
+            ret_str += f"GC {self._gc_count} collections when idle, " \
+                       f"avg {self._gc_sum / self._gc_count / 1000.0:.3f} ms, " \
+                       f"max {self._gc_max / 1000.0:.3f} ms\n"
+
         return ret_str
 
 
+## The default sleep function used by @c TaskList.idle_sched() on a Pyboard.
+#  The CPU sleeps until the next interrupt, which at the latest is the next
+#  one millisecond system tick, so the requested time isn't used.
+#  @param usec The number of microseconds until the next task is due
+def _wfi_sleep(usec):
+    wfi()
+
+
 ## This is @b the main task list which is created for scheduling when 
 #  @c cotask.py is imported into a program. 
 task_list = TaskList()
@@ -0,0 +1,299 @@
+"""!
+@file logger.py
+This file contains a @c Logger, which writes rows of samples to a binary
+log file on the board's flash filesystem for as long as a run lasts. Rows
+are packed into one of two preallocated buffers while the other, once
+full, is written to the file a few whole blocks at a time. The writes are
+made by @c Logger.flush(), which is added to @c cotask.task_list.idle_work
+so that the scheduler calls it when no task is due, and the slow flash
+writes hold up no task.
+
+The file starts with a header naming the channels, padded with zeros to a
+multiple of @c BLOCK_SIZE bytes; the rows follow, each the channels'
+values packed little-endian in channel order. As each buffer is a multiple
+of @c BLOCK_SIZE bytes and rows are split across the end of one buffer and
+the start of the next, every write but the last fills whole blocks of the
+file. @c log_decode.py on the PC turns a log back into a CSV file.
+"""
+
+import struct
+import utime
+import micropython
+from micropython import const
+
+## The bytes which start every log file
+MAGIC = b'LOG1'
+
+## The layout of the header at the start of a log: the magic bytes, the
+#  number of channels and the size of a row in bytes
+HEADER = '<4sBH'
+
+## The layout of each channel's entry in the header: its type code and the
+#  length of its name, which follows
+CHANNEL_HEADER = '<BB'
+
+## The size in bytes of the blocks of the filesystem, to which the header
+#  and buffers are padded so that writes are aligned with them
+BLOCK_SIZE = const(512)
+
+## The time in microseconds a write of one block is assumed to take before
+#  the first write has been measured
+WRITE_FIRST_ESTIMATE = 2500
+
+## The extra time in microseconds, beyond the estimated time of a write,
+#  which must be left before the next task is due for @c Logger.flush() to
+#  write any blocks
+WRITE_MARGIN = 500
+
+
+class Logger:
+    """!
+    @brief   Logs rows of samples to a binary file through two buffers.
+    @details The logger is made from a schema of channels as a
+             @c recorder.Recorder is, and writes to a file between
+             @c open() and @c close(). If the CPU is too busy for a full
+             buffer to be written in its idle time, @c log() writes the rest
+             of it once the other buffer is three quarters full, holding up the task
+             which logs rather than losing rows; rows are only dropped if
+             that write fails.
+             @code
+             log = logger.Logger(("x", "y", ("time", 'L')))
+             cotask.task_list.idle_work.append(log.flush)
+             log.open("run.log")
+             ...
+             log.log(row)
+             ...
+             log.close()
+             @endcode
+    """
+
+    def __init__(self, channels, buffer_size=4096):
+        """!
+        @brief   Allocate the buffers for a schema of channels.
+        @param   channels A sequence of channel names, whose samples are
+                 floats, or (name, type code) tuples
+        @param   buffer_size The size in bytes of each buffer, rounded up to
+                 a multiple of @c BLOCK_SIZE
+        """
+        ## The names of the channels, in the order of the values in a row
+        self.names = []
+        ## The @c struct type code of each channel
+        self.type_codes = []
+        for channel in channels:
+            if isinstance(channel, str):
+                channel = (channel, 'f')
+            self.names.append(channel[0])
+            self.type_codes.append(channel[1])
+        # Each value is packed on its own, which unlike packing a row at once
+        # needs no tuple of the values
+        self._formats = ['<' + code for code in self.type_codes]
+        self._offsets = []
+        ## The number of bytes taken by one row
+        self.row_size = 0
+        for fmt in self._formats:
+            self._offsets.append(self.row_size)
+            self.row_size += struct.calcsize(fmt)
+        ## The size in bytes of each buffer
+        self.buffer_size = -(-buffer_size // BLOCK_SIZE) * BLOCK_SIZE
+        self._buffers = (bytearray(self.buffer_size),
+                         bytearray(self.buffer_size))
+        # A row which doesn't fit in the rest of a buffer is packed here,
+        # then split between the two buffers
+        self._row = bytearray(self.row_size)
+        self._row_view = memoryview(self._row)
+        self._views = (memoryview(self._buffers[0]),
+                       memoryview(self._buffers[1]))
+        self._block_est = WRITE_FIRST_ESTIMATE
+        self._file = None
+        self._reset()
+
+    def _reset(self):
+        """!
+        Empty the buffers and clear the counts.
+        """
+        self._fill = 0
+        self._pos = 0
+        self._pending = -1
+        # The number of bytes of the pending buffer written so far
+        self._written = 0
+        ## The number of rows logged since the log was opened
+        self.rows = 0
+        ## The number of rows which were dropped because both buffers were
+        #  full or the log wasn't open
+        self.dropped = 0
+        ## The number of buffers written to the file
+        self.writes = 0
+        ## The number of those writes made by @c log() rather than in idle
+        #  time, each holding up the task which logs for the time of a write
+        self.late_writes = 0
+        ## The longest time in microseconds taken by one write to the file
+        self.max_write_us = 0
+        ## Whether opening the file or a write failed, as when the
+        #  filesystem is full, which ends the log
+        self.failed = False
+
+    def open(self, path):
+        """!
+        @brief   Start a new log file, replacing any file of the same name.
+        @param   path The name of the file, such as @c "run.log"
+        """
+        self.close()
+        self._reset()
+        header = bytearray(struct.pack(HEADER, MAGIC, len(self.names),
+                                       self.row_size))
+        for name, code in zip(self.names, self.type_codes):
+            name = name.encode()
+            header += struct.pack(CHANNEL_HEADER, ord(code), len(name)) + name
+        header += bytes(-len(header) % BLOCK_SIZE)
+        try:
+            self._file = open(path, 'wb')
+            self._file.write(header)
+        except OSError:
+            # As when the filesystem is full or read-only; the run goes on,
+            # and its rows are counted as dropped
+            self._fail()
+
+    @micropython.native
+    def log(self, values):
+        """!
+        @brief   Put a row of samples into the buffer being filled.
+        @param   values A sequence holding one value per channel, in the
+                 order of the schema
+        @returns @c True if the row was logged, @c False if it was dropped
+        """
+        size = self.buffer_size
+        if self._pending >= 0 and self._pos >= size * 3 // 4:
+            # There hasn't been time to write the full buffer while idle, and
+            # it will soon be needed
+            writes = self.writes
+            self.flush()
+            self.late_writes += self.writes - writes
+        if self._file is None or (self._pos == size and not self._swap()):
+            self.dropped += 1
+            return False
+        pos = self._pos
+        formats = self._formats
+        offsets = self._offsets
+        if pos + self.row_size <= size:
+            buf = self._buffers[self._fill]
+            for index in range(len(formats)):
+                struct.pack_into(formats[index], buf, pos + offsets[index],
+                                 values[index])
+            self._pos = pos + self.row_size
+        else:
+            if self._pending >= 0:
+                self.dropped += 1
+                return False
+            row = self._row
+            for index in range(len(formats)):
+                struct.pack_into(formats[index], row, offsets[index],
+                                 values[index])
+            first = size - pos
+            self._buffers[self._fill][pos:] = self._row_view[:first]
+            self._swap()
+            rest = self.row_size - first
+            self._buffers[self._fill][:rest] = self._row_view[first:]
+            self._pos = rest
+        self.rows += 1
+        if self._pos == size:
+            self._swap()
+        return True
+
+    def _swap(self):
+        """!
+        Hand the full buffer over to be written and start filling the other.
+        @returns @c False if the other buffer hasn't been written yet
+        """
+        if self._pending >= 0:
+            return False
+        self._pending = self._fill
+        self._fill ^= 1
+        self._pos = 0
+        return True
+
+    def flush(self, slack_us=None):
+        """!
+        @brief   Write as much of the full buffer to the file as there's
+                 time for.
+        @details This is meant to be put in @c cotask.task_list.idle_work.
+                 As many whole blocks are written as the estimated time of
+                 a block's write lets fit in @c slack_us, so the buffer
+                 may take several calls. Each write is timed; the estimate
+                 follows the longest recent time per block. If a write
+                 fails, the file is closed, @c failed is set and later rows
+                 are dropped.
+        @param   slack_us The time in microseconds until the next task is
+                 due, or @c None to write the rest of the buffer now
+        """
+        if self._pending < 0 or self._file is None:
+            return
+        start = self._written
+        end = self.buffer_size
+        if slack_us is not None:
+            blocks = (slack_us - WRITE_MARGIN) // self._block_est
+            if blocks < 1:
+                return
+            if start + blocks * BLOCK_SIZE < end:
+                end = start + blocks * BLOCK_SIZE
+        begin = utime.ticks_us()
+        try:
+            self._file.write(self._views[self._pending][start:end])
+        except OSError:
+            # Keep what was written and stop logging rather than stop the
+            # scheduler, which this is called from
+            self._fail()
+            return
+        write_time = utime.ticks_diff(utime.ticks_us(), begin)
+        if write_time > self.max_write_us:
+            self.max_write_us = write_time
+        block_time = write_time * BLOCK_SIZE // (end - start)
+        self._block_est -= self._block_est >> 3
+        if block_time > self._block_est:
+            self._block_est = block_time
+        if end < self.buffer_size:
+            self._written = end
+            return
+        self._written = 0
+        self._pending = -1
+        self.writes += 1
+
+    def _fail(self):
+        """!
+        Close the file, if it was opened, after a write failed, ignoring any
+        error in closing it, and mark the log as failed.
+        """
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+        self._file = None
+        self.failed = True
+
+    def close(self):
+        """!
+        @brief   Write what remains in the buffers and close the file.
+        @details If a write or closing the file fails, @c failed is set
+                 rather than an error raised, as the log is often closed
+                 while the program is being stopped.
+        """
+        if self._file is None:
+            return
+        self.flush()
+        if self._file is None:
+            return
+        try:
+            if self._pos:
+                self._file.write(self._views[self._fill][:self._pos])
+            self._file.close()
+        except OSError:
+            self._fail()
+            return
+        self._file = None
+
+    def __repr__(self):
+        return ("Logger: {:d} rows, {:d} dropped, {:d} writes ({:d} late), "
+                "max {:d} us{:s}"
+                .format(self.rows, self.dropped, self.writes,
+                        self.late_writes, self.max_write_us,
+                        ", write failed" if self.failed else ""))
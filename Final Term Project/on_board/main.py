@@ -1,9 +1,13 @@
 import gc
+from array import array
 # import pyb
 import cotask
 import task_share
-import cqueue
-from time import ticks_us, ticks_ms, ticks_diff  # Use to get dt value in update()
+import timestamp
+import telemetry
+import recorder
+import logger
+from time import ticks_us, ticks_ms, ticks_diff
 from pyb import Timer, Pin, I2C, ADC
 from Encoder import Encoder
 from motor_driver import motor_driver
@@ -32,20 +36,19 @@ Pin(Pin.cpu.B6, mode=Pin.ALT, alt=7)  # Set pin modes to UART matching column 7
 Pin(Pin.cpu.B7, mode=Pin.ALT, alt=7)
 
 # Setup UART
-uart = UART(1, 115200)  # init with given baudrate
-uart.init(115200, bits=8, parity=None, stop=1)  # init with given parameters
+_UART_BAUD = const(115200)
+uart = UART(1, _UART_BAUD)  # init with given baudrate
+uart.init(_UART_BAUD, bits=8, parity=None, stop=1)  # init with given parameters
 # uart.write("test".encode())
 
 """! Global Variables Defined (Check if actually needed to clean up) !"""
 L_prev_dir = 0
 L_prev_en = 1
 L_prev_eff = 0
-L_t_start = 0
 L_t_UI = 0
 R_prev_dir = 0
 R_prev_en = 1
 R_prev_eff = 0
-R_t_start = 0
 R_t_UI = 0
 
 """! Setup for Encoders and Motors !"""
@@ -144,6 +147,26 @@ PB12 = Pin(Pin.cpu.B12, mode=Pin.IN, pull=Pin.PULL_UP)  # For Right Bump Sensor
 PB13 = Pin(Pin.cpu.B13, mode=Pin.IN, pull=Pin.PULL_UP)  # For Left Bump Sensor
 
 
+# Positions of the fields of the pose topic, in the order they're published
+_POSE_X = const(0)
+_POSE_Y = const(1)
+_POSE_YAW = const(2)
+
+# Positions of the fields of the left and right wheel topics
+_WHEEL_POS = const(0)
+_WHEEL_VEL = const(1)
+_WHEEL_VOLTS = const(2)
+
+# The log of the current run, made by collect_data, which is closed if the
+# program is stopped during a run
+run_logger = None
+
+# Time between rows of live telemetry streamed over the UART (5 Hz). Each row
+# holds up the task about 4 ms while the UART sends it, so faster rates left the
+# priority 0 tasks too little time to meet their deadlines
+_STREAM_PERIOD_MS = const(200)
+
+
 def yaw_error(x_curr, y_curr, yaw_curr, x_set, y_set):  # calculates difference between desired and real yaw
     # E is the vector pointing from Romi's position to the target
     E_x = x_set - x_curr
@@ -175,12 +198,13 @@ def yaw_error(x_curr, y_curr, yaw_curr, x_set, y_set):  # calculates difference
     right_ops
     UI
     collect_data
+    stream_telemetry
     battery_read
     !"""
 
 
 def commander(shares):
-    x_position, y_position, start_pathing, position_follow, line_follow, x_target, y_target, dist_from_target, distance_traveled_share, R_lin_spd, L_lin_spd = shares
+    start_pathing, position_follow, line_follow, x_target, y_target, dist_from_target, distance_traveled_share, R_lin_spd, L_lin_spd, command_num, run = shares
     com_1 = Command("lin", 930, 100, 720, 800)  # Line follow from start to first fork
     com_2 = Command("fwd", 100, 100)  # Go past the diamond
     com_3 = Command("lin", 480, 100, 1250, 400)  # Line follow around half circle
@@ -203,12 +227,16 @@ def commander(shares):
     """
     ADD COMMAND OBJECTS TO THE LIST TO BE EXECUTED IN ORDER
     """
+    # The subscriber's values hold x, y and yaw from the same update
+    pose_sub = task_share.subscribe("pose")
+    pose = pose_sub.values
     state = 0
     while True:
-        gc.collect()
+        pose_sub.read()
         if state == 0:
             if op_ind < len(_operations) and start_pathing.get():  # check if commands list is empty
                 curr_command = _operations[op_ind]
+                command_num.put(op_ind + 1)
                 print(f"Current command is {op_ind + 1}")
                 state = 1
             else:
@@ -230,7 +258,7 @@ def commander(shares):
                 position_follow.put(1)
                 x_target.put(curr_command.x_coord)
                 y_target.put(curr_command.y_coord)
-                yaw_err, dist_to_checkpoint = yaw_error(x_position.get(), y_position.get(), yaw_angle_share.get(),
+                yaw_err, dist_to_checkpoint = yaw_error(pose[_POSE_X], pose[_POSE_Y], pose[_POSE_YAW],
                                                         X_target.get(), Y_target.get())
                 dist_from_target.put(dist_to_checkpoint)
             elif curr_command.mode == "yaw":  # position follower mode, yaw setpoint
@@ -240,19 +268,19 @@ def commander(shares):
                 x_target.put(curr_command.x_coord)
                 y_target.put(curr_command.y_coord)
 
-                yaw_err, dist_to_checkpoint = yaw_error(x_position.get(), y_position.get(), yaw_angle_share.get(),
+                yaw_err, dist_to_checkpoint = yaw_error(pose[_POSE_X], pose[_POSE_Y], pose[_POSE_YAW],
                                                         X_target.get(), Y_target.get())
                 dist_from_target.put(dist_to_checkpoint)
-                yaw_initial = yaw_angle_share.get()
+                yaw_initial = pose[_POSE_YAW]
             elif curr_command.mode == "bmp":  # bumper mode
                 print("Parsed bumper mode")
                 line_follow.put(1)
             elif curr_command.mode == "fwd":
-                x_target.put(x_position.get() + 1.1 * curr_command.end_condition * cos(yaw_angle_share.get()))
-                y_target.put(y_position.get() + 1.1 * curr_command.end_condition * sin(yaw_angle_share.get()))
+                x_target.put(pose[_POSE_X] + 1.1 * curr_command.end_condition * cos(pose[_POSE_YAW]))
+                y_target.put(pose[_POSE_Y] + 1.1 * curr_command.end_condition * sin(pose[_POSE_YAW]))
                 starting_dist_traveled = distance_traveled_share.get()
             elif curr_command.mode == "tip":  # turn in place until certain yaw reached
-                yaw_initial = yaw_angle_share.get()
+                yaw_initial = pose[_POSE_YAW]
                 position_follow.put(0)
                 line_follow.put(0)
                 if curr_command.end_condition > 0:
@@ -270,7 +298,7 @@ def commander(shares):
                 print("position control mode in command task")
                 done = curr_command.check_end_condition(dist_from_target.get())
             elif curr_command.mode == "tip":  # position follower mode, prioritize yaw diff
-                yaw_diff = yaw_angle_share.get() - yaw_initial
+                yaw_diff = pose[_POSE_YAW] - yaw_initial
                 done = curr_command.check_end_condition(yaw_diff)
             elif curr_command.mode == "bmp":  # bumper mode
                 if not PB12.value() or not PB13.value():
@@ -292,6 +320,9 @@ def commander(shares):
                 t_start = ticks_ms()
                 state = 3
         if op_ind >= len(_operations):
+            if state != 4:
+                # The course is completed, so end the run's recording and log
+                run.put(0)
             state = 4
         elif state == 3:
             t_curr = ticks_ms()
@@ -303,22 +334,35 @@ def commander(shares):
         yield state
 
 def PositionControl(shares):
-    x_position, y_position, position_follow, IMU_time_share, yaw_angle_share, wheel_diff, dist_from_target, X_target, Y_target = shares
+    position_follow, IMU_time_share, wheel_diff, dist_from_target, X_target, Y_target = shares
+    pose_sub = task_share.subscribe("pose")
+    pose = pose_sub.values
     state = 0
     while True:
         if state == 0:
             if position_follow.get():
                 position_controller.enable_integral_error()
                 position_controller.old_ticks = IMU_time_share.get()
+                # Make sure the first run in state 1 works out an action
+                x_target_seen = -1
+                y_target_seen = -1
                 state = 1
         elif state == 1:
-            # timestamp sensor reading for controller
-            yaw_err, dist_to_checkpoint = yaw_error(x_position.get(), y_position.get(), yaw_angle_share.get(),
-                                                    X_target.get(), Y_target.get())
-            control_output_diff = position_controller.get_action(IMU_time_share.get(), yaw_err)
-            scaled_speed_diff = control_output_diff * -5
-            dist_from_target.put(dist_to_checkpoint)  # used to check command completion in commander task
-            wheel_diff.put(scaled_speed_diff)
+            # The pose is only updated every 50 ms, and the targets once per
+            # command; with the same inputs and IMU timestamp the controller
+            # would give the same output, so skip it until one changes
+            if (pose_sub.fresh() or X_target.changed_since(x_target_seen)
+                    or Y_target.changed_since(y_target_seen)):
+                pose_sub.read()
+                x_target_seen = X_target.version()
+                y_target_seen = Y_target.version()
+                # timestamp sensor reading for controller
+                yaw_err, dist_to_checkpoint = yaw_error(pose[_POSE_X], pose[_POSE_Y], pose[_POSE_YAW],
+                                                        X_target.get(), Y_target.get())
+                control_output_diff = position_controller.get_action(IMU_time_share.get(), yaw_err)
+                scaled_speed_diff = control_output_diff * -5
+                dist_from_target.put(dist_to_checkpoint)  # used to check command completion in commander task
+                wheel_diff.put(scaled_speed_diff)
             if not position_follow.get():
                 position_controller.enable_integral_error()
                 state = 0
@@ -327,7 +371,7 @@ def PositionControl(shares):
 
 def IR_sensor(shares):
     global centroid_set_point
-    calib_black, calib_white, line_follow, L_speed_share, R_speed_share, wheel_diff = shares
+    calib_black, calib_white, line_follow, L_speed_share, R_speed_share, wheel_diff, centroid_share = shares
     ir_controller.disable_integral_error()
     state = 0
     while True:
@@ -356,8 +400,10 @@ def IR_sensor(shares):
             ir_sensor_array.whites = const([360.62, 299.06, 297.68, 286.17, 281.66, 295.05, 316.05])
             ir_controller.set_target(centroid_set_point)
             ir_sensor_array.array_read()
-            ir_ticks_new = ticks_us()  # timestamp sensor reading for controller
-            control_output_diff = ir_controller.get_action(ir_ticks_new, ir_sensor_array.find_centroid())
+            ir_ticks_new = timestamp.stamp()  # timestamp sensor reading for controller
+            centroid = ir_sensor_array.find_centroid()
+            centroid_share.put(centroid)
+            control_output_diff = ir_controller.get_action(ir_ticks_new, centroid)
             scaled_speed_diff = control_output_diff * 70
             # split the difference in wheel speeds evenly between the two wheels
             wheel_diff.put(scaled_speed_diff)
@@ -368,8 +414,10 @@ def IR_sensor(shares):
 
 
 def IMU_OP(shares):
-    L_pos_share, R_pos_share, L_voltage_share, R_voltage_share, L_vel_share, R_vel_share, \
-        yaw_angle_share, yaw_rate_share, dist_traveled_share, IMU_time_share, test_start_time, x_position, y_position = shares
+    yaw_angle_share, yaw_rate_share, dist_traveled_share, IMU_time_share = shares
+    left_wheel = task_share.subscribe("left wheel")
+    right_wheel = task_share.subscribe("right wheel")
+    pose_topic = task_share.topics["pose"]
     robot_width = 141  # mm
     # create state variables
     x_hat_old = np.array(np.zeros(4).reshape(4, ))
@@ -436,35 +484,39 @@ def IMU_OP(shares):
         elif state == 1:  # Initialize reference Yaw based on encoder values
             sleep_ms(200)
             Euler_offset = IMU.readEulerAngles()[0]  # update yaw angle (rad)
-            y_measured[0] = L_pos_share.get() * .153  # in encoder counts, converted to mm
-            y_measured[1] = R_pos_share.get() * .153  # in encoder counts, converted to mm
+            left_wheel.read()
+            right_wheel.read()
+            y_measured[0] = left_wheel.values[_WHEEL_POS] * .153  # in encoder counts, converted to mm
+            y_measured[1] = right_wheel.values[_WHEEL_POS] * .153  # in encoder counts, converted to mm
             y_measured[2] = IMU.readEulerAngles()[0] - Euler_offset  # update yaw angle (rad)
             y_measured[3] = IMU.readAngularVelocity()[2]  # update yaw rate (rad/s)
             y_measured[2] = (y_measured[1] - y_measured[0]) / robot_width
-            v_left = L_voltage_share.get()  # pwm effort converted to V in ops tasks
-            v_right = R_voltage_share.get()
+            v_left = left_wheel.values[_WHEEL_VOLTS]  # pwm effort converted to V in ops tasks
+            v_right = right_wheel.values[_WHEEL_VOLTS]
             # Create u* = u/y vector (vl, vr, sl, sr, psi, psi_dot)
             u_aug = np.concatenate((np.array([v_left, v_right]), y_measured))
-            x_hat_old[0] = L_vel_share.get() * .153 / 35  # converted from counts/s to mm/s to radians per second
-            x_hat_old[1] = R_vel_share.get() * .153 / 35  # converted from counts/s to mm/s to radians per second
+            x_hat_old[0] = left_wheel.values[_WHEEL_VEL] * .153 / 35  # converted from counts/s to mm/s to radians per second
+            x_hat_old[1] = right_wheel.values[_WHEEL_VEL] * .153 / 35  # converted from counts/s to mm/s to radians per second
             x_hat_old[2] = 0  # Romi has not travelled any linear distance yet
             x_hat_old[3] = y_measured[2]  # yaw angle is already known from output vector
             state = 2
         elif state == 2:
-            new_time_meas = ticks_us()
             # Run observer and update equations
             x_hat_new = np.dot(_A_d, x_hat_old) + np.dot(_B_d, u_aug)
             # x_hat_new = np.dot(B_d, u_aug)
             y_hat = np.dot(_C, x_hat_new)
             dist_traveled = x_hat_new[2]
             dist_traveled_share.put(dist_traveled)
-            IMU_time_share.put(ticks_diff(new_time_meas, test_start_time.get()))
-            y_measured[0] = L_pos_share.get() * .153  # in encoder counts, converted to mm
-            y_measured[1] = R_pos_share.get() * .153  # in encoder counts, converted to mm
+            left_wheel.read()
+            right_wheel.read()
+            y_measured[0] = left_wheel.values[_WHEEL_POS] * .153  # in encoder counts, converted to mm
+            y_measured[1] = right_wheel.values[_WHEEL_POS] * .153  # in encoder counts, converted to mm
+            imu_stamp = timestamp.stamp()  # timestamp the IMU reading, which the pose is based on
             y_measured[2] = IMU.readEulerAngles()[0] - Euler_offset  # update yaw angle
             y_measured[3] = IMU.readAngularVelocity()[2]  # update yaw rate
-            v_left = L_voltage_share.get()  # pwm converted to V in ops tasks
-            v_right = R_voltage_share.get()
+            IMU_time_share.put(imu_stamp)
+            v_left = left_wheel.values[_WHEEL_VOLTS]  # pwm converted to V in ops tasks
+            v_right = right_wheel.values[_WHEEL_VOLTS]
             u_aug = np.concatenate((np.array([v_left, v_right]), y_measured))
             yaw_angle_share.put(y_measured[2])
             yaw_rate_share.put(y_measured[3])
@@ -474,13 +526,10 @@ def IMU_OP(shares):
             global_coords[0] = global_coords[0] + S_diff * cos(-1 * y_measured[2]) * 1.03
             global_coords[1] = global_coords[1] + S_diff * sin(-1 * y_measured[2]) * 1.05
 
-            x_position.put(global_coords[0])
-            y_position.put(global_coords[1])
             # use estimated states for the  position calculator
             est_global_coords[0] = est_global_coords[0] + S_diff * cos(-1 * y_measured[2])
             est_global_coords[1] = est_global_coords[1] + S_diff * sin(-1 * y_hat[2])
-            x_position.put(global_coords[0])
-            y_position.put(global_coords[1])
+            pose_topic.put((global_coords[0], global_coords[1], y_measured[2]))
             state = 2
         yield state
 
@@ -497,44 +546,50 @@ def left_ops(shares):
     print("LEFT OPS")
     state = 0
     # params: L dir, L eff, L en, L pos, L vel, L time
-    L_lin_spd, L_en, L_pos, L_vel, L_time, wheel_diff, follower_on, L_voltage, position_follower_on = shares
-    global L_prev_dir, L_prev_eff, L_prev_en, L_t_start
+    L_lin_spd, L_en, L_time, wheel_diff, follower_on, position_follower_on = shares
+    left_wheel = task_share.topics["left wheel"]
+    global L_prev_dir, L_prev_eff, L_prev_en
+    # This task runs at 50 Hz, so the shares it reads are indexed directly
+    # rather than through get() calls; none of them is written by an ISR
+    L_lin_spd_buf = L_lin_spd.buffer()
+    L_en_buf = L_en.buffer()
+    wheel_diff_buf = wheel_diff.buffer()
+    follower_on_buf = follower_on.buffer()
+    position_follower_on_buf = position_follower_on.buffer()
     # State 0: init
     while True:
         if state == 0:  # initialize shares and vars
             mot_left.enable()
             left_encoder.zero()
             left_encoder.update()
-            L_t_start = ticks_us()
             L_en.put(1)
             state = 1
         elif state == 1:  # task stays in state 1 permanently
             left_encoder.update()  # update encoder
-            L_t_new = ticks_us()
+            L_t_new = timestamp.stamp()  # stamp the encoder reading once, for the controller and the time share
             # global variables are used to store the internal data/state of the task
-            if L_en.get() > 0:
+            if L_en_buf[0] > 0:
                 # left_encoder.zero()
                 mot_left.enable()
                 cl_ctrl_mot_left.enable_integral_error()
             else:
                 mot_left.disable()
                 cl_ctrl_mot_left.disable_integral_error()
-            left_base_target = L_lin_spd.get()
-            if follower_on.get():
-                follower_diff = wheel_diff.get() / 2
+            left_base_target = L_lin_spd_buf[0]
+            if follower_on_buf[0]:
+                follower_diff = wheel_diff_buf[0] / 2
                 left_target = left_base_target - follower_diff
-            elif position_follower_on.get():  # implement the speed adjustment from the line follower task
-                follower_diff = wheel_diff.get() / 2
+            elif position_follower_on_buf[0]:  # implement the speed adjustment from the line follower task
+                follower_diff = wheel_diff_buf[0] / 2
                 left_target = left_base_target - follower_diff
             else:
                 left_target = left_base_target
             cl_ctrl_mot_left.set_target(left_target)
             pwm_percent = cl_ctrl_mot_left.get_action(L_t_new, left_encoder.get_velocity())
             mot_left.set_effort(pwm_percent)
-            L_voltage.put(pwm_percent * 9 / 100)  # pwm percent sent to motor
-            L_pos.put(left_encoder.get_position())  # counts
-            L_vel.put(left_encoder.get_velocity())  # counts
-            L_time.put(ticks_diff(L_t_new, L_t_start))
+            # position and velocity in counts and counts/s, and the voltage sent to the motor
+            left_wheel.put((left_encoder.get_position(), left_encoder.get_velocity(), pwm_percent * 9 / 100))
+            L_time.put(L_t_new)
         yield state
 
 
@@ -542,42 +597,46 @@ def right_ops(shares):
     # print("RIGHT OPS")
     state = 0
     # params: R dir, R eff, R en, R pos, R vel, R time
-    R_lin_spd, R_en, R_pos, R_vel, R_time, wheel_diff, line_follower_on, R_voltage, position_follower_on = shares
-    global R_prev_dir, R_prev_eff, R_prev_en, R_t_start
+    R_lin_spd, R_en, R_time, wheel_diff, line_follower_on, position_follower_on = shares
+    right_wheel = task_share.topics["right wheel"]
+    global R_prev_dir, R_prev_eff, R_prev_en
+    # Shares read every run are indexed directly, as in left_ops()
+    R_lin_spd_buf = R_lin_spd.buffer()
+    R_en_buf = R_en.buffer()
+    wheel_diff_buf = wheel_diff.buffer()
+    line_follower_on_buf = line_follower_on.buffer()
+    position_follower_on_buf = position_follower_on.buffer()
     # State 0: init
     while True:
         if state == 0:
             mot_right.enable()
             right_encoder.zero()
             right_encoder.update()
-            R_t_start = ticks_us()
             R_en.put(1)
             state = 1
         elif state == 1:
             right_encoder.update()
-            R_t_new = ticks_us()
-            if R_en.get() > 0:
+            R_t_new = timestamp.stamp()
+            if R_en_buf[0] > 0:
                 mot_right.enable()
                 cl_ctrl_mot_right.enable_integral_error()
             else:
                 mot_right.disable()
-                R_prev_en = R_en.get()
+                R_prev_en = R_en_buf[0]
                 cl_ctrl_mot_right.disable_integral_error()
-            right_base_target = R_lin_spd.get()
+            right_base_target = R_lin_spd_buf[0]
             cl_ctrl_mot_right.set_target(right_base_target)
-            R_prev_eff = R_lin_spd.get()  # store and update the effort
-            if line_follower_on.get():  # implement the speed adjustment from the line follower task
-                follower_diff = wheel_diff.get() / 2
+            R_prev_eff = right_base_target  # store and update the effort
+            if line_follower_on_buf[0]:  # implement the speed adjustment from the line follower task
+                follower_diff = wheel_diff_buf[0] / 2
                 cl_ctrl_mot_right.set_target(right_base_target + follower_diff)
-            elif position_follower_on.get():  # implement the speed adjustment from the line follower task
-                follower_diff = wheel_diff.get() / 2
+            elif position_follower_on_buf[0]:  # implement the speed adjustment from the line follower task
+                follower_diff = wheel_diff_buf[0] / 2
                 cl_ctrl_mot_right.set_target(right_base_target + follower_diff)
             pwm_percent = cl_ctrl_mot_right.get_action(R_t_new, right_encoder.get_velocity())  # t_print is a pwm%
             mot_right.set_effort(pwm_percent)
-            R_voltage.put(pwm_percent * 9 / 100)  # voltage input to motor
-            R_pos.put(right_encoder.get_position())
-            R_vel.put(right_encoder.get_velocity())
-            R_time.put(ticks_diff(R_t_new, R_t_start))
+            right_wheel.put((right_encoder.get_position(), right_encoder.get_velocity(), pwm_percent * 9 / 100))
+            R_time.put(R_t_new)
         yield state
 
 
@@ -596,7 +655,7 @@ UI Task guide:
     z = print left queues
     x = print right queues
     t = configure for testing
-    m = start pathing
+    m = start pathing, and record and log the run
 Motor step response test:
     Turns both motors off
     Sets both motor efforts to what the right motor effort currently is
@@ -625,7 +684,11 @@ def run_UI(shares):
                 state = 2
         elif state == 2:  # decode character
             if char_in == "m":
-                start_pathing.put(1)
+                # The course is run once; the commander clears Run when it's completed
+                if not start_pathing.get():
+                    start_pathing.put(1)
+                    test_start_time_share.put(timestamp.stamp())
+                    Run.put(1)  # record and log the course run
                 state = 1
             else:
                 state = 1
@@ -647,33 +710,47 @@ def collect_data(shares):
     # print("collect data")
     print("Collect Data")
     state = 0
-    R_EFF, L_EFF, RIGHT_POS, RIGHT_VEL, R_TIME, LEFT_POS, LEFT_VEL, L_TIME, yaw_angle, yaw_rate, IMU_time_share, dist_traveled_share, x_position, y_position, run, print_out = shares
+    R_EFF, L_EFF, R_TIME, L_TIME, yaw_angle, yaw_rate, IMU_time_share, dist_traveled_share, run, print_out, command_num = shares
+    # Time in each run spent sending data in state 3, so other tasks still run
+    _DUMP_BUDGET_US = const(8000)
+    # Payload of the dump's frames; a frame of 80 bytes of data takes about 8 ms
+    # to go out at 115200 baud, as the UART's writes wait for each byte
+    _DUMP_PAYLOAD = const(80)
+    # The task's period, the time between recorded rows
+    _RECORD_PERIOD_MS = const(20)
+    # Rows recorded from a trigger on (2 s); the recorder runs in a ring during
+    # a run and freezes this many rows after the first trigger, so the dump
+    # holds the seconds before it. 0 records from the start of a run until full
+    _POST_TRIGGER_ROWS = const(100)
+    # Every row of a run is also logged to this file on the flash filesystem
+    _LOG_FILE = "run.log"
+    # Triggers: either bumper pressed, the commander starting this command
+    # (0 for none), or the yaw rate going past this many rad/s
+    _TRIGGER_COMMAND = const(2)
+    _TRIGGER_YAW_RATE = 4.0
+    left_wheel = task_share.subscribe("left wheel")
+    right_wheel = task_share.subscribe("right wheel")
+    pose_sub = task_share.subscribe("pose")
     while True:
         # Initialize state
         if state == 0:
-            # Size of queue data being sent back to UI
-            QUEUE_SIZE = 1
-            # Initialize rightside queues
-            RIGHT_POS_Q = cqueue.FloatQueue(QUEUE_SIZE)  # Position share is initialized as f
-            RIGHT_VEL_Q = cqueue.FloatQueue(QUEUE_SIZE)  # Velocity share is initialized as f
-            # R_TIME_Q = cqueue.IntQueue(QUEUE_SIZE)  # Time share is initialized as I
-            # Initialize leftside queues
-            LEFT_POS_Q = cqueue.FloatQueue(QUEUE_SIZE)  # Position share is initialized as f
-            LEFT_VEL_Q = cqueue.FloatQueue(QUEUE_SIZE)  # Velocity share is initialized as f
-            # L_TIME_Q = cqueue.IntQueue(QUEUE_SIZE)  # Time share is initialized as I
-
-            # IMU Queues
-            IMU_TIME_Q = cqueue.IntQueue(QUEUE_SIZE)  # Time share is initialized as I
-
-            # X_Hat vector from IMU task
-            S_Q = cqueue.FloatQueue(QUEUE_SIZE)
-
-            # Y vector output queues from IMU task
-            Psi_Q = cqueue.FloatQueue(QUEUE_SIZE)
-            Psi_dot_Q = cqueue.FloatQueue(QUEUE_SIZE)
-
-            X_position_Q = cqueue.FloatQueue(QUEUE_SIZE)  # Position share is initialized as f
-            Y_position_Q = cqueue.FloatQueue(QUEUE_SIZE)  # Position share is initialized as f
+            # One row is recorded per run; timestamps are 32-bit unsigned, as
+            # are the time shares, and the rest are floats
+            channels = (("time", 'L'), "psi", "psi dot", "x", "y", "s",
+                        "right pos", "right vel", ("right time", 'L'),
+                        "left pos", "left vel", ("left time", 'L'))
+            # The log's buffers are written to the file by the scheduler when no
+            # task is due, so the flash writes hold up no task. It's made first so
+            # the recorder's share of the free heap leaves room for its buffers
+            global run_logger
+            run_logger = logger.Logger(channels)
+            cotask.task_list.idle_work.append(run_logger.flush)
+            data_recorder = recorder.Recorder(channels)
+            # The row is filled in place each run so recording it doesn't make a tuple
+            sample = [0] * len(data_recorder.names)
+            frame_writer = telemetry.FrameWriter(_DUMP_PAYLOAD)
+            print(f"Recorder holds {data_recorder.seconds(_RECORD_PERIOD_MS):.1f} s of data; "
+                  f"{data_recorder.free_seconds(_RECORD_PERIOD_MS):.1f} s more would fit in the free heap")
 
             print_out.put(0)
             state = 1
@@ -683,52 +760,112 @@ def collect_data(shares):
             t = print_out.get()
             r = run.get()
             if r:
+                if _POST_TRIGGER_ROWS:
+                    data_recorder.arm(_POST_TRIGGER_ROWS)
+                else:
+                    data_recorder.clear()
+                run_logger.open(_LOG_FILE)
                 state = 2
             elif t:
-                if RIGHT_VEL_Q.any() and RIGHT_POS_Q.any() and R_TIME_Q.any() and LEFT_VEL_Q.any() and LEFT_POS_Q.any() and L_TIME_Q.any():
+                if data_recorder.rows():
+                    data_recorder.start_send()
                     state = 3
         # Data collection state
         elif state == 2:
             if run.get():
-                # Putting shares from right motor task into queues
-                RIGHT_POS_Q.put(RIGHT_POS.get())
-                RIGHT_VEL_Q.put(RIGHT_VEL.get())
-                # R_TIME_Q.put(R_TIME.get())
-
-                # Putting shares from left motor task into queues
-                LEFT_POS_Q.put(LEFT_POS.get())
-                LEFT_VEL_Q.put(LEFT_VEL.get())
-
-                # Put IMU task shares
-                S_Q.put(dist_traveled_share.get())
-
-                Psi_Q.put(yaw_angle.get())
-                Psi_dot_Q.put(yaw_rate.get())
-
-                X_position_Q.put(x_position.get())
-                Y_position_Q.put(y_position.get())
-
+                # Put the IMU task shares, with the time the IMU was read
+                sample[0] = IMU_time_share.get()
+                sample[1] = yaw_angle.get()
+                sample[2] = yaw_rate.get()
+                pose_sub.read()
+                sample[3] = pose_sub.values[_POSE_X]
+                sample[4] = pose_sub.values[_POSE_Y]
+                sample[5] = dist_traveled_share.get()
+
+                # Wheel topics from the motor tasks, with the times the encoders were read
+                right_wheel.read()
+                sample[6] = right_wheel.values[_WHEEL_POS]
+                sample[7] = right_wheel.values[_WHEEL_VEL]
+                sample[8] = R_TIME.get()
+                left_wheel.read()
+                sample[9] = left_wheel.values[_WHEEL_POS]
+                sample[10] = left_wheel.values[_WHEEL_VEL]
+                sample[11] = L_TIME.get()
+
+                # Only the first trigger counts, so these are checked every run
+                if not PB12.value() or not PB13.value():
+                    data_recorder.trigger("bump")
+                elif _TRIGGER_COMMAND and command_num.get() == _TRIGGER_COMMAND:
+                    data_recorder.trigger("command")
+                elif abs(sample[2]) > _TRIGGER_YAW_RATE:
+                    data_recorder.trigger("yaw rate")
+                data_recorder.record(sample)
+                run_logger.log(sample)
                 state = 2
             else:
+                run_logger.close()
+                print(f"Run logged to {_LOG_FILE}: {run_logger}")
                 state = 1
         # outputting data state
         elif state == 3:
-            uart.write("OUTPUTTING TRIAL DATA _____________________________ \r\n")
-            size = 0
-             # IMU task output:
-            uart.write("Euler Angles output\n")
-            print("Got to the Euler angle write in collection task")
-            while Psi_Q.any():
-                size += 1
-                uart.write(f"{IMU_TIME_Q.get()}, {Psi_Q.get()}, {Psi_dot_Q.get()}, {X_position_Q.get()}, {Y_position_Q.get()}\r\n")
-                uart.write(f"{Psi_Q.get()}, {Psi_dot_Q.get()}, {X_position_Q.get()}, {Y_position_Q.get()}\r\n")
-                sleep_ms(5)
-            state = 1
-            uart.write(f"Number of data points: {size}\r\n")
-            print("Done sending data")
-            run.put(0)
-            print_out.put(0)
-            state = 1
+            # Send the recording as binary frames (see telemetry.py), which
+            # telemetry_decode.py on the PC turns back into a CSV file. Frames
+            # are only sent for part of each run, and the task yields between
+            if data_recorder.send_some(frame_writer, uart, _DUMP_BUDGET_US, _UART_BAUD):
+                print(f"Done sending data: {data_recorder}")
+                run.put(0)
+                print_out.put(0)
+                state = 1
+        yield state
+
+
+def stream_telemetry(shares):
+    # Sends the pose, wheel speeds, line centroid and motor voltages over the UART
+    # every run as binary frames (see telemetry.py), which telemetry_decode.py --live
+    # on the PC writes out as CSV while the robot runs. A row is dropped rather than
+    # waited for if the UART is still sending, and the achieved rate and the number
+    # of dropped rows are printed every few seconds
+    print_out, centroid_share = shares
+    _REPORT_MS = const(5000)
+    pose_sub = task_share.subscribe("pose")
+    left_wheel = task_share.subscribe("left wheel")
+    right_wheel = task_share.subscribe("right wheel")
+    streamer = telemetry.Streamer(("x", "y", "yaw", "left vel", "right vel", "centroid",
+                                   "left volts", "right volts"))
+    row = streamer.row
+    last_report = ticks_ms()
+    state = 0
+    while True:
+        # Streaming state
+        if state == 0:
+            if print_out.get():
+                # collect_data is sending a recording over the UART; wait for it
+                state = 1
+            else:
+                pose_sub.read()
+                row[0] = pose_sub.values[_POSE_X]
+                row[1] = pose_sub.values[_POSE_Y]
+                row[2] = pose_sub.values[_POSE_YAW]
+                left_wheel.read()
+                right_wheel.read()
+                row[3] = left_wheel.values[_WHEEL_VEL]
+                row[4] = right_wheel.values[_WHEEL_VEL]
+                row[5] = centroid_share.get()
+                row[6] = left_wheel.values[_WHEEL_VOLTS]
+                row[7] = right_wheel.values[_WHEEL_VOLTS]
+                streamer.send(uart, timestamp.stamp())
+                if ticks_diff(ticks_ms(), last_report) >= _REPORT_MS:
+                    print(streamer)
+                    streamer.clear_counts()
+                    last_report = ticks_ms()
+        # Paused state, while a recording is sent
+        elif state == 1:
+            if not print_out.get():
+                # The PC may have started listening during the dump, so name
+                # the channels again
+                streamer.restart()
+                last_report = ticks_ms()
+                state = 0
         yield state
 
 
@@ -759,20 +896,17 @@ if __name__ == "__main__":
     print(gc.mem_free())
     # Display total amount of memory in bytes
     print(gc.mem_alloc())
+    # Count reads and writes of every share so the diagnostic printout shows
+    # shares which are never read or have stopped being written
+    task_share.track_stats = True
     # Create Share objects for inter-task communication
     L_lin_spd = task_share.Share('f', thread_protect=False, name="L lin spd")  # Controls Motor Setpoint, in mm/s
-    L_voltage_share = task_share.Share('f', thread_protect=False, name="L mot eff")  # Volts
     L_en_share = task_share.Share('H', thread_protect=False, name="L en")
-    L_pos_share = task_share.Share('f', thread_protect=False, name="L pos")  # Encoder Counts
-    L_vel_share = task_share.Share('f', thread_protect=False, name="L vel")  # Stores read velocity in counts/s
-    L_time_share = task_share.Share('H', thread_protect=False, name="L time")  # us
+    L_time_share = task_share.Share('L', thread_protect=False, name="L time")  # us
     R_dir_share = task_share.Share('H', thread_protect=False, name="R dir")
     R_lin_spd = task_share.Share('f', thread_protect=False, name="R lin spd")  # Controls Motor Setpoint, in mm/s
-    R_voltage_share = task_share.Share('f', thread_protect=False, name="R mot eff")  # Volts
     R_en_share = task_share.Share('H', thread_protect=False, name="R en")
-    R_pos_share = task_share.Share('f', thread_protect=False, name="R pos")  # Encoder Counts
-    R_vel_share = task_share.Share('f', thread_protect=False, name="R vel")  # Stores read velocity in counts/s
-    R_time_share = task_share.Share('H', thread_protect=False, name="R time")
+    R_time_share = task_share.Share('L', thread_protect=False, name="R time")
     run = task_share.Share('H', thread_protect=False, name="run")
     print_out = task_share.Share('H', thread_protect=False, name="print out")
     bat_share = task_share.Share('f', thread_protect=False, name="bat share")
@@ -786,55 +920,69 @@ if __name__ == "__main__":
     yaw_angle_share = task_share.Share('f', thread_protect=False, name="yaw angle")
     yaw_rate_share = task_share.Share('f', thread_protect=False, name="yaw rate")
     dist_traveled_share = task_share.Share('f', thread_protect=False, name="Distance traveled")
-    IMU_time_share = task_share.Share('H', thread_protect=False, name="IMU time")
-    time_start_share = task_share.Share('H', thread_protect=False, name="time start")
-    X_coords_share = task_share.Share('f', thread_protect=False, name="X coordinate")
-    Y_coords_share = task_share.Share('f', thread_protect=False, name="Y coordinate")
+    IMU_time_share = task_share.Share('L', thread_protect=False, name="IMU time")
+    time_start_share = task_share.Share('L', thread_protect=False, name="time start")
+    # Topics, which tasks subscribe to by name rather than having them passed in their shares.
+    # Global position and heading, published by the state estimator
+    task_share.Topic("pose", 'f', ('x', 'y', 'yaw'), thread_protect=False)
+    # Encoder position (counts), velocity (counts/s) and motor voltage, published by the ops tasks
+    task_share.Topic("left wheel", 'f', ('pos', 'vel', 'volts'), thread_protect=False)
+    task_share.Topic("right wheel", 'f', ('pos', 'vel', 'volts'), thread_protect=False)
     start_pathing = task_share.Share('H', thread_protect=False,
                                      name="start pathing")  # Boolean from UI task to start command pathing
     X_target = task_share.Share('f', thread_protect=False, name="X target")
     Y_target = task_share.Share('f', thread_protect=False, name="Y target")
     dist_from_target = task_share.Share('f', thread_protect=False, name="distance from target")
+    command_num = task_share.Share('H', thread_protect=False, name="command")  # Number of the command being run, from 1
+    centroid_share = task_share.Share('f', thread_protect=False, name="centroid")  # Line position under the IR sensors
 
     gc.collect()
-    # Create the tasks. If trace is enabled for any task, memory will be
-    # allocated for state transition tracing, and the application will run out
-    # of memory after a while and quit. Therefore, use tracing only for
-    # debugging and set trace to False when it's not needed2
-
-    task_left_ops = cotask.Task(left_ops, name="Left ops", priority=3, period=20,
-                                profile=True, trace=False, shares=(L_lin_spd, L_en_share, L_pos_share, L_vel_share,
-                                                                   L_time_share, wheel_diff, line_follow,
-                                                                   L_voltage_share, position_follow))
-    task_right_ops = cotask.Task(right_ops, name="Right ops", priority=4, period=20,
-                                 profile=True, trace=False, shares=(R_lin_spd, R_en_share, R_pos_share, R_vel_share,
-                                                                    R_time_share, wheel_diff, line_follow,
-                                                                    R_voltage_share, position_follow))
+    # Create the tasks. If trace is enabled for a task, the last
+    # cotask.TRACE_DEPTH state transitions are kept in a ring allocated when
+    # the task is created, so tracing can be left on for a whole run. Traces
+    # are saved to trace.bin when the program stops; read them on the PC with
+    # on_pc/trace_decode.py. Tasks with mem_profile enabled show the heap
+    # memory they allocate per run in the task table; it's on for the tasks
+    # suspected of causing most of the garbage collection
+
+    # The motor tasks have no period; they're released at 50 Hz by the
+    # interrupt of timer 6 (see below) so their rate doesn't drift when
+    # other tasks hold up the loop
+    task_left_ops = cotask.Task(left_ops, name="Left ops", priority=3,
+                                profile=True, trace=False, shares=(L_lin_spd, L_en_share, L_time_share, wheel_diff,
+                                                                   line_follow, position_follow))
+    task_right_ops = cotask.Task(right_ops, name="Right ops", priority=4,
+                                 profile=True, trace=False, shares=(R_lin_spd, R_en_share, R_time_share, wheel_diff,
+                                                                    line_follow, position_follow))
     task_ui = cotask.Task(run_UI, name="UI", priority=1, period=100,
                           profile=True, trace=False,
                           shares=(L_lin_spd, R_lin_spd, run, print_out, time_start_share, start_pathing))
     task_collect_data = cotask.Task(collect_data, name="Collect Data", priority=0, period=20,
-                                    profile=True, trace=False, shares=(
-            R_lin_spd, L_lin_spd, R_pos_share, R_vel_share, R_time_share, L_pos_share, L_vel_share, L_time_share,
-            yaw_angle_share, yaw_rate_share, IMU_time_share, dist_traveled_share, X_coords_share, Y_coords_share, run,
-            print_out))
+                                    profile=True, trace=False, mem_profile=True, shares=(
+            R_lin_spd, L_lin_spd, R_time_share, L_time_share, yaw_angle_share, yaw_rate_share, IMU_time_share,
+            dist_traveled_share, run, print_out, command_num))
+    # Live telemetry; its period sets the rate at which rows are streamed
+    task_stream = cotask.Task(stream_telemetry, name="Telemetry", priority=0, period=_STREAM_PERIOD_MS,
+                              profile=True, trace=False, mem_profile=True, shares=(print_out, centroid_share))
     task_read_battery = cotask.Task(battery_read, name="Battery", priority=0, period=2000,
                                     profile=True, trace=False, shares=(bat_share, bat_flag))
     task_IR_sensor = cotask.Task(IR_sensor, name="IR sensor", priority=0, period=50,
                                  profile=True, trace=False,
-                                 shares=(calib_black, calib_white, line_follow, L_lin_spd, R_lin_spd, wheel_diff))
+                                 shares=(calib_black, calib_white, line_follow, L_lin_spd, R_lin_spd, wheel_diff,
+                                         centroid_share))
+    # The state estimator blocks while the IMU calibrates; skip the runs missed
+    # then rather than running it back to back and starving the motor tasks
     task_state_estimator = cotask.Task(IMU_OP, name="state estimator", priority=10, period=50,
-                                       profile=True, trace=False, shares=(
-            L_pos_share, R_pos_share, L_voltage_share, R_voltage_share, L_vel_share, R_vel_share, yaw_angle_share,
-            yaw_rate_share, dist_traveled_share, IMU_time_share, time_start_share, X_coords_share, Y_coords_share))
-    task_commander = cotask.Task(commander, name="Commander", priority=0, period=20, profile=True, trace=False,
-                                 shares=(X_coords_share, Y_coords_share, start_pathing, position_follow,
+                                       profile=True, trace=False, overrun=cotask.SKIP, mem_profile=True, shares=(
+            yaw_angle_share, yaw_rate_share, dist_traveled_share, IMU_time_share))
+    task_commander = cotask.Task(commander, name="Commander", priority=0, period=20, profile=True, trace=True,
+                                 mem_profile=True,
+                                 shares=(start_pathing, position_follow,
                                          line_follow, X_target, Y_target, dist_from_target,
-                                         dist_traveled_share, R_lin_spd, L_lin_spd))
+                                         dist_traveled_share, R_lin_spd, L_lin_spd, command_num, run))
     task_position_controller = cotask.Task(PositionControl, name="Pos CTRL", priority=0, period=20, profile=True,
                                            trace=False,
-                                           shares=(X_coords_share, Y_coords_share, position_follow, IMU_time_share,
-                                                   yaw_angle_share, wheel_diff,
+                                           shares=(position_follow, IMU_time_share, wheel_diff,
                                                    dist_from_target, X_target, Y_target))
 
     gc.collect()
@@ -843,31 +991,45 @@ if __name__ == "__main__":
     cotask.task_list.append(task_right_ops)
     cotask.task_list.append(task_ui)
     cotask.task_list.append(task_collect_data)
+    cotask.task_list.append(task_stream)
     cotask.task_list.append(task_read_battery)
     cotask.task_list.append(task_IR_sensor)
     cotask.task_list.append(task_state_estimator)
     cotask.task_list.append(task_commander)
     cotask.task_list.append(task_position_controller)
+    motor_release = cotask.TimerRelease(Timer(6, freq=50), (task_left_ops, task_right_ops))
 
     # Run the memory garbage collector to ensure memory is as defragmented as
     # possible before the real-time scheduler is started
     gc.collect()
+    # Let the scheduler collect garbage in its idle time once a quarter of the
+    # free heap has been used, rather than when a task happens to allocate
+    cotask.task_list.gc_threshold = gc.mem_free() // 4
     print("PROG START")
 
-    # Run the scheduler with the chosen scheduling algorithm. Quit if ^C pressed
+    # Run the scheduler with the chosen scheduling algorithm. Quit if ^C pressed.
+    # The idle scheduler sleeps until the next task is due rather than spinning
     while True:
         try:
-            cotask.task_list.pri_sched()
+            cotask.task_list.idle_sched()
         except KeyboardInterrupt:
+            motor_release.stop()
             mot_left.disable()
             mot_right.disable()
+            if run_logger:
+                run_logger.close()
+                print(run_logger)
             print(gc.mem_free())
             # print(micropython.mem_info())
             print('\n' + str(cotask.task_list))
+            print(motor_release.report())
+            with open("trace.bin", "wb") as trace_file:
+                cotask.task_list.dump_traces(trace_file)
             print(task_share.show_all())
             print('')
             break
         except:
+            motor_release.stop()
             mot_left.disable()
             mot_right.disable()
             raise
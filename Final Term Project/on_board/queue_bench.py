@@ -0,0 +1,128 @@
+"""!
+@file queue_bench.py
+This file contains a benchmark which compares the time taken to put items
+into and get them from a @c task_share.Queue which turns interrupts off
+while it changes its pointers, the same queue without protection, and a
+@c task_share.SPSCQueue, which is safe between one writer and one reader
+without turning interrupts off. On the board, whose MicroPython image has
+the C queues, an @c cqueue.IntQueue is timed as well for comparison. As in
+the test program in @c cqueue.py, the average and longest times of the
+calls are printed, for each run and over all of the runs; the longest time
+to put an item matters most when the items are put in an interrupt
+callback.
+
+The benchmark runs on the Pyboard, on the MicroPython unix port, or under
+CPython; under CPython the @c utime and @c micropython calls which
+@c task_share.py and @c cotask.py use are supplied by @c bench_host.py.
+"""
+
+try:
+    import utime
+    import micropython
+except ImportError:
+    # Running under CPython: supply the calls that task_share.py and
+    # cotask.py make
+    import bench_host
+    utime, micropython = bench_host.install()
+
+import sys
+import task_share
+
+# The C queues are only built into the board's MicroPython image; elsewhere
+# cqueue.py is only their documentation and test program
+if sys.platform == "pyboard":
+    import cqueue
+else:
+    cqueue = None
+
+## The number of times to call put() and get() for each queue in each run
+TEST_SIZE = 3000
+
+## The number of elements in each queue which we create and test
+NUM_QUEUE_SIZE = 2000
+
+## The number of times we repeat the whole test
+NUM_RUNS = 10
+
+
+def make_queues():
+    """!
+    Create one queue of each kind to be tested.
+    @returns A list of tuples, each holding a name for the queue and the
+             queue, whose @c put() and @c get() are called with no arguments
+             but the item
+    """
+    queues = [("Protected", task_share.Queue('l', NUM_QUEUE_SIZE,
+                                             thread_protect=True,
+                                             overwrite=True, stats=False)),
+              ("Unprotected", task_share.Queue('l', NUM_QUEUE_SIZE,
+                                               thread_protect=False,
+                                               overwrite=True, stats=False)),
+              ("SPSC", task_share.SPSCQueue('l', NUM_QUEUE_SIZE,
+                                            stats=False))]
+    if cqueue is not None:
+        queues.append(("C IntQueue", cqueue.IntQueue(NUM_QUEUE_SIZE)))
+    return queues
+
+
+def time_queue(queue):
+    """!
+    Fill a queue, then empty it, timing each call to @c put() and @c get()
+    and checking that the items come out as they went in. Items beyond the
+    queue's size aren't put, as the SPSC queue never overwrites.
+    @param queue The queue to test
+    @returns A tuple holding the sum and the longest of the durations of the
+             @c put() calls and of the @c get() calls, in microseconds
+    """
+    putsum = putmax = getsum = getmax = 0
+    count = min(TEST_SIZE, NUM_QUEUE_SIZE)
+    for item in range(count):
+        begin_time = utime.ticks_us()
+        queue.put(item)
+        dur = utime.ticks_diff(utime.ticks_us(), begin_time)
+        putsum += dur
+        putmax = dur if dur > putmax else putmax
+
+    for item in range(count):
+        begin_time = utime.ticks_us()
+        got_this = queue.get()
+        dur = utime.ticks_diff(utime.ticks_us(), begin_time)
+        getsum += dur
+        getmax = dur if dur > getmax else getmax
+        if got_this != item:
+            print(f"Error: got {got_this} rather than {item}")
+    return putsum, putmax, getsum, getmax
+
+
+def main():
+    """!
+    Time each kind of queue repeatedly and print the results of each run and
+    of all of the runs together.
+    """
+    queues = make_queues()
+    count = min(TEST_SIZE, NUM_QUEUE_SIZE)
+    overall = {name: [0, 0, 0, 0] for name, _ in queues}
+
+    for run in range(NUM_RUNS):
+        print(f"Run {run + 1} of {NUM_RUNS}")
+        for name, queue in queues:
+            putsum, putmax, getsum, getmax = time_queue(queue)
+            print(f"  {name:<12s} put Avg {putsum / count:.2f}, Max {putmax}"
+                  f" us; get Avg {getsum / count:.2f}, Max {getmax} us")
+            total = overall[name]
+            total[0] += putsum
+            total[1] = max(total[1], putmax)
+            total[2] += getsum
+            total[3] = max(total[3], getmax)
+
+    print("")
+    print(f"Overall results from {NUM_RUNS} runs of {count} calls:")
+    for name, _ in queues:
+        putsum, putmax, getsum, getmax = overall[name]
+        print(f"{name:<12s} put Avg {putsum / (count * NUM_RUNS):.2f}, "
+              f"Max {putmax} us; get Avg {getsum / (count * NUM_RUNS):.2f}, "
+              f"Max {getmax} us")
+
+
+main()
+print("Test finished.")
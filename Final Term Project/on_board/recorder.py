@@ -0,0 +1,320 @@
+"""!
+@file recorder.py
+This file contains a @c Recorder, which records rows of samples of several
+channels, such as the robot's pose and wheel speeds, into one preallocated
+array per channel. Recording a row puts each value into its channel's array
+and allocates no memory, so a long run can be recorded at the control rate
+without making garbage. After a run the columns are sent to the PC with
+@c telemetry.FrameWriter, each straight from its array.
+
+A recorder either records once from the start of a run until it is full,
+or, once armed with @c Recorder.arm(), records continuously into a ring,
+overwriting its oldest rows, until a trigger such as a bump freezes it a
+set number of rows later. The frozen recording then holds the seconds
+before the trigger as well as those after it, and only that window is
+sent.
+"""
+
+import gc
+import struct
+import utime
+import micropython
+from array import array
+
+
+class Recorder:
+    """!
+    @brief   Records rows of samples into one array per channel.
+    @details The recorder is made from a schema, a sequence of channels,
+             each given as a name, whose samples are floats, or as a tuple
+             of a name and an @c array type code, such as @c ('time', 'L')
+             for timestamps. Every channel's array holds the same number of
+             samples, the recorder's capacity; once it is full, further
+             rows are counted as dropped. An armed recorder instead
+             overwrites its oldest rows until @c trigger() is called, then
+             records a given number of rows more and freezes.
+             @code
+             rec = recorder.Recorder(("x", "y", ("time", "L")), 500)
+             row = [0.0, 0.0, 0]
+             ...
+             row[0] = x
+             row[1] = y
+             row[2] = timestamp.stamp()
+             rec.record(row)
+             ...
+             rec.arm(100)
+             ...
+             if bumped:
+                 rec.trigger("bump")
+             rec.record(row)
+             @endcode
+    """
+
+    def __init__(self, channels, capacity=None, heap_fraction=0.25):
+        """!
+        @brief   Allocate the arrays for a schema of channels.
+        @param   channels A sequence of channel names or (name, type code)
+                 tuples
+        @param   capacity The number of rows to hold, or @c None to use a
+                 fraction of the free heap
+        @param   heap_fraction The fraction of the free heap to use if no
+                 capacity is given
+        """
+        ## The names of the channels, in the order of the values in a row
+        self.names = []
+        ## The @c array type code of each channel
+        self.type_codes = []
+        for channel in channels:
+            if isinstance(channel, str):
+                channel = (channel, 'f')
+            self.names.append(channel[0])
+            self.type_codes.append(channel[1])
+        ## The number of bytes taken by one row of all the channels
+        self.row_size = sum(struct.calcsize(code) for code in self.type_codes)
+        gc.collect()
+        if capacity is None:
+            capacity = int(gc.mem_free() * heap_fraction) // self.row_size
+        ## The number of rows which the recorder can hold
+        self.capacity = capacity
+        ## The arrays holding the samples, one per channel
+        self.columns = [array(code, (0 for _ in range(capacity)))
+                        for code in self.type_codes]
+        gc.collect()
+        self._send_schema = 0
+        self._send_channel = 0
+        self._send_row = 0
+        self._send_oldest = 0
+        self._ring = False
+        self._post_rows = 0
+        self.clear()
+
+    def clear(self):
+        """!
+        @brief   Forget the recorded rows, the trigger and the count of
+                 dropped rows, and record from the start until full.
+        """
+        self._ring = False
+        self._reset()
+
+    def arm(self, post_rows):
+        """!
+        @brief   Forget the recorded rows and record continuously into a
+                 ring until a trigger.
+        @details Once full, each row overwrites the oldest one. After
+                 @c trigger() is called, @c post_rows more rows are recorded,
+                 counting the row recorded next, and the recorder then
+                 freezes; the rest of its rows are the ones from before the
+                 trigger.
+        @param   post_rows The number of rows to record from the trigger on,
+                 from 1 to the capacity
+        """
+        self._ring = True
+        self._post_rows = max(1, min(post_rows, self.capacity))
+        self._reset()
+
+    def _reset(self):
+        """!
+        Forget the recorded rows, the trigger and the count of dropped rows.
+        """
+        self._count = 0
+        self._next = 0
+        self._total = 0
+        self._post_left = -1
+        self._trigger_total = 0
+        ## The number of rows which didn't fit since the recorder was cleared
+        #  or armed
+        self.dropped = 0
+        ## The reason given to @c trigger(), or @c None before a trigger
+        self.trigger_reason = None
+
+    def trigger(self, reason="trigger"):
+        """!
+        @brief   Mark the row recorded next as the trigger.
+        @details An armed recorder freezes once the rows after the trigger
+                 have been recorded; one which isn't armed only marks the
+                 row. Only the first trigger after the recorder is cleared
+                 or armed counts, so this can be called every time a
+                 condition holds.
+        @param   reason A short name of what caused the trigger, such as
+                 @c "bump", which is sent with the recording
+        """
+        if self.trigger_reason is not None:
+            return
+        self.trigger_reason = reason
+        self._trigger_total = self._total
+        if self._ring:
+            self._post_left = self._post_rows
+
+    @micropython.native
+    def record(self, values):
+        """!
+        @brief   Record a row of samples.
+        @details The values are copied into the channels' arrays, which
+                 allocates no memory; passing a list or array which is
+                 reused for every row avoids making a tuple for each.
+        @param   values A sequence holding one value per channel, in the
+                 order of the schema
+        @returns @c True if the row was recorded, @c False if the recorder
+                 is full or frozen
+        """
+        if self._post_left == 0:
+            self.dropped += 1
+            return False
+        row = self._next
+        if row >= self.capacity:
+            if not self._ring:
+                self.dropped += 1
+                return False
+            row = 0
+        columns = self.columns
+        for index in range(len(columns)):
+            columns[index][row] = values[index]
+        self._next = row + 1
+        if self._count < self.capacity:
+            self._count += 1
+        self._total += 1
+        if self._post_left > 0:
+            self._post_left -= 1
+        return True
+
+    def rows(self):
+        """!
+        @returns The number of rows held
+        """
+        return self._count
+
+    def full(self):
+        """!
+        @returns @c True if no more rows can be recorded
+        """
+        if self._ring:
+            return self._post_left == 0
+        return self._count >= self.capacity
+
+    def frozen(self):
+        """!
+        @returns @c True if the recorder was triggered while armed and has
+                 recorded all of the rows after the trigger
+        """
+        return self._post_left == 0
+
+    def trigger_row(self):
+        """!
+        @details The trigger marks the row recorded after it. If no row
+                 was recorded after the trigger, as when a recorder which
+                 isn't armed was already full, the last row is given.
+        @returns The index of the trigger's row among the rows held, oldest
+                 first as they are sent, or -1 if there's been no trigger
+                 or no rows are held
+        """
+        if self.trigger_reason is None:
+            return -1
+        return min(self._trigger_total - (self._total - self._count),
+                   self._count - 1)
+
+    def seconds(self, period_ms):
+        """!
+        @brief   Find how long a recording the recorder holds.
+        @param   period_ms The time between rows in milliseconds
+        @returns The time in seconds taken to fill the recorder
+        """
+        return self.capacity * period_ms / 1000
+
+    def free_seconds(self, period_ms):
+        """!
+        @brief   Find how much more recording time would fit in the heap.
+        @param   period_ms The time between rows in milliseconds
+        @returns The time in seconds which rows taking all of the free heap
+                 would cover
+        """
+        return gc.mem_free() // self.row_size * period_ms / 1000
+
+    def start_send(self):
+        """!
+        @brief   Get ready to send the recorded rows with @c send_some().
+        """
+        self._send_schema = 0
+        self._send_channel = 0
+        self._send_row = 0
+        self._send_oldest = self._next - self._count
+        if self._send_oldest < 0:
+            self._send_oldest += self.capacity
+
+    def send_some(self, writer, stream, budget_us, baudrate=None):
+        """!
+        @brief   Send some of the recorded data as telemetry frames.
+        @details After @c start_send(), frames naming each channel are sent
+                 first, then column frames, each copied from a channel's
+                 array, and last an end frame, which gives the trigger's row
+                 if there was one. The rows are sent oldest first, so the
+                 rows of an armed recorder are sent from where its ring
+                 wrapped, two pieces per channel.
+                 Each call sends at least one frame and begins no frame
+                 which would end after @c budget_us, so a task can send a
+                 recording a little at a time between yields. A UART whose
+                 writes wait for the bytes to go out, as the Pyboard's do,
+                 takes longer to send a frame than to build it; given the
+                 UART's baud rate, the time to send the longest frame is
+                 counted before each frame is begun. The writer's
+                 @c max_payload should be small enough that one frame fits
+                 in the budget.
+        @param   writer A @c telemetry.FrameWriter
+        @param   stream The stream, such as a UART, to write to
+        @param   budget_us The time in microseconds by which the frames sent
+                 should be finished
+        @param   baudrate The baud rate of a UART whose writes wait for the
+                 bytes to be sent, or @c None for a stream whose writes
+                 don't wait
+        @returns @c True when all of the data has been sent
+        """
+        start = utime.ticks_us()
+        # Each byte takes 10 bits on the wire: a start bit, 8 data bits and
+        # a stop bit
+        frame_us = 0
+        if baudrate:
+            frame_us = writer.max_frame_size() * 10000000 // baudrate
+        sent = False
+        while (not sent or utime.ticks_diff(utime.ticks_us(), start)
+                           + frame_us <= budget_us):
+            sent = True
+            if self._send_schema < len(self.names):
+                num = self._send_schema
+                if num == 0:
+                    writer.resync(stream)
+                writer.send_schema(stream, num, self.type_codes[num],
+                                   self.names[num])
+                self._send_schema += 1
+                continue
+            if self._send_channel >= len(self.columns):
+                writer.send_end(stream, self.trigger_row(),
+                                self.trigger_reason)
+                self.start_send()
+                return True
+            code = self.type_codes[self._send_channel]
+            count = min(self._count - self._send_row,
+                        writer.column_room(code))
+            if count <= 0:
+                self._send_channel += 1
+                self._send_row = 0
+                sent = False
+                continue
+            # Rows in the ring after the oldest come first, then those
+            # from its start
+            first = (self._send_oldest + self._send_row) % self.capacity
+            count = min(count, self.capacity - first)
+            column = memoryview(self.columns[self._send_channel])
+            writer.send_column(stream, self._send_channel, code,
+                               self._send_row, column[first:first + count])
+            self._send_row += count
+        return False
+
+    def __repr__(self):
+        text = ("Recorder: {:d} channels, {:d}/{:d} rows, {:d} dropped"
+                .format(len(self.names), self._count, self.capacity,
+                        self.dropped))
+        if self.trigger_reason is not None:
+            text += ", {:s} at row {:d}".format(self.trigger_reason,
+                                                self.trigger_row())
+        elif self._ring:
+            text += ", armed"
+        return text
@@ -0,0 +1,95 @@
+"""!
+@file sched_bench.py
+This file contains a benchmark which compares the cost of the polling
+scheduler @c cotask.TaskList.pri_sched() with the deadline-ordered scheduler
+@c cotask.TaskList.dl_sched(). Task sets of 9, 30 and 100 tasks are made from
+the periods and priorities of the tasks in @c main.py; each task's generator
+does nothing but yield, so the results show only the scheduler's overhead.
+
+The benchmark runs on the Pyboard, on the MicroPython unix port, or under
+CPython; under CPython the @c utime and @c micropython calls which
+@c cotask.py uses are supplied by @c bench_host.py.
+"""
+
+try:
+    import utime
+    import micropython
+except ImportError:
+    # Running under CPython: supply the calls that task_share.py and
+    # cotask.py make
+    import bench_host
+    utime, micropython = bench_host.install()
+
+import gc
+import cotask
+
+## Sizes of the task sets which are compared
+TASK_COUNTS = (9, 30, 100)
+
+## Periods in milliseconds and priorities of the tasks in main.py, which are
+#  repeated as needed to fill out a task set
+ROMI_TASKS = ((20, 3), (20, 4), (100, 1), (20, 0), (2000, 0), (50, 0),
+              (50, 10), (20, 0), (20, 0))
+
+## How long each scheduler is run for each task set, in milliseconds
+RUN_TIME = 2000
+
+
+def idle_task():
+    """!
+    Task which does nothing at all, so only the scheduler is measured.
+    """
+    while True:
+        yield 0
+
+
+def make_task_list(num_tasks):
+    """!
+    Create a task list holding the given number of do-nothing tasks.
+    @param num_tasks The number of tasks to put in the list
+    @returns A new @c cotask.TaskList
+    """
+    task_list = cotask.TaskList()
+    for count in range(num_tasks):
+        period, priority = ROMI_TASKS[count % len(ROMI_TASKS)]
+        task_list.append(cotask.Task(idle_task, name=f"T{count}",
+                                     priority=priority, period=period))
+    return task_list
+
+
+def run_sched(sched):
+    """!
+    Call a scheduler method over and over for @c RUN_TIME milliseconds.
+    @param sched The bound scheduler method, such as @c tl.pri_sched
+    @returns A tuple holding the number of passes and the number of passes
+             in which a task was run
+    """
+    passes = 0
+    runs = 0
+    run_us = RUN_TIME * 1000
+    begin_time = utime.ticks_us()
+    while utime.ticks_diff(utime.ticks_us(), begin_time) < run_us:
+        if sched():
+            runs += 1
+        passes += 1
+    return passes, runs
+
+
+def main():
+    """!
+    Run both schedulers on each task set and print the average time taken
+    by a scheduler pass and the number of task runs in each test.
+    """
+    print(f"{'TASKS':>5s} {'SCHEDULER':>10s} {'PASSES':>9s} {'RUNS':>7s}"
+          f" {'US/PASS':>8s}")
+    for num_tasks in TASK_COUNTS:
+        for sched_name in ("pri_sched", "dl_sched"):
+            task_list = make_task_list(num_tasks)
+            gc.collect()
+            passes, runs = run_sched(getattr(task_list, sched_name))
+            print(f"{num_tasks:5d} {sched_name:>10s} {passes:9d} {runs:7d}"
+                  f" {RUN_TIME * 1000 / passes:8.2f}")
+
+
+main()
+print("Test finished.")
@@ -0,0 +1,158 @@
+"""!
+@file share_bench.py
+This file contains a benchmark which measures the cost of reading and
+writing a @c task_share.Share. Reading with @c get() is compared with
+indexing the array given by @c Share.buffer() and with copying the data
+into an array with @c Share.read_into(), for a share of floats and a share
+of 16-bit flags as used in @c main.py. Writing with @c put() is compared
+with storing into the share's array.
+
+For each operation the average time per call and the heap memory allocated
+per call are printed. On MicroPython a float read with @c get() or by
+indexing an array creates a float object, which shows up as allocation;
+@c read_into() copies the bytes and allocates nothing.
+
+The benchmark runs on the Pyboard, on the MicroPython unix port, or under
+CPython; under CPython the @c utime and @c micropython calls which
+@c task_share.py and @c cotask.py use are supplied by @c bench_host.py,
+and no allocation is measured.
+
+CPython times don't measure what matters on the board. Viper code such as
+the byte copy in @c read_into() runs there as ordinary Python, a call per
+byte, so @c read_into() looks many times slower than @c get(), while on
+MicroPython it is compiled to machine code; and the allocation which
+@c read_into() avoids isn't measured at all. Compare the calls on the
+board or on the unix port.
+"""
+
+try:
+    import utime
+    import micropython
+except ImportError:
+    # Running under CPython: supply the calls that task_share.py and
+    # cotask.py make
+    import bench_host
+    utime, micropython = bench_host.install()
+
+import array
+import gc
+import task_share
+
+## How many times each operation is called
+CALLS = 10000
+
+
+def mem_alloc():
+    """!
+    Find how much heap memory is in use.
+    @returns The number of bytes allocated, or @c None where the count isn't
+             available, as under CPython
+    """
+    try:
+        return gc.mem_alloc()
+    except AttributeError:
+        return None
+
+
+def bench_get(share):
+    """!
+    Read a share @c CALLS times with @c get().
+    """
+    for _ in range(CALLS):
+        share.get()
+
+
+def bench_buffer(share):
+    """!
+    Read a share @c CALLS times by indexing its array.
+    """
+    buf = share.buffer()
+    for _ in range(CALLS):
+        buf[0]
+
+
+def bench_read_into(share):
+    """!
+    Copy a share @c CALLS times into an array with @c read_into().
+    """
+    dest = array.array(share._type_code, [0])
+    for _ in range(CALLS):
+        share.read_into(dest)
+
+
+def bench_put(share):
+    """!
+    Write a share @c CALLS times with @c put().
+    """
+    value = share.buffer()[0]
+    for _ in range(CALLS):
+        share.put(value)
+
+
+def bench_store(share):
+    """!
+    Write a share @c CALLS times by storing into its array.
+    """
+    buf = share.buffer()
+    value = buf[0]
+    for _ in range(CALLS):
+        buf[0] = value
+
+
+def bench_empty(share):
+    """!
+    Run the benchmark loop with nothing in it, to find the loop's own cost.
+    """
+    for _ in range(CALLS):
+        pass
+
+
+def measure(bench, share):
+    """!
+    Time one benchmark and measure the memory it allocates.
+    @param bench The benchmark function
+    @param share The share which the benchmark uses
+    @returns A tuple holding the time taken in microseconds and the bytes
+             allocated, or @c None for the bytes if they can't be counted
+    """
+    gc.collect()
+    gc.disable()
+    before = mem_alloc()
+    begin_time = utime.ticks_us()
+    bench(share)
+    run_time = utime.ticks_diff(utime.ticks_us(), begin_time)
+    after = mem_alloc()
+    gc.enable()
+    return run_time, None if before is None else after - before
+
+
+def main():
+    """!
+    Run each benchmark on a float share and a flag share and print the time
+    and memory used per call, less the cost of the empty loop.
+    """
+    shares = (task_share.Share('f', thread_protect=False, name="float"),
+              task_share.Share('H', thread_protect=False, name="flag"))
+    shares[0].put(1.5)
+    shares[1].put(1)
+    empty_time, _ = measure(bench_empty, shares[0])
+
+    print(f"{'OPERATION':<12s} {'TYPE':>6s} {'US/CALL':>8s}"
+          f" {'BYTES/CALL':>11s}")
+    for name, bench in (("get", bench_get), ("buffer[0]", bench_buffer),
+                        ("read_into", bench_read_into), ("put", bench_put),
+                        ("buffer[0]=", bench_store)):
+        for share in shares:
+            run_time, alloc = measure(bench, share)
+            type_name = task_share.type_code_strings[share._type_code]
+            line = (f"{name:<12s} {type_name:>6s}"
+                    f" {(run_time - empty_time) / CALLS:8.3f}")
+            if alloc is None:
+                line += f" {'-':>11s}"
+            else:
+                line += f" {alloc / CALLS:11.1f}"
+            print(line)
+
+
+main()
+print("Test finished.")
@@ -23,14 +23,37 @@
 
 import array
 import gc
-import pyb
+import utime
 import micropython
 
+try:
+    from pyb import disable_irq, enable_irq
+except ImportError:
+    # Ports without pyb, such as the unix port on which benchmarks are run,
+    # have no interrupts which could corrupt shared data
+    def disable_irq ():
+        return 0
+
+    def enable_irq (state):
+        pass
+
+try:
+    import cotask
+except ImportError:
+    cotask = None
+
 
 ## This is a system-wide list of all the queues and shared variables. It is
 #  used to create diagnostic printouts. 
 share_list = []
 
+## If @c True, queues and shares which are created without a @c stats
+#  argument count their reads and writes; see @c BaseShare.reset_stats().
+track_stats = False
+
+## This dictionary holds every @c Topic, with the topic's name as the key.
+topics = {}
+
 ## This dictionary allows readable printouts of queue and share data types.
 type_code_strings = {'b' : "int8",   'B' : "uint8",
                      'h' : "int16",  'H' : "uint16",
@@ -48,6 +71,33 @@ def show_all ():
     return '\n'.join (gen)
 
 
+## Copy bytes from one buffer to another without allocating any memory.
+#  @param dest The buffer, such as an @c array.array, into which to copy
+#  @param start The byte in @c dest at which to start copying
+#  @param source The buffer from which to copy
+#  @param nbytes The number of bytes to copy
+@micropython.viper
+def _copy_bytes (dest, start: int, source, nbytes: int):
+    to = ptr8 (dest)
+    frm = ptr8 (source)
+    for index in range (nbytes):
+        to[start + index] = frm[index]
+
+
+## Copy bytes from part of one buffer to the start of another without
+#  allocating any memory.
+#  @param dest The buffer into which to copy
+#  @param source The buffer from which to copy
+#  @param start The byte in @c source at which to start copying
+#  @param nbytes The number of bytes to copy
+@micropython.viper
+def _copy_from (dest, source, start: int, nbytes: int):
+    to = ptr8 (dest)
+    frm = ptr8 (source)
+    for index in range (nbytes):
+        to[index] = frm[start + index]
+
+
 ## Base class for queues and shares which exchange data between tasks.
 # 
 #  One should never create an object from this class; it doesn't do anything
@@ -58,14 +108,75 @@ class BaseShare:
     ## Create a base queue object when called by a child class initializer.
     #
     #  This method creates the things which queues and shares have in common.
-    def __init__ (self, type_code, thread_protect = True, name = None):
+    def __init__ (self, type_code, thread_protect = True, name = None,
+                  stats = None):
         self._type_code = type_code
         self._thread_protect = thread_protect
+        self._watchers = []
+        self._stats = track_stats if stats == None else stats
+        self.reset_stats ()
 
         # Add this queue to the global share and queue list
         share_list.append (self)
 
 
+    ## Start a task whenever data is put into this queue or share.
+    #
+    #  Each write calls the task's @c go() method, so a task with no period
+    #  can be run only when its input changes rather than polling it. A task
+    #  may watch several queues and shares.
+    #  @code
+    #  my_share.watch (my_task)
+    #  @endcode
+    #  @param task The @c cotask.Task to be started
+    def watch (self, task):
+        self._watchers.append (task)
+
+
+    ## Reset the statistics kept by a queue or share made with @c stats on.
+    #
+    #  The statistics are the numbers of items put and got, the task which
+    #  last put data, and the time of the last put. They show up in the
+    #  diagnostic printout, where a share which is never read or which
+    #  hasn't been written for a long time stands out.
+    def reset_stats (self):
+        self._puts = 0
+        self._gets = 0
+        self._writer = None
+        self._write_ms = None
+
+
+    ## Record a write for the statistics.
+    #  @param count The number of items written
+    #  @param in_ISR @c True if the write was made from within an ISR
+    @micropython.native
+    def _count_put (self, count, in_ISR):
+        self._puts += count
+        if in_ISR:
+            self._writer = "ISR"
+        elif cotask != None and cotask.current_task != None:
+            self._writer = cotask.current_task.name
+        else:
+            self._writer = None
+        self._write_ms = utime.ticks_ms ()
+
+
+    ## Make the part of the diagnostic printout which shows the statistics.
+    #  @return A string holding the statistics, or an empty string if they
+    #          aren't kept
+    def _stats_str (self):
+        if not self._stats:
+            return ''
+        if self._write_ms == None:
+            age = "never"
+        else:
+            age = "{:d} ms".format (utime.ticks_diff (utime.ticks_ms (),
+                                                      self._write_ms))
+        return " Puts {:d} Gets {:d} Writer {:s} Age {:s}".format (
+            self._puts, self._gets,
+            self._writer if self._writer != None else '-', age)
+
+
 ## A queue which is used to transfer data from one task to another.
 #
 #  If parameter 'thread_protect' is @c True when a queue is created, transfers
@@ -117,10 +228,12 @@ class Queue (BaseShare):
     #         data if the queue becomes full 
     #  @param name A short name for the queue, default @c QueueN where @c N
     #         is a serial number for the queue
+    #  @param stats @c True to count the queue's reads and writes, or
+    #         @c None to use the module's @c track_stats setting
     def __init__ (self, type_code, size, thread_protect = False, 
-                  overwrite = False, name = None):
+                  overwrite = False, name = None, stats = None):
         # First call the parent class initializer
-        super ().__init__ (type_code, thread_protect, name)
+        super ().__init__ (type_code, thread_protect, name, stats)
 
         self._size = size
         self._overwrite = overwrite
@@ -137,6 +250,8 @@ class Queue (BaseShare):
         except ValueError:
             self._buffer = None
             raise
+        self._itemsize = len (bytes (array.array (type_code, [0])))
+        self._view = memoryview (self._buffer)
 
         # Initialize pointers to be used for reading and writing data
         self.clear ()
@@ -150,16 +265,18 @@ class Queue (BaseShare):
     # 
     #  If there isn't room for the item, wait (blocking the calling process)
     #  until room becomes available, unless the @c overwrite constructor
-    #  parameter was set to @c True to allow old data to be clobbered. If
+    #  parameter was set to @c True to allow old data to be clobbered. In a
+    #  cooperative scheduler no other task can run while this method waits,
+    #  so if the queue is emptied by another task, waiting never ends. If
     #  non-blocking behavior without overwriting is needed, one should call
-    #  @c full() to ensure that the queue is not full before putting data
-    #  into it:
+    #  @c try_put(), or call @c full() to ensure that the queue is not full
+    #  before putting data into it:
     #  @code
     #     def some_task ():
     #         # Setup
     #         while True:
-    #             if not my_queue.full ():
-    #                 my_queue.put (create_something_to_put ())
+    #             if not my_queue.try_put (create_something_to_put ()):
+    #                 print ("Data lost")
     #             yield 0
     #  @endcode
     #  @param item The item to be placed into the queue
@@ -169,6 +286,7 @@ class Queue (BaseShare):
         # If we're in an ISR and the queue is full and we're not allowed to
         # overwrite data, we have to give up and exit
         if self.full ():
+            self._full_count += 1
             if in_ISR:
                 return
 
@@ -179,7 +297,7 @@ class Queue (BaseShare):
 
         # Prevent data corruption by blocking interrupts during data transfer
         if self._thread_protect and not in_ISR:
-            _irq_state = pyb.disable_irq ()
+            _irq_state = disable_irq ()
 
         # Write the data and advance the counts and pointers
         self._buffer[self._wr_idx] = item
@@ -187,22 +305,30 @@ class Queue (BaseShare):
         if self._wr_idx >= self._size:
             self._wr_idx = 0
         self._num_items += 1
-        if self._num_items >= self._size:        # Can't be fuller than full
+        if self._num_items > self._size:         # Can't be fuller than full
             self._num_items = self._size
+            self._rd_idx = self._wr_idx          # The oldest item is gone
         if self._num_items > self._max_full:     # Record maximum fillage
             self._max_full = self._num_items
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
-            pyb.enable_irq (_irq_state)
+            enable_irq (_irq_state)
+
+        if self._stats:
+            self._count_put (1, in_ISR)
+        for task in self._watchers:
+            task.go ()
 
 
     ## Read an item from the queue.
     # 
     #  If there isn't anything in there, wait (blocking the calling process)
-    #  until something becomes available. If non-blocking reads are needed,
-    #  one should call @c any() to check for items before attempting to read
-    #  from the queue. This is usually done in a low priority task:
+    #  until something becomes available; as with @c put(), waiting for
+    #  another task never ends. If non-blocking reads are needed, one should
+    #  call @c try_get(), or call @c any() to check for items before
+    #  attempting to read from the queue. This is usually done in a low
+    #  priority task:
     #  @code
     #     def some_task ():
     #         # Setup
@@ -217,12 +343,14 @@ class Queue (BaseShare):
     @micropython.native
     def get (self, in_ISR = False):
         # Wait until there's something in the queue to be returned
-        while self.empty ():
-            pass
+        if self.empty ():
+            self._empty_count += 1
+            while self.empty ():
+                pass
 
         # Prevent data corruption by blocking interrupts during data transfer
         if self._thread_protect and not in_ISR:
-            irq_state = pyb.disable_irq ()
+            irq_state = disable_irq ()
 
         # Get the item to be returned from the queue
         to_return = self._buffer[self._rd_idx]
@@ -237,11 +365,66 @@ class Queue (BaseShare):
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
-            pyb.enable_irq (irq_state)
+            enable_irq (irq_state)
 
+        if self._stats:
+            self._gets += 1
         return (to_return)
 
 
+    ## Put an item into the queue if there is room for it.
+    #
+    #  Unlike @c put(), this method returns rather than waiting forever if
+    #  the queue is full. It can wait for up to a given time for room, which
+    #  is only useful if the queue is emptied by an interrupt; a task which
+    #  empties the queue can't run until the caller yields.
+    #  @param item The item to be placed into the queue
+    #  @param timeout_us The longest time in microseconds to wait for room,
+    #         or 0 not to wait
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return @c True if the item was put, @c False if the queue was full
+    @micropython.native
+    def try_put (self, item, timeout_us = 0, in_ISR = False):
+        if self.full () and not self._overwrite:
+            self._full_count += 1
+            if timeout_us <= 0 or in_ISR:
+                return False
+            start = utime.ticks_us ()
+            while self.full ():
+                if utime.ticks_diff (utime.ticks_us (), start) >= timeout_us:
+                    return False
+        self.put (item, in_ISR)
+        return True
+
+
+    ## Read an item from the queue if there is one.
+    #
+    #  Unlike @c get(), this method returns rather than waiting forever if
+    #  the queue is empty. It can wait for up to a given time for an item,
+    #  which is only useful if the queue is filled by an interrupt.
+    #  @code
+    #     item = my_queue.try_get ()
+    #     if item != None:
+    #         do_something_with (item)
+    #  @endcode
+    #  @param timeout_us The longest time in microseconds to wait for an
+    #         item, or 0 not to wait
+    #  @param default The value to return if there's no item
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return The item read, or @c default if the queue was empty
+    @micropython.native
+    def try_get (self, timeout_us = 0, default = None, in_ISR = False):
+        if self.empty ():
+            self._empty_count += 1
+            if timeout_us <= 0 or in_ISR:
+                return default
+            start = utime.ticks_us ()
+            while self.empty ():
+                if utime.ticks_diff (utime.ticks_us (), start) >= timeout_us:
+                    return default
+        return self.get (in_ISR)
+
+
     ## Check if there are any items in the queue.
     # 
     #  Returns @c True if there are any items in the queue and @c False
@@ -282,21 +465,433 @@ class Queue (BaseShare):
         return (self._num_items)
 
 
+    ## Put the items of a sequence into the queue.
+    #
+    #  This puts items as @c put() does, but with one call for the lot. It
+    #  never waits for room: if the queue fills and the @c overwrite
+    #  constructor parameter wasn't set, the items which don't fit are left
+    #  out, and the number which were put tells the caller where to resume.
+    #  @param items A sequence, such as an array or a tuple, of items
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return The number of items put into the queue
+    @micropython.native
+    def put_many (self, items, in_ISR = False):
+        count = len (items)
+        if count > self._size - self._num_items:
+            self._full_count += 1
+            if not self._overwrite:
+                count = self._size - self._num_items
+
+        if self._thread_protect and not in_ISR:
+            irq_state = disable_irq ()
+
+        buf = self._buffer
+        wr_idx = self._wr_idx
+        for index in range (count):
+            buf[wr_idx] = items[index]
+            wr_idx += 1
+            if wr_idx >= self._size:
+                wr_idx = 0
+        self._wr_idx = wr_idx
+        self._num_items += count
+        if self._num_items >= self._size:
+            # Overwritten items are dropped from the read end
+            self._num_items = self._size
+            self._rd_idx = wr_idx
+        if self._num_items > self._max_full:
+            self._max_full = self._num_items
+
+        if self._thread_protect and not in_ISR:
+            enable_irq (irq_state)
+
+        if count:
+            if self._stats:
+                self._count_put (count, in_ISR)
+            for task in self._watchers:
+                task.go ()
+        return count
+
+
+    ## Move items from the queue into an array.
+    #
+    #  As many items as are in the queue, up to the length of the array, are
+    #  removed and copied into the start of the array. The items' bytes are
+    #  copied, so no memory is allocated even for a queue of floats. This
+    #  method doesn't wait for items.
+    #  @param dest An array of the queue's type code
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return The number of items copied into @c dest
+    @micropython.native
+    def get_into (self, dest, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = disable_irq ()
+
+        count = self._num_items
+        if count <= 0:
+            self._empty_count += 1
+        if count > len (dest):
+            count = len (dest)
+        first = self._size - self._rd_idx
+        if first > count:
+            first = count
+        size = self._itemsize
+        _copy_from (dest, self._buffer, self._rd_idx * size, first * size)
+        _copy_bytes (dest, first * size, self._buffer, (count - first) * size)
+        self._remove (count)
+
+        if self._thread_protect and not in_ISR:
+            enable_irq (irq_state)
+
+        if self._stats:
+            self._gets += count
+        return count
+
+
+    ## Get views of the items in the queue without copying or removing them.
+    #
+    #  The items in a ring buffer may wrap around the end of the buffer, so
+    #  the items are given as two memoryviews; the first holds the oldest
+    #  items and the second, which may be empty, those which wrapped around.
+    #  The views can be given straight to a UART's or a file's @c write().
+    #  Once they have been used, @c discard() removes the items from the
+    #  queue; nothing should be put into the queue until then, as it could
+    #  overwrite the items being viewed.
+    #  @return A tuple of two memoryviews holding the items in order
+    def views (self):
+        end = self._rd_idx + self._num_items
+        if end <= self._size:
+            return (self._view[self._rd_idx:end], self._view[0:0])
+        return (self._view[self._rd_idx:], self._view[0:end - self._size])
+
+
+    ## Remove items from the queue without reading them.
+    #
+    #  @param count The number of items to remove; if there are fewer items
+    #         than this in the queue, it is emptied
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    @micropython.native
+    def discard (self, count, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = disable_irq ()
+
+        if count > self._num_items:
+            count = self._num_items
+        self._remove (count)
+
+        if self._thread_protect and not in_ISR:
+            enable_irq (irq_state)
+
+
+    ## Write the contents of the queue to a stream and empty the queue.
+    #
+    #  The items are written as raw bytes, in the byte order of the
+    #  microcontroller, with at most two calls to the stream's @c write().
+    #  This is much faster than getting the items one at a time and writing
+    #  them as text.
+    #  @code
+    #  with open ("run.bin", "wb") as file:
+    #      my_queue.drain (file)
+    #  @endcode
+    #  @param stream A stream, such as a file or a @c UART, to write to
+    #  @return The number of items written
+    def drain (self, stream):
+        count = self.num_in ()
+        first, second = self.views ()
+        stream.write (first)
+        if len (second):
+            stream.write (second)
+        self.discard (count)
+        if self._stats:
+            self._gets += count
+        return count
+
+
+    ## Move the read pointer past a number of items which are in the queue.
+    #  @param count The number of items, no more than are in the queue
+    @micropython.native
+    def _remove (self, count):
+        self._rd_idx += count
+        if self._rd_idx >= self._size:
+            self._rd_idx -= self._size
+        self._num_items -= count
+
+
     ## Remove all contents from the queue.
+    #
+    #  The counts of attempts to read from the queue when it was empty and
+    #  to write to it when it was full are reset too.
     def clear (self):
         self._rd_idx = 0
         self._wr_idx = 0
         self._num_items = 0
         self._max_full = 0
+        self._empty_count = 0
+        self._full_count = 0
 
 
     ## This method puts diagnostic information about the queue into a string.
     # 
     #  It shows the queue's name and type as well as the maximum number of
-    #  items and queue size. 
+    #  items and queue size, and how many times the queue was found empty
+    #  by a read or full by a write.
     def __repr__ (self):
-        return ('{:<12s} Queue<{:s}> Max Full {:d}/{:d}'.format (self._name,
-                type_code_strings[self._type_code], self._max_full, self._size))
+        return ('{:<12s} Queue<{:s}> Max Full {:d}/{:d} Empty {:d} Full {:d}'
+                .format (self._name, type_code_strings[self._type_code],
+                         self._max_full, self._size, self._empty_count,
+                         self._full_count) + self._stats_str ())
+
+
+# ============================================================================
+
+## A queue between one writer and one reader which never disables interrupts.
+#
+#  A @c Queue made with @c thread_protect set turns interrupts off while it
+#  changes its pointers, as the writer and the reader both change the count
+#  of items. That delays any interrupt which comes in meanwhile. In this
+#  queue the writer only changes the write pointer and the reader only the
+#  read pointer, and each stores its pointer after it has moved the data,
+#  so the other side never sees a slot before it's ready. That is safe
+#  without turning interrupts off so long as there is exactly one writer
+#  and one reader, such as an ISR filling the queue and a task emptying it.
+#  @code
+#  adc_queue = task_share.SPSCQueue ('H', 100, name="ADC")
+#
+#  def adc_callback (timer):
+#      adc_queue.put (adc.read (), in_ISR=True)
+#
+#  def adc_task ():
+#      while True:
+#          while adc_queue.any ():
+#              process (adc_queue.get ())
+#          yield 0
+#  @endcode
+#
+#  The pointers count from 0 to twice the queue's size before wrapping, so
+#  a full queue can be told from an empty one without leaving a slot
+#  unused. Old data is never overwritten, as that would move the read
+#  pointer from the writer's side; a write to a full queue is dropped in
+#  an ISR and waits in a task, as for a @c Queue. The methods which only
+#  read, such as @c get(), @c get_into(), @c views() and @c discard(), may
+#  only be called by the reader, and the writing ones by the writer;
+#  @c clear() should only be called when neither side is using the queue.
+class SPSCQueue (Queue):
+
+    ## Create a queue to be written by one task or ISR and read by one other.
+    #
+    #  @param type_code The type of data items which the queue can hold, as
+    #         for a @c Queue
+    #  @param size The maximum number of items which the queue can hold
+    #  @param name A short name for the queue, default @c QueueN where @c N
+    #         is a serial number for the queue
+    #  @param stats @c True to count the queue's reads and writes, or
+    #         @c None to use the module's @c track_stats setting
+    def __init__ (self, type_code, size, name = None, stats = None):
+        self._span = 2 * size
+        super ().__init__ (type_code, size, False, False, name, stats)
+
+
+    ## Put an item into the queue.
+    #
+    #  If the queue is full, an ISR's item is dropped and counted; a task
+    #  waits for room, which only comes if the reader is an ISR.
+    #  @param item The item to be placed into the queue
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    @micropython.native
+    def put (self, item, in_ISR = False):
+        if self.full ():
+            self._full_count += 1
+            if in_ISR:
+                return
+            while self.full ():
+                pass
+
+        wr_idx = self._wr_idx
+        if wr_idx < self._size:
+            self._buffer[wr_idx] = item
+        else:
+            self._buffer[wr_idx - self._size] = item
+        wr_idx += 1
+        if wr_idx >= self._span:
+            wr_idx = 0
+        # Only now may the reader see the item
+        self._wr_idx = wr_idx
+
+        count = self.num_in ()
+        if count > self._max_full:
+            self._max_full = count
+        if self._stats:
+            self._count_put (1, in_ISR)
+        for task in self._watchers:
+            task.go ()
+
+
+    ## Read an item from the queue.
+    #
+    #  If the queue is empty, a task waits for an item, which only comes if
+    #  the writer is an ISR; an ISR gets @c None.
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return The oldest item in the queue
+    @micropython.native
+    def get (self, in_ISR = False):
+        if self.empty ():
+            self._empty_count += 1
+            if in_ISR:
+                return None
+            while self.empty ():
+                pass
+
+        rd_idx = self._rd_idx
+        if rd_idx < self._size:
+            to_return = self._buffer[rd_idx]
+        else:
+            to_return = self._buffer[rd_idx - self._size]
+        rd_idx += 1
+        if rd_idx >= self._span:
+            rd_idx = 0
+        # Only now may the writer reuse the slot
+        self._rd_idx = rd_idx
+
+        if self._stats:
+            self._gets += 1
+        return to_return
+
+
+    ## Check if there are any items in the queue.
+    #  @return @c True if items are in the queue, @c False if not
+    @micropython.native
+    def any (self):
+        return self._wr_idx != self._rd_idx
+
+
+    ## Check if the queue is empty.
+    #  @return @c True if queue is empty, @c False if it's not empty
+    @micropython.native
+    def empty (self):
+        return self._wr_idx == self._rd_idx
+
+
+    ## Check if the queue is full.
+    #  @return @c True if the queue is full
+    @micropython.native
+    def full (self):
+        return self.num_in () >= self._size
+
+
+    ## Check how many items are in the queue.
+    #
+    #  The writer or reader may change the count right after it's found,
+    #  but only the writer can make it larger and only the reader smaller.
+    #  @return The number of items in the queue
+    @micropython.native
+    def num_in (self):
+        count = self._wr_idx - self._rd_idx
+        if count < 0:
+            count += self._span
+        return count
+
+
+    ## Put the items of a sequence into the queue.
+    #
+    #  This puts as many items as there is room for and never waits. The
+    #  reader sees all of the items at once, when the write pointer is
+    #  stored after they have been copied.
+    #  @param items A sequence, such as an array or a tuple, of items
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return The number of items put into the queue
+    @micropython.native
+    def put_many (self, items, in_ISR = False):
+        count = len (items)
+        room = self._size - self.num_in ()
+        if count > room:
+            self._full_count += 1
+            count = room
+
+        buf = self._buffer
+        size = self._size
+        wr_idx = self._wr_idx
+        for index in range (count):
+            if wr_idx < size:
+                buf[wr_idx] = items[index]
+            else:
+                buf[wr_idx - size] = items[index]
+            wr_idx += 1
+            if wr_idx >= self._span:
+                wr_idx = 0
+        self._wr_idx = wr_idx
+
+        if count:
+            filled = self.num_in ()
+            if filled > self._max_full:
+                self._max_full = filled
+            if self._stats:
+                self._count_put (count, in_ISR)
+            for task in self._watchers:
+                task.go ()
+        return count
+
+
+    ## Move items from the queue into an array without allocating memory.
+    #  @param dest An array of the queue's type code
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return The number of items copied into @c dest
+    @micropython.native
+    def get_into (self, dest, in_ISR = False):
+        count = self.num_in ()
+        if count <= 0:
+            self._empty_count += 1
+        if count > len (dest):
+            count = len (dest)
+        rd_idx = self._rd_idx
+        if rd_idx >= self._size:
+            rd_idx -= self._size
+        first = self._size - rd_idx
+        if first > count:
+            first = count
+        size = self._itemsize
+        _copy_from (dest, self._buffer, rd_idx * size, first * size)
+        _copy_bytes (dest, first * size, self._buffer, (count - first) * size)
+        self._remove (count)
+
+        if self._stats:
+            self._gets += count
+        return count
+
+
+    ## Get views of the items in the queue without copying or removing them.
+    #
+    #  Items put after this call aren't in the views, and can't overwrite
+    #  the ones which are until @c discard() is called.
+    #  @return A tuple of two memoryviews holding the items in order
+    def views (self):
+        rd_idx = self._rd_idx
+        if rd_idx >= self._size:
+            rd_idx -= self._size
+        end = rd_idx + self.num_in ()
+        if end <= self._size:
+            return (self._view[rd_idx:end], self._view[0:0])
+        return (self._view[rd_idx:], self._view[0:end - self._size])
+
+
+    ## Remove items from the queue without reading them.
+    #  @param count The number of items to remove; if there are fewer items
+    #         than this in the queue, it is emptied
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    @micropython.native
+    def discard (self, count, in_ISR = False):
+        filled = self.num_in ()
+        if count > filled:
+            count = filled
+        self._remove (count)
+
+
+    ## Move the read pointer past a number of items which are in the queue.
+    #  @param count The number of items, no more than are in the queue
+    @micropython.native
+    def _remove (self, count):
+        rd_idx = self._rd_idx + count
+        if rd_idx >= self._span:
+            rd_idx -= self._span
+        self._rd_idx = rd_idx
 
 
 # ============================================================================
@@ -348,11 +943,16 @@ class Share (BaseShare):
     #  @param thread_protect True if mutual exclusion protection is used
     #  @param name A short name for the share, default @c ShareN where @c N
     #         is a serial number for the share
-    def __init__ (self, type_code, thread_protect = True, name = None):
+    #  @param stats @c True to count the share's reads and writes, or
+    #         @c None to use the module's @c track_stats setting
+    def __init__ (self, type_code, thread_protect = True, name = None,
+                  stats = None):
         # First call the parent class initializer
-        super ().__init__ (type_code, thread_protect, name)
+        super ().__init__ (type_code, thread_protect, name, stats)
 
         self._buffer = array.array (type_code, [0])
+        self._itemsize = len (bytes (self._buffer))
+        self._seq = 0
 
         self._name = str (name) if name != None \
             else 'Share' + str (Share.ser_num)
@@ -372,13 +972,19 @@ class Share (BaseShare):
 
         # Disable interrupts before writing the data
         if self._thread_protect and not in_ISR:
-            irq_state = pyb.disable_irq ()
+            irq_state = disable_irq ()
 
         self._buffer[0] = data
+        self._seq += 1
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
-            pyb.enable_irq (irq_state)
+            enable_irq (irq_state)
+
+        if self._stats:
+            self._count_put (1, in_ISR)
+        for task in self._watchers:
+            task.go ()
 
 
     ## Read an item of data from the share.
@@ -391,22 +997,427 @@ class Share (BaseShare):
     def get (self, in_ISR = False):
         # Disable interrupts before reading the data
         if self._thread_protect and not in_ISR:
-            irq_state = pyb.disable_irq ()
+            irq_state = disable_irq ()
 
         to_return = self._buffer[0]
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
-            pyb.enable_irq (irq_state)
+            enable_irq (irq_state)
 
+        if self._stats:
+            self._gets += 1
         return (to_return)
 
 
+    ## Find how many times the share has been written.
+    #
+    #  A task can keep this number and later pass it to @c changed_since()
+    #  to find out whether it needs to do its work again. Writes made through
+    #  the array given by @c buffer() aren't counted.
+    #  @return The number of calls to @c put() so far
+    @micropython.native
+    def version (self):
+        return self._seq
+
+
+    ## Check whether the share has been written since a version was read.
+    #
+    #  @code
+    #  seen = my_share.version ()
+    #  while True:
+    #      if my_share.changed_since (seen):
+    #          seen = my_share.version ()
+    #          do_something_with (my_share.get ())
+    #      yield 0
+    #  @endcode
+    #  @param version A number returned by @c version()
+    #  @return @c True if @c put() has been called since
+    @micropython.native
+    def changed_since (self, version):
+        return self._seq != version
+
+
+    ## Copy the share's data into an item of an array.
+    #
+    #  Calling @c get() on a share of floats creates a new float object each
+    #  time, which uses heap memory. This method copies the data's bytes
+    #  instead, so no memory is allocated; several shares can be gathered
+    #  into one array for viper or @c ulab code to work on.
+    #  @param dest An array of the share's type, made once by the caller
+    #  @param index The index of the item in @c dest into which to copy
+    #  @param in_ISR Set this to True if calling from within an ISR
+    @micropython.native
+    def read_into (self, dest, index = 0, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = disable_irq ()
+
+        _copy_bytes (dest, index * self._itemsize, self._buffer,
+                     self._itemsize)
+
+        if self._thread_protect and not in_ISR:
+            enable_irq (irq_state)
+
+        if self._stats:
+            self._gets += 1
+
+
+    ## Get the array which holds the share's data.
+    #
+    #  The data is item 0 of the array. Code which is called often can keep
+    #  the array and index it, saving the cost of a call to @c get() or
+    #  @c put(); viper code can read and write it through a pointer, such as
+    #  @c ptr32(buf)[0] for a 32-bit integer, without making objects at all.
+    #  Access through the array isn't protected from interrupts, so it
+    #  should only be used for shares which aren't written by an ISR or for
+    #  types no bigger than 32 bits, which are written in one instruction.
+    #  Nor is it counted by @c version() or the statistics, except that
+    #  getting the array counts as one read.
+    #  @code
+    #  line_follow_buf = line_follow.buffer ()
+    #  while True:
+    #      if line_follow_buf[0]:
+    #          ...
+    #  @endcode
+    #  @return The share's @c array.array of one item
+    def buffer (self):
+        if self._stats:
+            self._gets += 1
+        return self._buffer
+
+
     ## Puts diagnostic information about the share into a string.
     #
-    #  Shares are pretty simple, so we just put the name and type. 
+    #  Shares are pretty simple, so we just put the name and type, and the
+    #  statistics if they're kept.
     def __repr__ (self):
         return ("{:<12s} Share<{:s}>".format (self._name,
-                type_code_strings[self._type_code]))
+                type_code_strings[self._type_code]) + self._stats_str ())
+
+
+
+
+# ============================================================================
+
+## A group of data items which are written and read together.
+#  This class holds several values of one data type, such as a robot's
+#  position and heading, so that a task reading them always gets values
+#  which were written at the same time. Reading three separate shares can
+#  give a position from one update and a heading from the next if the writer
+#  runs in between.
+#
+#  Each write increments a sequence counter before and after the values are
+#  changed. A reader copies the values and checks that the counter was even
+#  and didn't change while it copied, trying again if it did; readers never
+#  disable interrupts. @c read_into() copies into an array owned by the
+#  caller, so reading the record allocates no memory.
+#
+#  An example of the creation and use of a record is as follows:
+#  @code
+#  import array
+#  import task_share
+#
+#  pose = task_share.Record ('f', ('x', 'y', 'yaw'), name="Pose")
+#
+#  # In the task which finds the pose
+#  pose.put ((x, y, yaw))
+#
+#  # In a task which uses it; the array is made once, before the loop
+#  my_pose = array.array ('f', (0, 0, 0))
+#  pose.read_into (my_pose)
+#  @endcode
+class Record (BaseShare):
+
+    ## A counter used to give serial numbers to records for diagnostic use.
+    ser_num = 0
+
+    ## Create a record holding a number of data items.
+    #
+    #  All the fields hold data of one type, given by a type code as for a
+    #  @c Share.
+    #  @param type_code The type of data items which the record holds
+    #  @param fields A sequence of names of the fields, in the order in which
+    #         their values are put and read
+    #  @param thread_protect @c True if interrupts are disabled while the
+    #         record is written, needed if an interrupt may also write it
+    #  @param name A short name for the record, default @c RecordN where
+    #         @c N is a serial number for the record
+    #  @param stats @c True to count the record's reads and writes, or
+    #         @c None to use the module's @c track_stats setting
+    def __init__ (self, type_code, fields, thread_protect = True,
+                  name = None, stats = None):
+        # First call the parent class initializer
+        super ().__init__ (type_code, thread_protect, name, stats)
+
+        self._fields = tuple (fields)
+        self._buffer = array.array (type_code, [0] * len (self._fields))
+        self._nbytes = len (bytes (self._buffer))
+        self._seq = 0
+
+        self._name = str (name) if name != None \
+            else 'Record' + str (Record.ser_num)
+        Record.ser_num += 1
+
+
+    ## Find the position of a field in the record.
+    #
+    #  The position can be used to pick the field's value out of an array
+    #  filled by @c read_into(); look it up once rather than at every read.
+    #  @param field The name of the field
+    #  @return The index of the field
+    def index (self, field):
+        return self._fields.index (field)
 
 
+    ## Write all of the fields of the record.
+    #
+    #  @param values A sequence, such as a tuple or an array, holding a value
+    #         for each field in order
+    #  @param in_ISR Set this to True if calling from within an ISR
+    @micropython.native
+    def put (self, values, in_ISR = False):
+
+        # Disable interrupts before writing the data
+        if self._thread_protect and not in_ISR:
+            irq_state = disable_irq ()
+
+        # An odd sequence number tells readers a write is under way
+        self._seq += 1
+        buf = self._buffer
+        for index in range (len (buf)):
+            buf[index] = values[index]
+        self._seq += 1
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            enable_irq (irq_state)
+
+        if self._stats:
+            self._count_put (1, in_ISR)
+        for task in self._watchers:
+            task.go ()
+
+
+    ## Copy all of the fields of the record into an array.
+    #
+    #  The values are copied as raw bytes, so no memory is allocated. If
+    #  the record is written while it is being copied, which can only happen
+    #  when the writer is an interrupt, the copy is made again.
+    #
+    #  An interrupt can't wait for a task to finish writing, so when called
+    #  from an ISR which interrupted a write, the array is left as it was.
+    #  @param dest An array of the record's type with at least one item for
+    #         each field
+    #  @param in_ISR Set this to True if calling from within an ISR
+    #  @return The number of times the record has been written, or @c None
+    #          if the record was being written and @c in_ISR is @c True
+    @micropython.native
+    def read_into (self, dest, in_ISR = False):
+        if len (dest) < len (self._buffer):
+            raise ValueError ("Array too short for record")
+        while True:
+            seq = self._seq
+            if seq & 1:
+                if in_ISR:
+                    return None
+            else:
+                _copy_bytes (dest, 0, self._buffer, self._nbytes)
+                if self._seq == seq:
+                    if self._stats:
+                        self._gets += 1
+                    return seq >> 1
+
+
+    ## Read one field of the record.
+    #
+    #  This is handy when only one value is needed; to read several fields
+    #  which belong together, use @c read_into().
+    #  @param index The index of the field, as given by @c index()
+    @micropython.native
+    def get (self, index):
+        if self._stats:
+            self._gets += 1
+        return self._buffer[index]
+
+
+    ## Find how many times the record has been written.
+    #
+    #  A task can compare this with the value from its last read to find
+    #  whether the record has been written since.
+    #  @return The number of writes to the record
+    @micropython.native
+    def version (self):
+        return self._seq >> 1
+
+
+    ## Check whether the record has been written since a version was read.
+    #
+    #  @param version A number returned by @c version() or @c read_into()
+    #  @return @c True if @c put() has been called since
+    @micropython.native
+    def changed_since (self, version):
+        return self._seq >> 1 != version
+
+
+    ## Puts diagnostic information about the record into a string.
+    #
+    #  It shows the record's name, type and fields and how many times it
+    #  has been written.
+    def __repr__ (self):
+        return ("{:<12s} Record<{:s}> ({:s}) Writes {:d}".format (self._name,
+                type_code_strings[self._type_code], ', '.join (self._fields),
+                self._seq >> 1) + self._stats_str ())
+
+
+# ============================================================================
+
+## A record which tasks find by name rather than being handed it.
+#  Topics are kept in the dictionary @c topics under their names. A task
+#  which produces data, such as the wheel positions and speeds, publishes
+#  it with @c put(); any task which needs the data subscribes to the topic
+#  when it starts, without the topic having to be passed to it in its
+#  shares. Each subscriber has its own copy of the values and keeps track
+#  of which publication it last read.
+#
+#  The diagnostic printout of a topic shows how often it is published and
+#  how many subscribers it has.
+#  @code
+#  import task_share
+#
+#  # When setting up, before the tasks are run
+#  task_share.Topic ("pose", 'f', ('x', 'y', 'yaw'))
+#
+#  # In the task which finds the pose
+#  pose = task_share.topics["pose"]
+#  while True:
+#      pose.put ((x, y, yaw))
+#      yield 0
+#
+#  # In a task which uses it
+#  pose = task_share.subscribe ("pose")
+#  while True:
+#      if pose.read ():
+#          do_something_with (pose.values[0])
+#      yield 0
+#  @endcode
+class Topic (Record):
+
+    ## Create a topic and add it to the dictionary of topics.
+    #  @param name The name by which tasks find the topic
+    #  @param type_code The type of data items which the topic holds
+    #  @param fields A sequence of names of the fields, in the order in which
+    #         their values are published
+    #  @param thread_protect @c True if interrupts are disabled while the
+    #         topic is written, needed if an interrupt may also publish it
+    #  @param stats @c True to count the topic's reads and writes, or
+    #         @c None to use the module's @c track_stats setting
+    def __init__ (self, name, type_code, fields, thread_protect = True,
+                  stats = None):
+        if name in topics:
+            raise ValueError ("Topic '{:s}' already exists".format (name))
+        super ().__init__ (type_code, fields, thread_protect, name, stats)
+        self._subscribers = []
+        self._first_ms = 0
+        self._last_ms = 0
+        topics[name] = self
+
+
+    ## Publish new values of all the fields of the topic.
+    #
+    #  @param values A sequence holding a value for each field in order
+    #  @param in_ISR Set this to True if calling from within an ISR
+    @micropython.native
+    def put (self, values, in_ISR = False):
+        Record.put (self, values, in_ISR)
+
+        # Keep the times of the first and latest publications for the rate
+        self._last_ms = utime.ticks_ms ()
+        if self._seq == 2:
+            self._first_ms = self._last_ms
+
+
+    ## Make a new subscriber to this topic.
+    #  @return A @c Subscriber which reads this topic
+    def subscribe (self):
+        subscriber = Subscriber (self)
+        self._subscribers.append (subscriber)
+        return subscriber
+
+
+    ## Find how often the topic has been published since it was first
+    #  published.
+    #  @return The average rate of publication in Hz, or 0 if the topic has
+    #          been published fewer than two times
+    def rate (self):
+        span = utime.ticks_diff (self._last_ms, self._first_ms)
+        if span <= 0:
+            return 0.0
+        return ((self._seq >> 1) - 1) * 1000.0 / span
+
+
+    ## Puts diagnostic information about the topic into a string.
+    #
+    #  It shows the topic's name, type and fields, how many times and how
+    #  often it has been published, and how many subscribers it has and how
+    #  many publications they have missed between them.
+    def __repr__ (self):
+        missed = sum (sub.missed for sub in self._subscribers)
+        return ("{:<12s} Topic<{:s}> ({:s}) Writes {:d} Rate {:.1f} Hz "
+                "Subs {:d} Missed {:d}".format (self._name,
+                type_code_strings[self._type_code], ', '.join (self._fields),
+                self._seq >> 1, self.rate (), len (self._subscribers),
+                missed) + self._stats_str ())
+
+
+## A task's connection to a @c Topic.
+#  A subscriber holds an array, @c values, into which @c read() copies the
+#  topic's fields, and remembers which publication it read last so that it
+#  can tell whether there is anything new.
+class Subscriber:
+
+    ## Create a subscriber to a topic. Subscribers are made by calling
+    #  @c Topic.subscribe() or @c subscribe() rather than directly.
+    #  @param topic The topic to be read
+    def __init__ (self, topic):
+        self.topic = topic
+
+        ## The values of the topic's fields as of the last call to @c read()
+        self.values = array.array (topic._type_code, [0] * len (topic._fields))
+
+        ## The number of publications which were made but never read
+        self.missed = 0
+
+        # Start with the topic's present values, so only later publications
+        # count as new or missed
+        self._seen = topic.read_into (self.values)
+
+
+    ## Check whether the topic has been published since it was last read.
+    #  @return @c True if there is a publication which hasn't been read
+    @micropython.native
+    def fresh (self):
+        return self.topic.changed_since (self._seen)
+
+
+    ## Copy the latest values of the topic into @c values.
+    #
+    #  The values are copied even if they haven't changed, so @c values is
+    #  always up to date after this call.
+    #  @param in_ISR Set this to True if calling from within an ISR
+    #  @return @c True if the topic had been published since the last read
+    @micropython.native
+    def read (self, in_ISR = False):
+        version = self.topic.read_into (self.values, in_ISR)
+        if version == None or version == self._seen:
+            return False
+        self.missed += version - self._seen - 1
+        self._seen = version
+        return True
+
+
+## Subscribe to a topic by name.
+#  @param name The name of the topic
+#  @return A new @c Subscriber to the topic
+#  @throws KeyError if there is no topic with the given name
+def subscribe (name):
+    return topics[name].subscribe ()
@@ -0,0 +1,446 @@
+"""!
+@file telemetry.py
+This file contains a @c FrameWriter, which sends data from the board to a
+PC as compact binary frames, and the layout of the frames, which
+@c telemetry_decode.py on the PC reads.
+
+Each frame holds a 4-byte header, made of the kind of frame, a sequence
+number which counts frames modulo 256 so the PC can tell when frames were
+lost, and the length of the payload; then the payload; then a CRC-16
+(CCITT, initial value 0xFFFF) of the header and payload. All numbers are
+little-endian, as in the microcontroller's memory, so arrays of data are
+sent as they are. The frame is then COBS encoded, which replaces every zero
+byte, and ended with a zero byte; a receiver which starts listening partway
+through a frame or loses a byte finds the start of the next frame at the
+next zero.
+
+Recorded data is sent column by column: a @c KIND_SCHEMA frame names each
+channel and gives its array type code, @c KIND_COLUMN frames carry runs of
+a channel's samples copied straight from its buffer, and a @c KIND_END
+frame ends the set. If the recording was frozen by a trigger, the end
+frame gives the index of the trigger's row and what caused it.
+
+Live data is sent row by row by a @c Streamer: @c KIND_SCHEMA frames name
+the channels, then each @c KIND_SAMPLE frame carries the time of one row
+and one float per channel.
+"""
+
+import struct
+import utime
+import micropython
+from array import array
+from micropython import const
+
+## A frame naming a channel: channel number and type code, then the name
+KIND_SCHEMA = const(1)
+
+## A frame of samples: channel number, type code and the index of the first
+#  sample, then the samples
+KIND_COLUMN = const(2)
+
+## A frame ending a set of columns; its payload is empty, or the index of
+#  the row at which the recording was triggered, then the trigger's reason
+KIND_END = const(3)
+
+## A frame holding one row of live samples: a timestamp, then one float per
+#  channel in channel order
+KIND_SAMPLE = const(4)
+
+## The layout of the header at the start of every frame
+HEADER = '<BBH'
+
+## The layout of the start of the payload of a @c KIND_SCHEMA frame
+SCHEMA_HEADER = '<BB'
+
+## The layout of the start of the payload of a @c KIND_COLUMN frame
+COLUMN_HEADER = '<BBI'
+
+## The layout of the start of the payload of a @c KIND_END frame which
+#  reports a trigger
+END_HEADER = '<I'
+
+## The layout of the start of the payload of a @c KIND_SAMPLE frame
+SAMPLE_HEADER = '<I'
+
+## The size of the header in bytes
+_HEADER_SIZE = const(4)
+
+## The size of the CRC at the end of each frame in bytes
+_CRC_SIZE = const(2)
+
+
+@micropython.viper
+def _copy_into(dest, start: int, source, nbytes: int):
+    """!
+    Copy bytes from one buffer into another without allocating memory.
+    @param dest The buffer into which to copy
+    @param start The index in @c dest of the first byte to be written
+    @param source The buffer from which bytes are copied
+    @param nbytes The number of bytes to copy
+    """
+    to_buf = ptr8(dest)
+    from_buf = ptr8(source)
+    for index in range(nbytes):
+        to_buf[start + index] = from_buf[index]
+
+
+def _crc_table():
+    """!
+    Make the table of the CRC-16/CCITT-FALSE of each byte, which lets
+    @c crc16() take a byte at a time rather than a bit at a time.
+    @returns A bytearray holding 256 CRCs, each high byte first
+    """
+    table = bytearray(512)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table[2 * byte] = crc >> 8
+        table[2 * byte + 1] = crc & 0xFF
+    return table
+
+
+## The CRC of each byte, made once when this module is imported
+_CRC_TABLE = _crc_table()
+
+
+@micropython.viper
+def crc16(source, nbytes: int) -> int:
+    """!
+    Find the CRC-16/CCITT-FALSE of the start of a buffer.
+    @param source The buffer holding the data
+    @param nbytes The number of bytes at the start of @c source to check
+    @returns The CRC, from 0 to 0xFFFF
+    """
+    data = ptr8(source)
+    table = ptr8(_CRC_TABLE)
+    crc = 0xFFFF
+    for index in range(nbytes):
+        entry = ((crc >> 8) ^ data[index]) << 1
+        crc = ((crc << 8) & 0xFF00) ^ (table[entry] << 8) ^ table[entry + 1]
+    return crc
+
+
+@micropython.viper
+def _cobs_encode(dest, source, nbytes: int) -> int:
+    """!
+    COBS encode the start of a buffer and put a zero byte after it.
+    @param dest The buffer to hold the encoded bytes, which needs room for
+           @c nbytes plus one byte for every 254 plus two
+    @param source The buffer holding the bytes to be encoded
+    @param nbytes The number of bytes to encode
+    @returns The number of bytes put into @c dest, including the zero
+    """
+    out = ptr8(dest)
+    data = ptr8(source)
+    code_idx = 0
+    out_idx = 1
+    code = 1
+    for index in range(nbytes):
+        byte = data[index]
+        if byte == 0:
+            out[code_idx] = code
+            code_idx = out_idx
+            out_idx += 1
+            code = 1
+        else:
+            out[out_idx] = byte
+            out_idx += 1
+            code += 1
+            if code == 0xFF:
+                out[code_idx] = code
+                code_idx = out_idx
+                out_idx += 1
+                code = 1
+    out[code_idx] = code
+    out[out_idx] = 0
+    return out_idx + 1
+
+
+class FrameWriter:
+    """!
+    @brief   Builds frames in preallocated buffers and writes them to a
+             stream such as a UART or a file.
+    @details A frame is begun with @c start(), filled with @c pack() and
+             @c add(), and sent with @c send(). Building a frame allocates
+             no memory except for the tuple of numbers given to @c pack(),
+             which @c pack_value() avoids, and a view of the encoded frame
+             when a frame's size differs from the last one's, so frames can
+             be sent from a task making little garbage.
+             @code
+             writer = telemetry.FrameWriter()
+             writer.send_schema(uart, 0, 'f', "yaw")
+             writer.send_column(uart, 0, 'f', 0, yaw_array)
+             writer.send_end(uart)
+             @endcode
+    """
+
+    def __init__(self, max_payload=256):
+        """!
+        @brief   Allocate the buffers for frames of up to a given size.
+        @param   max_payload The largest payload in bytes which a frame may
+                 carry
+        """
+        ## The largest payload in bytes which a frame may carry
+        self.max_payload = max_payload
+        ## The number of frames sent, modulo 256
+        self.seq = 0
+        self._raw = bytearray(_HEADER_SIZE + max_payload + _CRC_SIZE)
+        raw_size = len(self._raw)
+        self._encoded = bytearray(raw_size + raw_size // 254 + 2)
+        self._view = memoryview(self._encoded)
+        # The view of the last frame sent, kept for the next frame of the
+        # same size
+        self._frame = self._view[:0]
+        self._kind = 0
+        self._length = 0
+
+    def start(self, kind):
+        """!
+        @brief   Begin a frame with an empty payload.
+        @param   kind The kind of frame, such as @c KIND_COLUMN
+        """
+        self._kind = kind
+        self._length = 0
+
+    def room(self):
+        """!
+        @returns The number of bytes which can still be added to the payload
+        """
+        return self.max_payload - self._length
+
+    def pack(self, fmt, *values):
+        """!
+        @brief   Add numbers to the payload as @c struct.pack() would.
+        @param   fmt The @c struct format of the numbers
+        @param   values The numbers
+        @raises  ValueError if the payload would be too long
+        """
+        size = struct.calcsize(fmt)
+        if size > self.room():
+            raise ValueError("frame payload too long")
+        struct.pack_into(fmt, self._raw, _HEADER_SIZE + self._length, *values)
+        self._length += size
+
+    def pack_value(self, fmt, value):
+        """!
+        @brief   Add one number to the payload, without the tuple which
+                 @c pack() makes of its numbers.
+        @param   fmt The @c struct format of the number, such as @c '<I'
+        @param   value The number
+        @raises  ValueError if the payload would be too long
+        """
+        size = struct.calcsize(fmt)
+        if size > self.room():
+            raise ValueError("frame payload too long")
+        struct.pack_into(fmt, self._raw, _HEADER_SIZE + self._length, value)
+        self._length += size
+
+    def add(self, data, itemsize=1):
+        """!
+        @brief   Copy the contents of a buffer into the payload.
+        @param   data A buffer such as a @c bytes, an @c array.array or a
+                 @c memoryview of one
+        @param   itemsize The size in bytes of each item of @c data, such
+                 as 4 for an array of floats
+        @raises  ValueError if the payload would be too long
+        """
+        nbytes = len(data) * itemsize
+        if nbytes > self.room():
+            raise ValueError("frame payload too long")
+        _copy_into(self._raw, _HEADER_SIZE + self._length, data, nbytes)
+        self._length += nbytes
+
+    def max_frame_size(self):
+        """!
+        @returns The most bytes which a frame, once encoded and ended with a
+                 zero, may take
+        """
+        return len(self._encoded)
+
+    def send(self, stream):
+        """!
+        @brief   Finish the frame and write it to a stream.
+        @param   stream A stream, such as a @c machine.UART or a file, with
+                 a @c write() method
+        @returns The number of bytes written, including framing
+        """
+        struct.pack_into(HEADER, self._raw, 0, self._kind, self.seq,
+                         self._length)
+        end = _HEADER_SIZE + self._length
+        struct.pack_into('<H', self._raw, end, crc16(self._raw, end))
+        size = _cobs_encode(self._encoded, self._raw, end + _CRC_SIZE)
+        if size != len(self._frame):
+            self._frame = self._view[:size]
+        stream.write(self._frame)
+        self.seq = (self.seq + 1) & 0xFF
+        return size
+
+    def resync(self, stream):
+        """!
+        @brief   Write a lone zero byte, which ends anything sent before it
+                 such as printed text, so the next frame is read cleanly.
+        @param   stream The stream to write to
+        """
+        stream.write(b'\x00')
+
+    def send_schema(self, stream, channel, type_code, name):
+        """!
+        @brief   Send a frame naming a channel.
+        @param   stream The stream to write to
+        @param   channel The channel's number, from 0 to 255
+        @param   type_code The @c array type code of the channel's samples
+        @param   name The channel's name
+        @returns The number of bytes written
+        """
+        self.start(KIND_SCHEMA)
+        self.pack(SCHEMA_HEADER, channel, ord(type_code))
+        self.add(name.encode())
+        return self.send(stream)
+
+    def send_column(self, stream, channel, type_code, first, data):
+        """!
+        @brief   Send a frame of samples of a channel.
+        @param   stream The stream to write to
+        @param   channel The channel's number
+        @param   type_code The @c array type code of the samples
+        @param   first The index of the first sample in the channel's data,
+                 which lets the samples be sent in several frames
+        @param   data An array or memoryview of the samples, no more than
+                 fit in a frame; see @c column_room()
+        @returns The number of bytes written
+        """
+        self.start(KIND_COLUMN)
+        self.pack(COLUMN_HEADER, channel, ord(type_code), first)
+        self.add(data, struct.calcsize(type_code))
+        return self.send(stream)
+
+    def column_room(self, type_code):
+        """!
+        @returns The number of samples of a type which fit in one column
+                 frame
+        """
+        return ((self.max_payload - struct.calcsize(COLUMN_HEADER))
+                // struct.calcsize(type_code))
+
+    def send_end(self, stream, trigger_row=-1, reason=None):
+        """!
+        @brief   Send a frame marking the end of a set of columns.
+        @param   stream The stream to write to
+        @param   trigger_row The index of the row at which the recording was
+                 triggered, or -1 if it wasn't
+        @param   reason The name of the trigger's cause, such as @c "bump"
+        @returns The number of bytes written
+        """
+        self.start(KIND_END)
+        if trigger_row >= 0:
+            self.pack(END_HEADER, trigger_row)
+            if reason:
+                self.add(reason.encode())
+        return self.send(stream)
+
+
+class Streamer:
+    """!
+    @brief   Sends rows of float samples to a UART as they are taken,
+             dropping rows rather than waiting for the UART.
+    @details Each row is copied from the array @c row into a frame built in
+             a preallocated buffer. Every row's frame is the same size, so
+             once the first has been sent a row allocates no memory but the
+             stamp, if it is too large for a small integer. Before a row is
+             sent the UART is checked with @c txdone(); if it is still
+             sending, such as an earlier frame or printed text, the row is
+             dropped rather than waiting behind that output. The row's own
+             frame is still written at the UART's pace, as the board's
+             UART has no buffer to send from: a row of 8 channels is 44
+             bytes, which hold up the task about 4 ms at 115200 baud. The
+             first calls to @c send() after @c restart()
+             send a frame naming one channel each rather than a row.
+             @code
+             streamer = telemetry.Streamer(("x", "y"))
+             ...
+             streamer.row[0] = x
+             streamer.row[1] = y
+             streamer.send(uart, timestamp.stamp())
+             @endcode
+    """
+
+    def __init__(self, names):
+        """!
+        @brief   Allocate the buffers for rows of the given channels.
+        @param   names A sequence of the names of the channels, whose samples
+                 are floats
+        """
+        ## The names of the channels, in the order of the values in a row
+        self.names = names
+        ## The array into which the samples of each row are put
+        self.row = array('f', (0 for _ in names))
+        # Frames must fit a row or the longest channel name
+        self._writer = FrameWriter(max(
+            struct.calcsize(SAMPLE_HEADER) + 4 * len(names),
+            struct.calcsize(SCHEMA_HEADER) + max(len(name) for name in names)))
+        self._schema_left = 0
+        self.restart()
+
+    def restart(self):
+        """!
+        @brief   Send the channels' names again before the next rows and
+                 start counting rows afresh, as when streaming is resumed.
+        """
+        self._schema_left = len(self.names)
+        self.clear_counts()
+
+    def clear_counts(self):
+        """!
+        @brief   Start counting the rows sent and dropped afresh, so that
+                 @c rate() covers the time from now on.
+        """
+        ## The number of rows sent since the counts were cleared
+        self.sent = 0
+        ## The number of rows dropped because the UART was busy
+        self.dropped = 0
+        self._start_ms = utime.ticks_ms()
+
+    @micropython.native
+    def send(self, uart, stamp):
+        """!
+        @brief   Send the row in @c row, unless the UART is busy.
+        @param   uart The UART to write to, which has a @c txdone() method
+        @param   stamp The time at which the row's samples were taken, such
+                 as from @c timestamp.stamp()
+        @returns @c True if the row was sent, @c False if it was dropped or
+                 a channel name was sent in its place
+        """
+        if not uart.txdone():
+            self.dropped += 1
+            return False
+        writer = self._writer
+        if self._schema_left:
+            channel = len(self.names) - self._schema_left
+            if channel == 0:
+                # End any text written before, so the first name isn't lost
+                writer.resync(uart)
+            writer.send_schema(uart, channel, 'f', self.names[channel])
+            self._schema_left -= 1
+            return False
+        writer.start(KIND_SAMPLE)
+        writer.pack_value(SAMPLE_HEADER, stamp)
+        writer.add(self.row, 4)
+        writer.send(uart)
+        self.sent += 1
+        return True
+
+    def rate(self):
+        """!
+        @returns The rate at which rows have been sent, in rows per second,
+                 since the counts were cleared
+        """
+        elapsed = utime.ticks_diff(utime.ticks_ms(), self._start_ms)
+        return self.sent * 1000 / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return ("Streamer: {:.1f} rows/s, {:d} sent, {:d} dropped"
+                .format(self.rate(), self.sent, self.dropped))
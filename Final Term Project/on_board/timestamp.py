@@ -0,0 +1,81 @@
+"""
+Microsecond timestamps kept in 32 bits, to be stored in 'L' shares and queues
+
+utime.ticks_us() wraps every 2**30 us (about 18 minutes), and a timestamp
+stored in a 16-bit 'H' share wraps every 65 ms. stamp() extends the ticks
+to a count of microseconds since reset() which only wraps every 2**32 us
+(about 71 minutes), and diff() finds the time between two stamps across
+that wrap. Each sensor sample should be stamped once, when it is read, and
+the stamp passed on with the data rather than taken again later.
+
+stamp() must be called at least once every 2**29 us (about 9 minutes) to
+keep track of the ticks; the tasks calling it every few milliseconds do.
+Stamps are wrapped by comparing them with 2**32 rather than by masking them,
+as the mask doesn't fit in a MicroPython small integer and each & with it
+would allocate memory. Taking a stamp and finding the time between stamps
+therefore allocate nothing for about the first 18 minutes; stamps of 2**30
+or more don't fit in a small integer either, so after that each stamp
+allocates a little memory.
+"""
+import utime
+from micropython import const
+
+# Stamps are kept modulo 2**32 so they fit in an 'L' share
+_STAMP_HALF = const(0x80000000)
+_STAMP_NEG_HALF = const(-0x80000000)
+_STAMP_PERIOD = const(0x100000000)
+
+_last_ticks = utime.ticks_us()  # ticks_us() when the last stamp was taken
+_last_stamp = 0  # The last stamp given out
+
+
+def reset():
+    """
+    Starts counting stamps from zero, such as at the start of a run
+
+    Returns:
+        none
+
+    """
+    global _last_ticks, _last_stamp
+    _last_ticks = utime.ticks_us()
+    _last_stamp = 0
+
+
+def stamp():
+    """
+    Takes a timestamp
+
+    Returns:
+        int: Microseconds since reset() was last called, modulo 2**32
+
+    """
+    global _last_ticks, _last_stamp
+    now = utime.ticks_us()
+    stamp = _last_stamp + utime.ticks_diff(now, _last_ticks)
+    if stamp >= _STAMP_PERIOD:
+        stamp -= _STAMP_PERIOD
+    _last_stamp = stamp
+    _last_ticks = now
+    return _last_stamp
+
+
+def diff(new, old):
+    """
+    Finds the time between two stamps, allowing for the stamps wrapping
+
+    Args:
+        new (int): The later stamp
+        old (int): The earlier stamp
+
+    Returns:
+        int: new - old in microseconds, negative if new was taken first; stamps
+            must be less than 2**31 us (about 36 minutes) apart
+
+    """
+    delta = new - old
+    if delta >= _STAMP_HALF:
+        delta -= _STAMP_PERIOD
+    elif delta < _STAMP_NEG_HALF:
+        delta += _STAMP_PERIOD
+    return delta
@@ -0,0 +1,660 @@
+"""!
+@file host_runner.py
+This file runs the Final Term Project's @c main.py, with the real @c cotask
+and @c task_share modules and the real task generators, on a PC. Time is
+kept by a @c vclock.VirtualClock, so a whole course run takes a few seconds
+or less, and at the end the CPU time used by each task is reported.
+
+The MicroPython modules which @c main.py uses are replaced by stand-ins:
+@c pyb pins, timers, ADCs and I2C, the UART from @c machine, the C queues
+of @c cqueue, @c gc, @c time, whose clock is the virtual one, and @c array,
+whose integer arrays wrap values which don't fit as MicroPython's do. The I2C
+bus holds a simple BNO055 which is always calibrated. A model of the Romi's
+motors turns the PWM efforts set by the motor tasks into encoder counts and
+the IMU's heading, so the control loops have something to control. The
+IMU task's @c ulab.numpy is supplied by numpy.
+
+The virtual clock doesn't move while Python code runs, so each run of a task
+is charged the host time it took multiplied by @c SLOWDOWN, plus the modeled
+time of any I2C and UART transfers, flash writes and sleeps it made. Run times are
+therefore only estimates, and differ a little from run to run; the order
+in which tasks run and the effects of the scheduling are modeled exactly.
+
+Run it from this folder with @c python @c host_runner.py; use @c -h to see
+the options.
+"""
+
+import argparse
+import array
+import builtins
+import collections
+import contextlib
+import io
+import math
+import os
+import runpy
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import types
+
+import numpy
+import vclock
+
+## The host's own timer, saved before @c time is replaced
+perf_counter = time.perf_counter
+
+## The host's own @c open(), saved before it is replaced
+host_open = builtins.open
+
+## The folder holding the on-board code
+ON_BOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        vclock.ON_BOARD)
+
+## How long the course run lasts, in simulated seconds
+SIM_TIME = 60
+
+## How many times slower the Nucleo's MicroPython runs task code than the
+#  PC's CPython does. It was chosen so that the modeled run times of the
+#  state estimator come out near those in the measured profile table.
+SLOWDOWN = 100
+
+## The characters typed at the UI task and when, in simulated seconds. An
+#  @c m starts the course; it is sent once the IMU is set up, as the UI task
+#  throws away anything which arrives before its first run.
+KEYS = ((1.0, "m"),)
+
+## The time taken by a call to @c gc.collect() on the Nucleo, in
+#  microseconds; an estimate, as it depends on how much of the heap is used
+GC_TIME_US = 1500
+
+## The time taken to write each 512-byte block to the Nucleo's flash
+#  filesystem, in microseconds; an estimate, matching the 20 ms which
+#  @c logger.py assumes for a 4 kB write before it has timed one
+FLASH_BLOCK_US = 2500
+
+## The I2C bus frequency in Hz, the default for @c pyb.I2C
+I2C_FREQ = 400000
+
+## Readings of the ADCs by pin. The battery reads as 8.4 V; the middle IR
+#  sensor of the array sees the line and the others see white.
+ADC_VALUES = {"C2": 3333, "C3": 300, "A4": 300, "B0": 300, "C1": 3000,
+              "C0": 300, "C4": 300, "C5": 300}
+
+## The motors of the Romi: the PWM timer, direction pin and sleep pin of
+#  each motor driver, and the timer which counts the encoder's pulses, as
+#  wired in @c main.py. The left wheel is first.
+WHEELS = ((17, "C9", "C8", 1),
+          (16, "A1", "A0", 3))
+
+## The steady wheel speed in encoder counts per second per percent of PWM
+#  effort, from the feed-forward constants of the motor controllers
+MOTOR_GAIN = 1 / (0.0677 * 0.25)
+
+## The time constant of the motors' speed response, in seconds
+MOTOR_TAU = 0.08
+
+## The distance travelled per encoder count, in millimeters
+MM_PER_COUNT = 0.153
+
+## The distance between the Romi's wheels, in millimeters
+WHEEL_WIDTH = 141
+
+
+## The simulated clock which runs the program
+clock = vclock.VirtualClock()
+
+
+class Romi:
+    """!
+    @brief   A model of the Romi's wheels and the state of the pins, timers
+             and devices through which the program sees them.
+    """
+
+    def __init__(self):
+        """!
+        @brief   Create the model with the Romi at rest.
+        """
+        ## Pin levels by pin name
+        self.pins = {}
+        ## Timers by number
+        self.timers = {}
+        ## The speed of each wheel in encoder counts per second, forward
+        self.speed = [0.0, 0.0]
+        ## The Romi's heading in radians, counterclockwise
+        self.heading = 0.0
+        ## The Romi's rate of turn in radians per second, counterclockwise
+        self.turn_rate = 0.0
+        self._last_us = 0
+
+    def effort(self, wheel):
+        """!
+        @brief   Find the PWM effort given to a wheel's motor.
+        @param   wheel An entry of @c WHEELS
+        @returns The effort in percent, negative for reverse, or zero if
+                 the driver is asleep
+        """
+        pwm_num, dir_pin, slp_pin, enc_num = wheel
+        timer = self.timers.get(pwm_num)
+        if not self.pins.get(slp_pin) or timer is None or 1 not in timer.channels:
+            return 0.0
+        percent = timer.channels[1].percent
+        return -percent if self.pins.get(dir_pin) else percent
+
+    def update(self):
+        """!
+        @brief   Move the model forward to the clock's current time.
+        """
+        dt = (clock.now_us - self._last_us) / 1000000
+        if dt <= 0:
+            return
+        self._last_us = clock.now_us
+        alpha = 1 - math.exp(-dt / MOTOR_TAU)
+        for idx, wheel in enumerate(WHEELS):
+            old = self.speed[idx]
+            self.speed[idx] += (self.effort(wheel) * MOTOR_GAIN - old) * alpha
+            encoder = self.timers.get(wheel[3])
+            if encoder is not None:
+                # The encoders count down as the wheels go forward
+                encoder.position -= (old + self.speed[idx]) / 2 * dt
+        self.turn_rate = ((self.speed[1] - self.speed[0]) * MM_PER_COUNT
+                          / WHEEL_WIDTH)
+        self.heading += self.turn_rate * dt
+
+
+## The model of the Romi which the stand-ins read and write
+romi = Romi()
+
+
+class _PinNames:
+    """!
+    Stand-in for @c Pin.cpu and @c Pin.board, whose attributes name pins.
+    """
+
+    def __getattr__(self, name):
+        return name
+
+
+class Pin:
+    """!
+    @brief   A stand-in for @c pyb.Pin which keeps its level in the model.
+    """
+    IN = 0
+    OUT_PP = 1
+    OUT_OD = 2
+    ALT = 3
+    ALT_OD = 4
+    ANALOG = 5
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+    cpu = _PinNames()
+    board = _PinNames()
+
+    def __init__(self, pin, mode=IN, pull=PULL_NONE, alt=-1, value=None):
+        """!
+        @brief   Set up a pin, given its name or another @c Pin.
+        """
+        self.name = pin.name if isinstance(pin, Pin) else pin
+        if value is not None:
+            romi.pins[self.name] = value
+        elif self.name not in romi.pins:
+            romi.pins[self.name] = 1 if pull == Pin.PULL_UP else 0
+
+    def value(self, level=None):
+        """!
+        @brief   Read the pin's level or set it.
+        """
+        if level is None:
+            return romi.pins[self.name]
+        romi.pins[self.name] = 1 if level else 0
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING):
+        """!
+        @brief   Accept an interrupt handler; the model's pins don't change
+                 by themselves, so it is never called.
+        """
+
+
+class TimerChannel:
+    """!
+    @brief   A stand-in for a @c pyb.Timer channel, which keeps its PWM
+             duty cycle.
+    """
+
+    def __init__(self, mode, pulse_width_percent=0):
+        self.mode = mode
+        ## The PWM duty cycle in percent
+        self.percent = pulse_width_percent or 0
+
+    def pulse_width_percent(self, percent=None):
+        """!
+        @brief   Read the PWM duty cycle or set it, limited to 0 to 100%.
+        """
+        if percent is None:
+            return self.percent
+        romi.update()
+        self.percent = min(max(percent, 0), 100)
+
+
+class Timer(vclock.VirtualTimer):
+    """!
+    @brief   A stand-in for @c pyb.Timer. A timer given a frequency ticks
+             on the virtual clock; one set up to count encoder pulses reads
+             the encoder position of the model.
+    """
+    PWM = 0
+    PWM_INVERTED = 1
+    OC_TIMING = 2
+    OC_TOGGLE = 3
+    IC = 4
+    ENC_A = 5
+    ENC_B = 6
+    ENC_AB = 7
+
+    def __init__(self, num, freq=None, prescaler=0, period=0xFFFF, **kwargs):
+        super().__init__(clock, num, freq=freq,
+                         source_freq=vclock.TIMER_SOURCE_FREQ)
+        if freq is None:
+            self._prescaler = prescaler
+            self._period = period
+        ## The channels which have been set up, by number
+        self.channels = {}
+        ## The encoder position counted by the timer, if it counts pulses
+        self.position = 0.0
+        romi.timers[num] = self
+
+    def channel(self, num, mode=PWM, pin=None, pulse_width_percent=0,
+                **kwargs):
+        """!
+        @brief   Set up a channel of the timer.
+        """
+        self.channels[num] = TimerChannel(mode, pulse_width_percent)
+        return self.channels[num]
+
+    def counter(self):
+        """!
+        @returns The count of an encoder timer, or of a ticking timer
+        """
+        if any(ch.mode >= Timer.ENC_A for ch in self.channels.values()):
+            romi.update()
+            return int(self.position) % (self._period + 1)
+        return super().counter()
+
+
+class ADC:
+    """!
+    @brief   A stand-in for @c pyb.ADC which reads a fixed value by pin.
+    """
+
+    def __init__(self, pin):
+        self.name = pin.name if isinstance(pin, Pin) else pin
+
+    def read(self):
+        return ADC_VALUES.get(self.name, 0)
+
+
+class I2C:
+    """!
+    @brief   A stand-in for @c pyb.I2C on which a BNO055 IMU answers.
+    @details The IMU always reports itself fully calibrated, and its heading
+             and rate of turn come from the model of the Romi. Each transfer
+             takes the time it would on the bus.
+    """
+    CONTROLLER = MASTER = 0
+    PERIPHERAL = SLAVE = 1
+
+    def __init__(self, bus, mode=CONTROLLER, baudrate=I2C_FREQ, **kwargs):
+        self.baudrate = baudrate
+        self.regs = bytearray(128)
+        # Calibration status: system, gyro, accelerometer and magnetometer
+        self.regs[0x35] = 0xFF
+
+    def _transfer(self, num_bytes):
+        """!
+        @brief   Take the time needed to send the address, register and data.
+        """
+        clock.advance((num_bytes + 3) * 9 * 1000000 / self.baudrate)
+
+    def mem_read(self, data, addr, memaddr, timeout=5000, addr_size=8):
+        """!
+        @brief   Read registers of the IMU.
+        @param   data The number of bytes to read, or a buffer to fill
+        """
+        num_bytes = data if isinstance(data, int) else len(data)
+        self._transfer(num_bytes)
+        romi.update()
+        # Heading is clockwise from 0 to 2 pi, and angles are in 1/900 rad
+        heading = (-romi.heading) % (2 * math.pi)
+        self.regs[0x1A:0x20] = struct.pack('<hhh', int(heading * 900), 0, 0)
+        self.regs[0x14:0x1A] = struct.pack('<hhh', 0, 0,
+                                           int(romi.turn_rate * 900))
+        result = bytes(self.regs[memaddr:memaddr + num_bytes])
+        if isinstance(data, int):
+            return result
+        data[:] = result
+        return data
+
+    def mem_write(self, data, addr, memaddr, timeout=5000, addr_size=8):
+        """!
+        @brief   Write registers of the IMU.
+        @param   data An integer to write to one register, or a buffer
+        """
+        if isinstance(data, int):
+            data = bytes((data,))
+        self._transfer(len(data))
+        self.regs[memaddr:memaddr + len(data)] = data
+
+
+class UART:
+    """!
+    @brief   A stand-in for @c machine.UART. Characters from @c KEYS arrive
+             at their times, and what is written is kept.
+    """
+
+    def __init__(self, bus, baudrate=115200, **kwargs):
+        self.baudrate = baudrate
+        ## Everything written to the UART
+        self.sent = bytearray()
+        self._keys = collections.deque(KEYS)
+        self._done_us = 0
+
+    def init(self, baudrate=115200, **kwargs):
+        self.baudrate = baudrate
+
+    def _arrived(self):
+        """!
+        @returns The characters which have arrived and not been read
+        """
+        now = clock.now_us / 1000000
+        return "".join(key for when, key in self._keys if when <= now)
+
+    def any(self):
+        return len(self._arrived())
+
+    def read(self, num_bytes=None):
+        chars = self._arrived()[:num_bytes]
+        for _ in chars:
+            self._keys.popleft()
+        return chars.encode() if chars else None
+
+    def write(self, data):
+        """!
+        @brief   Send data, taking the time to send all but the last byte.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        self.sent += data
+        clock.advance((len(data) - 1) * 10 * 1000000 / self.baudrate)
+        self._done_us = clock.now_us + 10 * 1000000 / self.baudrate
+        return len(data)
+
+    def txdone(self):
+        """!
+        @returns @c True once the last byte written has been sent
+        """
+        return clock.now_us >= self._done_us
+
+
+class FlashFile:
+    """!
+    @brief   A file in the folder which stands in for the board's flash,
+             whose writes take the time they would on the board.
+    """
+
+    def __init__(self, file):
+        self._file = file
+
+    def write(self, data):
+        """!
+        @brief   Write data, taking the time to write each block it starts.
+        """
+        clock.advance(-(-memoryview(data).nbytes // 512) * FLASH_BLOCK_US)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+def _flash_open(path, mode='r', *args, **kwargs):
+    """!
+    Stand-in for @c open(), whose files opened for writing are
+    @c FlashFile objects.
+    """
+    file = host_open(path, mode, *args, **kwargs)
+    return file if mode.startswith('r') and '+' not in mode else \
+        FlashFile(file)
+
+
+class MicroArray(array.array):
+    """!
+    @brief   An array which, as MicroPython's do, keeps only the low bits of
+             an integer too big for its type rather than raising an error.
+    """
+
+    def __setitem__(self, index, value):
+        if self.typecode not in "fd" and isinstance(value, int):
+            bits = 8 * self.itemsize
+            value &= (1 << bits) - 1
+            if self.typecode.islower() and value >> (bits - 1):
+                value -= 1 << bits
+        super().__setitem__(index, value)
+
+
+class HostQueue:
+    """!
+    @brief   A stand-in for the C queues of @c cqueue. As those do, it
+             overwrites the oldest item when it is full.
+    """
+
+    def __init__(self, size):
+        self._items = collections.deque(maxlen=size)
+        self._max = 0
+
+    def any(self):
+        return len(self._items) > 0
+
+    def available(self):
+        return len(self._items)
+
+    def put(self, data):
+        self._items.append(data)
+        self._max = max(self._max, len(self._items))
+
+    def get(self):
+        return self._items.popleft() if self._items else None
+
+    def clear(self):
+        self._items.clear()
+
+    def full(self):
+        return len(self._items) == self._items.maxlen
+
+    def max_full(self):
+        return self._max
+
+
+def _collect():
+    """!
+    Stand-in for @c gc.collect(), which takes the time it takes on the board.
+    """
+    clock.advance(GC_TIME_US)
+
+
+def _wfi():
+    """!
+    Stand-in for @c pyb.wfi(): sleep until a timer interrupt or the next
+    one millisecond system tick.
+    """
+    clock.wfi(1000 - clock.now_us % 1000)
+
+
+def stand_ins():
+    """!
+    Make the stand-ins for the MicroPython modules used by @c main.py.
+    @returns A dictionary of modules by name
+    """
+    pyb = types.ModuleType("pyb")
+    for item in (Pin, Timer, ADC, I2C):
+        setattr(pyb, item.__name__, item)
+    pyb.disable_irq = lambda: 0
+    pyb.enable_irq = lambda state=True: None
+    pyb.wfi = _wfi
+
+    machine = types.ModuleType("machine")
+    machine.UART = UART
+    machine.Pin = Pin
+
+    cqueue = types.ModuleType("cqueue")
+    cqueue.FloatQueue = cqueue.IntQueue = cqueue.ByteQueue = HostQueue
+
+    gc = types.ModuleType("gc")
+    gc.collect = _collect
+    gc.enable = gc.disable = lambda: None
+    gc.isenabled = lambda: True
+    gc.threshold = lambda amount=None: -1
+    gc.mem_free = lambda: 80000
+    gc.mem_alloc = lambda: 20000
+
+    micro_array = types.ModuleType("array")
+    micro_array.array = MicroArray
+
+    ulab = types.ModuleType("ulab")
+    ulab.numpy = numpy
+
+    return {"pyb": pyb, "machine": machine, "cqueue": cqueue, "gc": gc,
+            "array": micro_array,
+            "time": clock.module("time"), "ulab": ulab,
+            "ulab.numpy": numpy}
+
+
+def charged(gen, usage, slowdown):
+    """!
+    Wrap a task's generator so that each run takes simulated time.
+    @param gen The task's generator
+    @param usage A two-item list in which the task's number of runs and the
+           simulated time it has used, in microseconds, are added up
+    @param slowdown The factor by which host time is multiplied
+    """
+    while True:
+        start_us = clock.now_us
+        host_start = perf_counter()
+        state = next(gen)
+        clock.advance((perf_counter() - host_start) * 1000000 * slowdown)
+        usage[0] += 1
+        usage[1] += clock.now_us - start_us
+        yield state
+
+
+def run(sim_time=SIM_TIME, slowdown=SLOWDOWN, verbose=False):
+    """!
+    Run @c main.py on the virtual clock until @c sim_time has passed.
+    @param sim_time How long to run, in simulated seconds
+    @param slowdown The factor by which host time is multiplied
+    @param verbose If @c True, show what the program prints
+    @returns A tuple holding the task list and a dictionary holding each
+             task's number of runs and the time it used, by task name
+    """
+    clock.now_us = 0
+    saved = {name: sys.modules.get(name)
+             for name in ("pyb", "machine", "cqueue", "gc", "array", "time",
+                          "utime",
+                          "micropython", "ulab", "ulab.numpy")}
+    sys.modules.update(stand_ins())
+    vclock.install(clock)
+    for name, module in list(sys.modules.items()):
+        if os.path.dirname(getattr(module, "__file__", None) or "") == ON_BOARD:
+            del sys.modules[name]
+    old_cwd = os.getcwd()
+    flash = tempfile.mkdtemp()
+    try:
+        # The program runs in a folder which stands in for the board's flash
+        shutil.copy(os.path.join(ON_BOARD, "IMU_cal.txt"), flash)
+        os.chdir(flash)
+        builtins.open = _flash_open
+
+        import cotask
+        task_list = cotask.task_list
+        usage = {}
+
+        def append(task, _append=task_list.append):
+            usage[task.name] = [0, 0]
+            task._run_gen = charged(task._run_gen, usage[task.name],
+                                    slowdown)
+            _append(task)
+
+        def idle_sched(_idle_sched=task_list.idle_sched):
+            if clock.now_us >= sim_time * 1000000:
+                raise KeyboardInterrupt
+            return _idle_sched()
+
+        task_list.append = append
+        task_list.idle_sched = idle_sched
+
+        out = contextlib.nullcontext() if verbose else \
+            contextlib.redirect_stdout(io.StringIO())
+        with out:
+            runpy.run_path(os.path.join(ON_BOARD, "main.py"),
+                           run_name="__main__")
+    finally:
+        builtins.open = host_open
+        os.chdir(old_cwd)
+        shutil.rmtree(flash, ignore_errors=True)
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+    return task_list, usage
+
+
+def main():
+    """!
+    Run the course and print the CPU time used by each task.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument("--time", type=float, default=SIM_TIME,
+                        help="simulated seconds to run (default %(default)s)")
+    parser.add_argument("--slowdown", type=float, default=SLOWDOWN,
+                        help="board time per unit of host time "
+                             "(default %(default)s)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="show what the program prints")
+    args = parser.parse_args()
+
+    wall_start = perf_counter()
+    task_list, usage = run(args.time, args.slowdown, args.verbose)
+    wall = perf_counter() - wall_start
+
+    sim_us = args.time * 1000000
+    print(f"Simulated {args.time:g} s in {wall:.2f} s\n")
+    print(f"{'TASK':<16s}{'RUNS':>8s}{'CPU MS':>10s}{'AVG MS':>10s}"
+          f"{'CPU %':>8s}")
+    for name, (runs, used) in usage.items():
+        print(f"{name:<16s}{runs:8d}{used / 1000:10.1f}"
+              f"{(used / runs / 1000 if runs else 0):10.3f}"
+              f"{used / sim_us * 100:8.1f}")
+    total = sum(used for runs, used in usage.values())
+    print(f"{'TOTAL':<16s}{'':8s}{total / 1000:10.1f}{'':10s}"
+          f"{total / sim_us * 100:8.1f}")
+    print('\n' + str(task_list))
+
+
+if __name__ == "__main__":
+    main()
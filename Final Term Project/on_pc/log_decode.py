@@ -0,0 +1,84 @@
+"""!
+@file log_decode.py
+This file reads a binary log file written by @c logger.Logger on the board
+and saves it as a CSV file with one row per logged row.
+
+A log starts with a header which names each channel and gives its type,
+padded with zeros to a multiple of 512 bytes; the rows follow, each the
+channels' values packed little-endian in channel order. A log whose last
+row was cut short, as when the board was reset during a run, is read up to
+its last whole row.
+
+Copy the log off the board with @c mpremote @c cp @c :run.log @c ., then
+run @c python @c log_decode.py @c run.log @c -o @c run.csv.
+"""
+
+import argparse
+import contextlib
+import struct
+import sys
+
+## The bytes which start every log file, as in @c logger.py
+MAGIC = b'LOG1'
+
+## The layouts of the header and of each channel's entry in it, as in
+#  @c logger.py
+HEADER = '<4sBH'
+CHANNEL_HEADER = '<BB'
+
+## The size in bytes to which the header is padded
+BLOCK_SIZE = 512
+
+
+def read_log(data):
+    """!
+    Split the contents of a log file into its channels' names and its rows.
+    @param data The bytes of the log file
+    @returns A tuple holding the list of channel names and a list of rows,
+             each a tuple of values
+    @raises ValueError if the data doesn't start with a log header
+    """
+    magic, count, row_size = struct.unpack_from(HEADER, data)
+    if magic != MAGIC:
+        raise ValueError("not a log file")
+    offset = struct.calcsize(HEADER)
+    names = []
+    row_format = '<'
+    for _ in range(count):
+        code, length = struct.unpack_from(CHANNEL_HEADER, data, offset)
+        offset += struct.calcsize(CHANNEL_HEADER)
+        names.append(data[offset:offset + length].decode(errors="replace"))
+        offset += length
+        row_format += chr(code)
+    if struct.calcsize(row_format) != row_size:
+        raise ValueError("row size doesn't match the channels' types")
+    start = -(-offset // BLOCK_SIZE) * BLOCK_SIZE
+    whole = max(len(data) - start, 0) // row_size * row_size
+    rows = list(struct.iter_unpack(row_format, data[start:start + whole]))
+    return names, rows
+
+
+def main():
+    """!
+    Read a log file and save it as CSV.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument("file", help="log file copied from the board")
+    parser.add_argument("-o", "--output", help="CSV file to write "
+                        "(default: standard output)")
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as log_file:
+        names, rows = read_log(log_file.read())
+
+    with (open(args.output, "w") if args.output
+          else contextlib.nullcontext(sys.stdout)) as out:
+        out.write(",".join(names) + "\n")
+        for row in rows:
+            out.write(",".join(f"{value:g}" if isinstance(value, float)
+                               else str(value) for value in row) + "\n")
+    print(f"{len(rows)} rows of {len(names)} channels", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
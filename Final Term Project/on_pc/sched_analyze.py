@@ -0,0 +1,266 @@
+"""!
+@file sched_analyze.py
+This file checks whether a task set can meet its deadlines, using the task
+table printed by @c print(cotask.task_list) after a run with profiling on.
+It finds the CPU utilization of the task set and, from each task's longest
+measured run time, the worst-case response time of each task under the
+cooperative, non-preemptive priority scheduling of @c cotask. Tasks which
+can't be sure of finishing within their periods are flagged, and a
+rate-monotonic priority assignment and longer periods for the tasks which
+need them are suggested.
+
+The table may be pasted into a file along with anything else the program
+printed; only the lines from the @c TASK header to the end of the table are
+read. Tasks released by a timer or by @c go() have no period in the table;
+give their periods with @c --period, or they are only counted as blocking
+the other tasks.
+
+Run it with @c python @c sched_analyze.py @c profile.txt, or pipe the output
+of @c host_runner.py into it.
+"""
+
+import argparse
+import math
+import re
+import sys
+
+## The width of the task name column in the table
+NAME_WIDTH = 16
+
+## How many times the response time equation is iterated before a task is
+#  given up on
+MAX_ITERATIONS = 1000
+
+## A response time longer than this many of the longest period is taken to
+#  mean that the task may never run
+HORIZON = 100
+
+## Suggested periods are rounded up to a multiple of this many milliseconds
+PERIOD_STEP = 5
+
+## Words which begin a two-word column header, such as @c AVG @c DUR
+HEADER_PREFIXES = ("DL", "AVG", "MAX", "DUR", "LATE")
+
+
+def parse_table(lines):
+    """!
+    Read the task table printed by @c cotask.TaskList.
+    @details The columns are found from the header, so tables printed by
+             older versions of @c cotask, with fewer columns, can be read.
+             Each value in a row is one word, and a row may stop early
+             when a task isn't profiled.
+    @param lines An iterable of the lines of text holding the table
+    @returns A list of dictionaries, one per task, holding the task's name
+             under @c TASK and its other values under their column headers;
+             numbers are converted to @c float and missing values to @c None
+    """
+    labels = None
+    tasks = []
+    for line in lines:
+        line = line.rstrip("\n")
+        if labels is None:
+            if line.split()[:3] == ["TASK", "PRI", "PERIOD"]:
+                words = line[NAME_WIDTH:].split()
+                labels = []
+                while words:
+                    word = words.pop(0)
+                    if word in HEADER_PREFIXES and words:
+                        word += " " + words.pop(0)
+                    labels.append(word)
+            continue
+        if not line.strip() or line.startswith("IDLE"):
+            break
+        name = line[:NAME_WIDTH].rstrip()
+        words = line[NAME_WIDTH:].split()
+        # A name longer than the column pushes the rest of the row over
+        while words and not re.fullmatch(r"-?\d+", words[0]):
+            name += " " + words.pop(0)
+        task = {"TASK": name}
+        for label, word in zip(labels, words):
+            task[label] = None if word == "-" else float(word)
+        tasks.append(task)
+    if labels is None:
+        raise ValueError("no task table found")
+    return tasks
+
+
+def blocking(task, tasks, pri):
+    """!
+    Find the longest time a task can wait for a task of lower priority
+    which has already started, as tasks can't be preempted.
+    @param task The task whose blocking time is found
+    @param tasks All of the tasks
+    @param pri A dictionary of priority by task name
+    @returns The blocking time in milliseconds
+    """
+    return max([other["C"] for other in tasks
+                if pri[other["TASK"]] < pri[task["TASK"]]], default=0.0)
+
+
+def response_time(task, tasks, pri):
+    """!
+    Find the worst-case response time of a task, from its release to the
+    end of its run, under non-preemptive fixed-priority scheduling.
+    @details The task waits for at most one run of a lower-priority task
+             which has started, then for every release of tasks of higher
+             or equal priority before it can start; tasks of equal priority
+             are counted in case they were released first. Tasks with no
+             period are counted only in the blocking time.
+    @param task The task to check
+    @param tasks All of the tasks
+    @param pri A dictionary of priority by task name
+    @returns The response time in milliseconds, or @c math.inf if the
+             start time grows without bound
+    """
+    interfering = [other for other in tasks if other is not task
+                   and other["T"] and pri[other["TASK"]] >= pri[task["TASK"]]]
+    horizon = HORIZON * max(other["T"] for other in tasks if other["T"])
+    start = blocking(task, tasks, pri)
+    wait = start
+    for _ in range(MAX_ITERATIONS):
+        new_wait = start + sum((math.floor(wait / other["T"]) + 1) * other["C"]
+                               for other in interfering)
+        if new_wait == wait:
+            return wait + task["C"]
+        if new_wait > horizon:
+            break
+        wait = new_wait
+    return math.inf
+
+
+def analyze(tasks, pri):
+    """!
+    Find the response time of every task with a period.
+    @param tasks All of the tasks
+    @param pri A dictionary of priority by task name
+    @returns A dictionary of response times in milliseconds by task name
+    """
+    return {task["TASK"]: response_time(task, tasks, pri)
+            for task in tasks if task["T"]}
+
+
+def rate_monotonic(tasks):
+    """!
+    Give tasks with shorter periods higher priorities. Tasks with no period
+    go below all the others, and ties keep their present order.
+    @param tasks All of the tasks
+    @returns A dictionary of priority by task name, 0 being the lowest
+    """
+    order = sorted(tasks, key=lambda task: (task["T"] or math.inf,
+                                            -task["PRI"]),
+                   reverse=True)
+    pri = {}
+    level = 0
+    for num, task in enumerate(order):
+        if num and (task["T"], task["PRI"]) != (order[num - 1]["T"],
+                                                order[num - 1]["PRI"]):
+            level += 1
+        pri[task["TASK"]] = level
+    return pri
+
+
+def misses(tasks, resp):
+    """!
+    Count the tasks whose response times are longer than their periods.
+    """
+    return sum(1 for task in tasks
+               if task["T"] and resp[task["TASK"]] > task["T"])
+
+
+def print_results(tasks, pri, resp, title):
+    """!
+    Print each task's priority, period, run time and response time.
+    """
+    print(title)
+    print(f"{'TASK':<16s}{'PRI':>4s}{'PERIOD':>10s}{'DUR':>10s}"
+          f"{'UTIL':>8s}{'RESPONSE':>10s}")
+    for task in tasks:
+        line = f"{task['TASK']:<16s}{pri[task['TASK']]:4d}"
+        if task["T"]:
+            line += (f"{task['T']:10.1f}{task['C']:10.3f}"
+                     f"{task['C'] / task['T'] * 100:7.1f}%"
+                     f"{resp[task['TASK']]:10.3f}")
+            if resp[task["TASK"]] > task["T"]:
+                line += "  CAN MISS"
+        else:
+            line += f"{'-':>10s}{task['C']:10.3f}{'-':>8s}{'-':>10s}"
+        print(line)
+    print()
+
+
+def main():
+    """!
+    Read a task table and print the analysis.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument("file", nargs="?", help="file holding the task "
+                        "table (default: read standard input)")
+    parser.add_argument("--period", action="append", default=[],
+                        metavar="NAME=MS", help="period of a task which has "
+                        "none in the table, such as 'Left ops=20'")
+    parser.add_argument("--dur", choices=("max", "avg", "p99", "p95"),
+                        default="max", help="which run time to use: the "
+                        "longest, which may include a start-up run, the "
+                        "average or a percentile (default %(default)s)")
+    args = parser.parse_args()
+
+    with (open(args.file) if args.file else sys.stdin) as stream:
+        tasks = parse_table(stream)
+
+    periods = {}
+    for item in args.period:
+        name, _, msec = item.rpartition("=")
+        periods[name.strip()] = float(msec)
+    dur_label = {"max": "MAX DUR", "avg": "AVG DUR", "p99": "DUR P99",
+                 "p95": "DUR P95"}[args.dur]
+    for task in tasks:
+        task["T"] = periods.get(task["TASK"], task.get("PERIOD"))
+        task["C"] = task.get(dur_label)
+        if task["C"] is None:
+            sys.exit(f"{task['TASK']} has no {dur_label}; profile all tasks")
+
+    util = sum(task["C"] / task["T"] for task in tasks if task["T"])
+    print(f"CPU utilization {util * 100:.1f}% using {dur_label.lower()}")
+    if util > 1:
+        print("The task set can't be scheduled: it needs more than all of "
+              f"the CPU time. Periods must be made {util:.2f} times longer "
+              "on average")
+    untimed = [task["TASK"] for task in tasks if not task["T"]]
+    if untimed:
+        print("No period for " + ", ".join(untimed)
+              + "; counted only as blocking other tasks")
+    print()
+
+    pri = {task["TASK"]: int(task["PRI"]) for task in tasks}
+    resp = analyze(tasks, pri)
+    print_results(tasks, pri, resp, "Present priorities")
+    if not misses(tasks, resp):
+        print("All tasks with periods meet their deadlines")
+        return
+
+    rm_pri = rate_monotonic(tasks)
+    rm_resp = analyze(tasks, rm_pri)
+    print_results(tasks, rm_pri, rm_resp, "Rate-monotonic priorities")
+
+    # Suggest periods long enough for the tasks which can still miss their
+    # deadlines with whichever priorities work better
+    if misses(tasks, rm_resp) < misses(tasks, resp):
+        best_pri, best_resp = rm_pri, rm_resp
+    else:
+        best_pri, best_resp = pri, resp
+    for task in tasks:
+        if task["T"] and best_resp[task["TASK"]] > task["T"]:
+            if math.isinf(best_resp[task["TASK"]]):
+                print(f"{task['TASK']}: can't be scheduled at priority "
+                      f"{best_pri[task['TASK']]}; lengthen the periods of "
+                      "the tasks above it")
+            else:
+                period = (math.ceil(best_resp[task["TASK"]] / PERIOD_STEP)
+                          * PERIOD_STEP)
+                print(f"{task['TASK']}: lengthen its period from "
+                      f"{task['T']:g} to {period} ms at priority "
+                      f"{best_pri[task['TASK']]}")
+
+
+if __name__ == "__main__":
+    main()
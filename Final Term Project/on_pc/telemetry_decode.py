@@ -0,0 +1,296 @@
+"""!
+@file telemetry_decode.py
+This file reads the binary frames sent by @c telemetry.FrameWriter on the
+board, checks them, and puts the columns of recorded data back together
+into a CSV file with one row per sample. The frames can be read from a
+serial port as they are sent or from a file into which they were saved.
+
+Frames are found by the zero bytes which end them, so anything the board
+printed before a dump is skipped. Frames with a bad CRC or length are
+counted and dropped, and gaps in the frames' sequence numbers are counted
+as lost frames. If the recording was frozen by a trigger, the trigger's
+cause and row are reported along with those counts.
+
+With @c --live, the rows streamed by @c telemetry.Streamer while the robot
+runs are written out as they arrive, and the rate at which they arrived is
+reported when the stream ends or is stopped with Ctrl-C.
+
+Run it with @c python @c telemetry_decode.py @c --port @c COM5 @c -o
+@c run.csv, or with @c python @c telemetry_decode.py @c dump.bin.
+"""
+
+import argparse
+import binascii
+import contextlib
+import struct
+import sys
+
+## The kinds of frames, as in @c telemetry.py
+KIND_SCHEMA = 1
+KIND_COLUMN = 2
+KIND_END = 3
+KIND_SAMPLE = 4
+
+## The layouts of the frame header and the payload headers, as in
+#  @c telemetry.py
+HEADER = '<BBH'
+SCHEMA_HEADER = '<BB'
+COLUMN_HEADER = '<BBI'
+END_HEADER = '<I'
+SAMPLE_HEADER = '<I'
+
+## The size of the CRC at the end of each frame in bytes
+CRC_SIZE = 2
+
+## How many bytes to ask the stream for at a time
+READ_SIZE = 4096
+
+
+def cobs_decode(data):
+    """!
+    Undo the COBS encoding of a frame.
+    @param data The encoded bytes, without the zero which ended them
+    @returns The decoded bytes
+    @raises ValueError if the data isn't valid COBS
+    """
+    out = bytearray()
+    index = 0
+    while index < len(data):
+        code = data[index]
+        if code == 0 or index + code > len(data):
+            raise ValueError("bad COBS code")
+        out += data[index + 1:index + code]
+        index += code
+        if code < 0xFF and index < len(data):
+            out.append(0)
+    return bytes(out)
+
+
+def parse_frame(data):
+    """!
+    Decode and check one frame.
+    @param data The encoded bytes of the frame, without the zero
+    @returns A tuple holding the frame's kind, sequence number and payload
+    @raises ValueError if the frame is damaged
+    """
+    raw = cobs_decode(data)
+    head_size = struct.calcsize(HEADER)
+    if len(raw) < head_size + CRC_SIZE:
+        raise ValueError("frame too short")
+    kind, seq, length = struct.unpack_from(HEADER, raw)
+    if len(raw) != head_size + length + CRC_SIZE:
+        raise ValueError("frame length doesn't match its header")
+    crc, = struct.unpack_from('<H', raw, head_size + length)
+    if binascii.crc_hqx(raw[:head_size + length], 0xFFFF) != crc:
+        raise ValueError("bad CRC")
+    return kind, seq, raw[head_size:head_size + length]
+
+
+class FrameReader:
+    """!
+    @brief   Splits a stream of bytes into frames and keeps count of the
+             damaged and lost ones.
+    """
+
+    def __init__(self, stream, wait=False):
+        """!
+        @brief   Make a reader of the frames in a stream.
+        @param   stream A file or serial port opened for binary reading
+        @param   wait If @c True, a read which times out with nothing, as
+                 from a serial port, is tried again rather than taken as
+                 the end of the stream
+        """
+        ## The stream from which frames are read
+        self.stream = stream
+        ## Whether to keep waiting when a read gets nothing
+        self.wait = wait
+        ## The number of good frames read
+        self.frames = 0
+        ## The number of frames dropped as damaged
+        self.bad = 0
+        ## The number of frames missing, going by the sequence numbers
+        self.lost = 0
+        self._pending = b''
+        self._last_seq = None
+        self._first = True
+
+    def __iter__(self):
+        """!
+        @brief   Read frames until the stream ends.
+        @returns An iterator of (kind, sequence number, payload) tuples
+        """
+        while True:
+            chunk = self.stream.read(READ_SIZE)
+            if not chunk:
+                if self.wait:
+                    continue
+                return
+            pieces = (self._pending + chunk).split(b'\x00')
+            self._pending = pieces.pop()
+            for piece in pieces:
+                first = self._first
+                self._first = False
+                if not piece:
+                    continue
+                try:
+                    frame = parse_frame(piece)
+                except ValueError:
+                    # What came before the first zero may be text or part of
+                    # a frame, which isn't counted as damage
+                    if not first:
+                        self.bad += 1
+                    continue
+                self.frames += 1
+                seq = frame[1]
+                if self._last_seq is not None:
+                    self.lost += (seq - self._last_seq - 1) & 0xFF
+                self._last_seq = seq
+                yield frame
+
+
+def read_columns(reader):
+    """!
+    Read a set of columns, up to its end frame or the end of the stream.
+    @param reader A @c FrameReader
+    @returns A tuple holding a list of (channel name, list of samples)
+             tuples in channel order, in which a channel whose name frame
+             was lost is called @c chN after its number, and either
+             @c None or, if the recording was triggered, a tuple of the
+             trigger's row and reason
+    """
+    names = {}
+    columns = {}
+    trigger = None
+    for kind, seq, payload in reader:
+        if kind == KIND_SCHEMA:
+            channel, _ = struct.unpack_from(SCHEMA_HEADER, payload)
+            start = struct.calcsize(SCHEMA_HEADER)
+            names[channel] = payload[start:].decode(errors="replace")
+        elif kind == KIND_COLUMN:
+            channel, code, first = struct.unpack_from(COLUMN_HEADER, payload)
+            start = struct.calcsize(COLUMN_HEADER)
+            code = chr(code)
+            # Sizes are the board's, as in the unpack below, not the PC's
+            count = (len(payload) - start) // struct.calcsize('<' + code)
+            values = struct.unpack_from(f'<{count}{code}', payload, start)
+            column = columns.setdefault(channel, [])
+            if len(column) < first:
+                column.extend([None] * (first - len(column)))
+            column[first:first + count] = values
+        elif kind == KIND_END:
+            start = struct.calcsize(END_HEADER)
+            if len(payload) >= start:
+                row, = struct.unpack_from(END_HEADER, payload)
+                trigger = (row, payload[start:].decode(errors="replace"))
+            break
+    return ([(names.get(channel, f"ch{channel}"), columns.get(channel, []))
+             for channel in sorted(set(names) | set(columns))], trigger)
+
+
+def read_rows(reader):
+    """!
+    Read the rows of a live stream as they arrive.
+    @param reader A @c FrameReader
+    @returns An iterator of (channel names, timestamp in microseconds,
+             tuple of samples) tuples; a channel whose name frame hasn't
+             been received is called @c chN after its number
+    """
+    names = {}
+    start = struct.calcsize(SAMPLE_HEADER)
+    for kind, seq, payload in reader:
+        if kind == KIND_SCHEMA:
+            channel, _ = struct.unpack_from(SCHEMA_HEADER, payload)
+            offset = struct.calcsize(SCHEMA_HEADER)
+            names[channel] = payload[offset:].decode(errors="replace")
+        elif kind == KIND_SAMPLE:
+            stamp, = struct.unpack_from(SAMPLE_HEADER, payload)
+            count = (len(payload) - start) // 4
+            values = struct.unpack_from(f'<{count}f', payload, start)
+            yield ([names.get(channel, f"ch{channel}")
+                    for channel in range(count)], stamp, values)
+
+
+def write_csv(columns, stream):
+    """!
+    Write columns as CSV, one row per sample. Columns shorter than the
+    longest are padded with empty fields.
+    @param columns The list of columns returned by @c read_columns()
+    @param stream A text stream to write to
+    """
+    stream.write(",".join(name for name, _ in columns) + "\n")
+    rows = max((len(values) for _, values in columns), default=0)
+    for row in range(rows):
+        stream.write(",".join(
+            "" if row >= len(values) or values[row] is None
+            else f"{values[row]:g}" if isinstance(values[row], float)
+            else str(values[row]) for _, values in columns) + "\n")
+
+
+def main():
+    """!
+    Read a dump of columns, or with @c --live a stream of rows, from a file
+    or serial port and save it as CSV.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument("file", nargs="?", help="file of binary frames")
+    parser.add_argument("--port", help="serial port to read the frames from")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("-o", "--output", help="CSV file to write "
+                        "(default: standard output)")
+    parser.add_argument("--live", action="store_true",
+                        help="write the rows streamed while the robot runs")
+    args = parser.parse_args()
+
+    if args.port:
+        from serial import Serial
+        stream = Serial(args.port, args.baud, timeout=0.1)
+    elif args.file:
+        stream = open(args.file, "rb")
+    else:
+        parser.error("give a frame file or a serial port")
+
+    if args.live:
+        reader = FrameReader(stream, wait=bool(args.port))
+        rows = 0
+        first = last = None
+        with stream, (open(args.output, "w") if args.output
+                       else contextlib.nullcontext(sys.stdout)) as out:
+            try:
+                for names, stamp, values in read_rows(reader):
+                    if first is None:
+                        out.write(",".join(["time"] + names) + "\n")
+                        first = stamp
+                    # Timestamps wrap at 32 bits, as in timestamp.diff() on the board
+                    out.write(f"{((stamp - first) & 0xFFFFFFFF) / 1e6:.6f},"
+                              + ",".join(f"{value:g}" for value in values) + "\n")
+                    out.flush()
+                    rows += 1
+                    last = stamp
+            except KeyboardInterrupt:
+                pass
+        print(f"{reader.frames} frames, {reader.bad} damaged, {reader.lost} lost",
+              file=sys.stderr)
+        seconds = ((last - first) & 0xFFFFFFFF) / 1e6 if rows else 0
+        if seconds > 0:
+            print(f"{rows} rows in {seconds:.1f} s, {(rows - 1) / seconds:.1f} rows/s",
+                  file=sys.stderr)
+        return
+
+    with stream:
+        reader = FrameReader(stream, wait=bool(args.port))
+        columns, trigger = read_columns(reader)
+
+    # Standard output is left open for the messages below
+    with (open(args.output, "w") if args.output
+          else contextlib.nullcontext(sys.stdout)) as out:
+        write_csv(columns, out)
+    print(f"{reader.frames} frames, {reader.bad} damaged, {reader.lost} lost",
+          file=sys.stderr)
+    if trigger is not None:
+        row, reason = trigger
+        print(f"Triggered by {reason or 'trigger'} at row {row}",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
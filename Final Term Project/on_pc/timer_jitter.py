@@ -0,0 +1,86 @@
+"""!
+@file timer_jitter.py
+This file compares two ways of running the motor tasks of the Final Term
+Project at 50 Hz on a simulated clock: as timed tasks which the scheduler
+releases when it polls the time, and as untimed tasks released by a timer
+interrupt through @c cotask.TimerRelease. The rest of the task set from
+@c sched_compare.py runs alongside them, with run times taken from the
+measured profile table, and each way is run under @c idle_sched().
+
+Run it from this folder with @c python @c timer_jitter.py.
+"""
+
+from sched_compare import clock, TASK_SET, WARM_UP, SIM_TIME, modeled_task
+import vclock
+import cotask
+
+## The names of the tasks which are released by the timer
+TIMER_TASKS = ("Right ops", "Left ops")
+
+## The frequency in Hz of the timer which releases the motor tasks
+TIMER_FREQ = 50
+
+
+def run(use_timer):
+    """!
+    Run the task set for @c SIM_TIME seconds.
+    @param use_timer If @c True, the motor tasks are released by a timer;
+           if @c False, they are timed tasks
+    @returns A tuple holding the task list and the @c cotask.TimerRelease,
+             which is @c None if no timer is used
+    """
+    clock.now_us = 0
+    clock._timers.clear()
+    task_list = cotask.TaskList()
+    task_list.sleep_us = clock.wfi
+    motor_tasks = []
+    for spec in TASK_SET:
+        timed = not (use_timer and spec[0] in TIMER_TASKS)
+        task = cotask.Task(modeled_task, name=spec[0], priority=spec[1],
+                           period=spec[2] if timed else None, profile=True,
+                           shares=spec)
+        task_list.append(task)
+        if spec[0] in TIMER_TASKS:
+            motor_tasks.append(task)
+
+    release = None
+    if use_timer:
+        release = cotask.TimerRelease(
+            vclock.VirtualTimer(clock, 6, freq=TIMER_FREQ), motor_tasks)
+
+    warm = True
+    while clock.now_us < (WARM_UP + SIM_TIME) * 1000000:
+        task_list.idle_sched()
+        if warm and clock.now_us >= WARM_UP * 1000000:
+            warm = False
+            for pri in task_list.pri_list:
+                for task in pri[2:]:
+                    task.reset_profile()
+            if release:
+                release.reset()
+    if release:
+        release.stop()
+    return task_list, release
+
+
+def main():
+    """!
+    Run the task set both ways and print the motor tasks' start jitter.
+    """
+    polled, _ = run(False)
+    timed, release = run(True)
+
+    print("Motor tasks released by polling:")
+    for pri in polled.pri_list:
+        for task in pri[2:]:
+            if task.name in TIMER_TASKS:
+                print(f"{task.name:<16s} late avg {task._late_sum / task._runs / 1000:.3f}"
+                      f" ms, max {task._latest / 1000:.3f} ms, jitter "
+                      f"{(task._latest - task._soonest) / 1000:.3f} ms")
+    print("\nMotor tasks released by a timer:")
+    print(release.report())
+    print(timed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""!
+@file trace_decode.py
+This file reads the binary state transition traces written by
+@c cotask.TaskList.dump_traces() or @c cotask.Task.dump_trace() and prints
+them as one timeline, so that the transitions of different tasks can be
+seen in the order in which they happened. The traces can be read from a
+file which was saved on the board or from a serial port.
+
+Run it with @c python @c trace_decode.py @c trace.bin, or with
+@c python @c trace_decode.py @c --port @c COM5 to read a dump as it is sent.
+"""
+
+import argparse
+import struct
+
+## The format of the header of each task's record, as in @c cotask.py
+TRACE_HEADER = '<4sHII'
+
+## The number of distinct values of MicroPython's ticks, as on a Pyboard
+TICKS_PERIOD = 1 << 30
+
+
+def read_exact(stream, size):
+    """!
+    Read a number of bytes from a stream, waiting for all of them.
+    @param stream A file or serial port opened for binary reading
+    @param size The number of bytes to read
+    @returns The bytes read
+    @raises EOFError if the stream ends first
+    """
+    data = b''
+    while len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            raise EOFError("trace dump ended early")
+        data += more
+    return data
+
+
+def find_header(stream):
+    """!
+    Skip anything sent before the next record header, such as text printed
+    by the board before a dump, and read the header.
+    @param stream A file or serial port opened for binary reading
+    @returns The header's fields: name length, transitions and lost count
+    """
+    size = struct.calcsize(TRACE_HEADER)
+    data = read_exact(stream, 4)
+    while data != b'TRC1':
+        data = data[1:] + read_exact(stream, 1)
+    return struct.unpack(TRACE_HEADER, data + read_exact(stream, size - 4))[1:]
+
+
+def read_traces(stream):
+    """!
+    Read every task's record from a dump, up to the end marker or the end of
+    the stream.
+    @param stream A file or serial port opened for binary reading
+    @returns A list of tuples holding each task's name, the number of
+             transitions which were overwritten before the dump, and a list
+             of (tick, from state, to state) tuples
+    """
+    traces = []
+    while True:
+        try:
+            name_len, count, lost = find_header(stream)
+        except EOFError:
+            break
+        if name_len == 0:
+            break
+        name = read_exact(stream, name_len).decode(errors="replace")
+        times = struct.unpack(f'<{count}I', read_exact(stream, 4 * count))
+        states = struct.unpack(f'<{2 * count}H', read_exact(stream, 4 * count))
+        traces.append((name, lost, [(times[num], states[2 * num],
+                                     states[2 * num + 1])
+                                    for num in range(count)]))
+    return traces
+
+
+def ticks_diff(end, start):
+    """!
+    Find the signed difference between two tick values as utime does.
+    """
+    half = TICKS_PERIOD >> 1
+    return ((end - start + half) % TICKS_PERIOD) - half
+
+
+def timeline(traces):
+    """!
+    Merge the tasks' traces into one list ordered by time. Tick values wrap
+    every 2<sup>30</sup> microseconds, so each trace is unwrapped one step at
+    a time, and all are timed from the first transition of the first trace.
+    @param traces The list returned by @c read_traces()
+    @returns A list of (time in seconds, task name, from state, to state)
+             tuples, earliest first
+    """
+    events = []
+    ref = None
+    for name, lost, items in traces:
+        if not items:
+            continue
+        if ref is None:
+            ref = items[0][0]
+        usec = ticks_diff(items[0][0], ref)
+        last = items[0][0]
+        for tick, from_state, to_state in items:
+            usec += ticks_diff(tick, last)
+            last = tick
+            events.append((usec, name, from_state, to_state))
+    if not events:
+        return []
+    start = min(event[0] for event in events)
+    events.sort(key=lambda event: event[0])
+    return [((usec - start) / 1000000.0, name, from_state, to_state)
+            for usec, name, from_state, to_state in events]
+
+
+def main():
+    """!
+    Read a trace dump from a file or serial port and print its timeline.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument("file", nargs="?", help="binary trace file")
+    parser.add_argument("--port", help="serial port to read the dump from")
+    parser.add_argument("--baud", type=int, default=115200)
+    args = parser.parse_args()
+
+    if args.port:
+        from serial import Serial
+        stream = Serial(args.port, args.baud)
+    elif args.file:
+        stream = open(args.file, "rb")
+    else:
+        parser.error("give a trace file or a serial port")
+
+    with stream:
+        traces = read_traces(stream)
+
+    for name, lost, items in traces:
+        print(f"{name}: {len(items)} transitions"
+              + (f", {lost} earlier ones overwritten" if lost else ""))
+    print()
+    for time, name, from_state, to_state in timeline(traces):
+        print(f"{time: 12.6f}  {name:<16s}{from_state: 3d} -> {to_state:d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""!
+@file vclock.py
+This file contains a simulated clock which lets the on-board @c cotask.py
+and @c task_share.py modules run on a PC. Time only moves forward when the
+simulation says so, so a long run of the robot's task set can be replayed in
+a fraction of a second, and the results are the same every time.
+
+Calling @c install() puts stand-ins for the MicroPython @c utime and
+@c micropython modules into @c sys.modules. It must be called before the
+on-board modules are imported. A @c VirtualTimer stands in for a
+@c pyb.Timer, calling its callback as the clock passes each of its ticks.
+"""
+
+import builtins
+import sys
+import types
+
+## The number of distinct values of MicroPython's ticks, as on a Pyboard
+TICKS_PERIOD = 1 << 30
+
+## The frequency in Hz of the clock which feeds the timers of the robot's
+#  STM32L476, used by every tool which simulates them
+TIMER_SOURCE_FREQ = 80000000
+
+## The folder holding the on-board code, relative to this file
+ON_BOARD = "../on_board"
+
+
+class VirtualClock:
+    """!
+    @brief   A clock whose time only moves when it is advanced.
+    @details The clock keeps an unwrapped time in microseconds. Its
+             @c ticks_us() and related methods give wrapped tick values
+             which behave like those of MicroPython's @c utime module.
+    """
+
+    def __init__(self, start_us=0):
+        """!
+        @brief   Create a clock reading the given time.
+        @param   start_us The starting time in microseconds
+        """
+        ## The current simulated time in microseconds, never wrapped
+        self.now_us = start_us
+        self._timers = []
+
+    def _next_timer(self, end_us):
+        """!
+        @brief   Find the timer which ticks first, if any tick by a time.
+        @param   end_us The unwrapped time up to which timers are checked
+        @returns The timer which ticks soonest, or @c None if none ticks
+                 before or at @c end_us
+        """
+        soonest = None
+        for timer in self._timers:
+            if (timer.next_us <= end_us
+                    and (soonest is None or timer.next_us < soonest.next_us)):
+                soonest = timer
+        return soonest
+
+    def advance(self, usec):
+        """!
+        @brief   Move the clock forward, running the callback of each timer
+                 which ticks on the way, in order.
+        @param   usec The number of microseconds to move; negative values
+                 are ignored, as time can't go backward
+        """
+        if usec <= 0:
+            return
+        end_us = self.now_us + int(usec)
+        timer = self._next_timer(end_us)
+        while timer is not None:
+            self.now_us = timer.next_us
+            timer.fire()
+            timer = self._next_timer(end_us)
+        self.now_us = end_us
+
+    def advance_to(self, ticks):
+        """!
+        @brief   Move the clock forward to the time given by a tick value.
+        @param   ticks A tick value from @c ticks_us(); if it is in the past,
+                 the clock doesn't move
+        """
+        self.advance(self.ticks_diff(ticks, self.ticks_us()))
+
+    def ticks_us(self):
+        """!
+        @returns The current time in microseconds, wrapped like utime's
+        """
+        return self.now_us & (TICKS_PERIOD - 1)
+
+    def ticks_ms(self):
+        """!
+        @returns The current time in milliseconds, wrapped like utime's
+        """
+        return (self.now_us // 1000) & (TICKS_PERIOD - 1)
+
+    @staticmethod
+    def ticks_add(ticks, delta):
+        """!
+        @brief   Add a signed number to a tick value, wrapping as utime does.
+        """
+        return (ticks + delta) & (TICKS_PERIOD - 1)
+
+    @staticmethod
+    def ticks_diff(end, start):
+        """!
+        @brief   Find the signed difference between two tick values.
+        """
+        half = TICKS_PERIOD >> 1
+        return ((end - start + half) & (TICKS_PERIOD - 1)) - half
+
+    def sleep_us(self, usec):
+        """!
+        @brief   Sleep by moving the clock forward.
+        """
+        self.advance(usec)
+
+    def wfi(self, usec):
+        """!
+        @brief   Sleep until a timer ticks, as @c pyb.wfi() does, but for no
+                 longer than a given time.
+        @param   usec The longest time to sleep in microseconds
+        """
+        timer = self._next_timer(self.now_us + int(usec))
+        if timer is None:
+            self.advance(usec)
+        else:
+            self.now_us = timer.next_us
+            timer.fire()
+
+    def sleep_ms(self, msec):
+        """!
+        @brief   Sleep by moving the clock forward.
+        """
+        self.advance(msec * 1000)
+
+    def sleep(self, sec):
+        """!
+        @brief   Sleep by moving the clock forward.
+        """
+        self.advance(sec * 1000000)
+
+    def module(self, name="utime"):
+        """!
+        @brief   Make a module whose functions use this clock.
+        @param   name The name to give the module
+        @returns A module with the time functions of MicroPython's utime
+        """
+        mod = types.ModuleType(name)
+        for fun in ("ticks_us", "ticks_ms", "ticks_add", "ticks_diff",
+                    "sleep_us", "sleep_ms", "sleep"):
+            setattr(mod, fun, getattr(self, fun))
+        return mod
+
+
+class VirtualTimer:
+    """!
+    @brief   A stand-in for @c pyb.Timer which ticks on a @c VirtualClock.
+    @details Only the parts of @c pyb.Timer which set and read the timer's
+             rate and its callback are supplied. The prescaler and period
+             are worked out from the frequency as MicroPython does, so the
+             timer's period is rounded to a whole number of source clock
+             counts as a real timer's is. Only a timer with a callback is
+             run by the clock; the counter of one without is worked out from
+             the time when it's read.
+    """
+
+    def __init__(self, clock, num, freq=None, source_freq=TIMER_SOURCE_FREQ):
+        """!
+        @brief   Create a timer, starting it if a frequency is given.
+        @param   clock The @c VirtualClock which drives the timer
+        @param   num The number of the timer, kept only for display
+        @param   freq The frequency in Hz at which the timer ticks
+        @param   source_freq The frequency of the clock which feeds the timer
+        """
+        self.clock = clock
+        self.num = num
+        self._source_freq = source_freq
+        self._prescaler = 0
+        self._period = 0xFFFF
+        self._callback = None
+        ## The unwrapped time in microseconds at which the timer next ticks
+        self.next_us = None
+        if freq is not None:
+            self.init(freq=freq)
+
+    def init(self, freq):
+        """!
+        @brief   Start the timer ticking at a frequency.
+        @param   freq The frequency in Hz
+        """
+        counts = self._source_freq // freq
+        self._prescaler = (counts - 1) // 0x10000
+        self._period = counts // (self._prescaler + 1) - 1
+        self._start_us = self.clock.now_us
+        self._ticks = 0
+        self.next_us = self._tick_time(1)
+        self.callback(self._callback)
+
+    def deinit(self):
+        """!
+        @brief   Stop the timer and remove its callback.
+        """
+        self.callback(None)
+        self.next_us = None
+
+    def _tick_time(self, tick):
+        """!
+        @returns The unwrapped time in microseconds of a tick of the timer,
+                 counted from when it was started
+        """
+        return self._start_us + (tick * (self._prescaler + 1)
+                                 * (self._period + 1) * 1000000
+                                 // self._source_freq)
+
+    def fire(self):
+        """!
+        @brief   Run the callback for the tick which is due now.
+        """
+        self._ticks += 1
+        self.next_us = self._tick_time(self._ticks + 1)
+        if self._callback is not None:
+            self._callback(self)
+
+    def callback(self, fun):
+        """!
+        @brief   Set the function called at each tick, or @c None for none.
+        """
+        self._callback = fun
+        running = self in self.clock._timers
+        if fun is None or self.next_us is None:
+            if running:
+                self.clock._timers.remove(self)
+        elif not running:
+            # Skip the ticks which passed while the timer had no callback
+            self._ticks = ((self.clock.now_us - self._start_us)
+                           * self._source_freq // 1000000
+                           // ((self._prescaler + 1) * (self._period + 1)))
+            self.next_us = self._tick_time(self._ticks + 1)
+            self.clock._timers.append(self)
+
+    def freq(self):
+        """!
+        @returns The frequency at which the timer ticks, in Hz
+        """
+        return (self._source_freq
+                / ((self._prescaler + 1) * (self._period + 1)))
+
+    def prescaler(self):
+        """!
+        @returns The value in the timer's prescaler register
+        """
+        return self._prescaler
+
+    def period(self):
+        """!
+        @returns The value in the timer's period (auto-reload) register
+        """
+        return self._period
+
+    def source_freq(self):
+        """!
+        @returns The frequency in Hz of the clock which feeds the timer
+        """
+        return self._source_freq
+
+    def counter(self):
+        """!
+        @returns The count in the timer's counter register
+        """
+        counts = ((self.clock.now_us - self._start_us) * self._source_freq
+                  // 1000000 // (self._prescaler + 1))
+        return counts % (self._period + 1)
+
+    def __repr__(self):
+        return (f"VirtualTimer({self.num}, freq={self.freq()}, "
+                f"prescaler={self._prescaler}, period={self._period})")
+
+
+def _identity(fun):
+    """!
+    Stand-in for the MicroPython code emitter decorators, which on a PC
+    leave functions as they are.
+    """
+    return fun
+
+
+def _ptr8(buf):
+    """!
+    Stand-in for the viper code emitter's @c ptr8(), which on a PC gives a
+    view of a buffer's bytes which can be indexed and written.
+    """
+    return memoryview(buf).cast("B")
+
+
+def install(clock):
+    """!
+    @brief   Make the on-board modules importable on a PC using a clock.
+    @details Stand-ins for the @c utime and @c micropython modules are put
+             into @c sys.modules, and the on-board folder is put on the
+             module search path.
+    @param   clock The @c VirtualClock which will supply the time
+    """
+    sys.modules["utime"] = clock.module()
+
+    mp = types.ModuleType("micropython")
+    mp.native = _identity
+    mp.viper = _identity
+    mp.const = _identity
+    sys.modules["micropython"] = mp
+    builtins.ptr8 = _ptr8
+
+    import os
+    on_board = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            ON_BOARD)
+    if on_board not in sys.path:
+        sys.path.insert(0, on_board)